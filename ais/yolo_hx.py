@@ -7,6 +7,7 @@ sys.path.append("/home/hx/Yolov8-source/lib")
 
 from ais import libutil_bytetrack as bytetrack_util
 import libyolov8_trt as yolov8_trt
+from common.engine_pool import engine_pool
 import faulthandler
 
 faulthandler.enable()
@@ -41,6 +42,23 @@ Yolov8Detect类:
 '''
 
 
+YOLO_MODEL_PATH = '/home/hx/Yolov8-source/data/model/yolov8s-d-t-b8.trt'
+# trt引擎构建时的maxShapes为8x3x640x640
+YOLO_MAX_BATCH_SIZE = 8
+# 合并推理时引擎只使用这几种batch大小，不足时补齐到最近的一档，每种分辨率最多常驻len(YOLO_BATCH_SIZES)个引擎
+YOLO_BATCH_SIZES = (1, 4, YOLO_MAX_BATCH_SIZE)
+
+
+def padded_batch_size(image_num):
+    """
+    返回不小于image_num的最小一档batch大小，超过最大一档时返回最大一档
+    """
+    for batch_size in YOLO_BATCH_SIZES:
+        if image_num <= batch_size:
+            return batch_size
+    return YOLO_BATCH_SIZES[-1]
+
+
 def inference(img):
     yolov8_detector = init_yolo_detector(img)
 
@@ -55,25 +73,32 @@ def init_yolo_detector(img):
 
     print(f'config src_size = {config.src_width}x{config.src_height}')
     # 初始化推理模型
-    yolov8_detector = yolov8_trt.Yolov8Detect(config)
+    yolov8_detector = init_yolo_detector_by_config(config)
 
     return yolov8_detector
 
 
 def init_yolo_detector_by_config(config):
-    return yolov8_trt.Yolov8Detect(config)
+    # 从进程内的引擎池获取引擎，相同模型、分辨率和batch大小的引擎只会反序列化一次
+    key = (config.trtModelPath, config.src_width, config.src_height, config.batchSize)
+    return engine_pool.get(key, lambda: yolov8_trt.Yolov8Detect(config))
+
 
+def warm_up_yolo_detector(src_width, src_height, batch_size=1):
+    # 提前把引擎反序列化到引擎池中，供热进程池中的进程使用
+    init_yolo_detector_by_config(init_yolo_detector_config(src_width, src_height, batch_size))
 
-def init_yolo_detector_config(src_width, src_height):
+
+def init_yolo_detector_config(src_width, src_height, batch_size=1):
     # 配置文件参数定义
     config = yolov8_trt.Yolov8Config()
     config.nmsThresh = 0.5
     config.objThresh = 0.45
 
-    config.trtModelPath = '/home/hx/Yolov8-source/data/model/yolov8s-d-t-b8.trt'
-    config.maxBatchSize = 8
+    config.trtModelPath = YOLO_MODEL_PATH
+    config.maxBatchSize = YOLO_MAX_BATCH_SIZE
 
-    config.batchSize = 1
+    config.batchSize = min(batch_size, YOLO_MAX_BATCH_SIZE)
 
     config.src_width = src_width
     config.src_height = src_height
@@ -82,15 +107,38 @@ def init_yolo_detector_config(src_width, src_height):
 
 
 def inference_by_yolo_detector(yolo_detector, img):
-    # 调用推理api进行推理
-    input_images = []
-    for i in range(9):
-        input_images.append(img)
-    results = yolo_detector.inference(input_images)
+    # 调用推理api进行推理，单张图像只推理一次
+    input_images = [img]
+    results = inference_batch(yolo_detector, input_images)
 
     return results, input_images
 
 
+def inference_batch(yolo_detector, frames, batch_size=None):
+    """
+    把多张不同的图像（例如视频中连续的若干帧）作为一个batch推理，返回与frames一一对应的推理结果。
+
+    batch_size为引擎配置的batch大小，frames不足batch_size时（例如视频的最后一批帧）用最后一帧补齐，
+    补齐部分的结果会被丢弃；不传batch_size时按frames的实际数量推理，不做补齐
+    """
+    input_images = list(frames)
+    if batch_size is not None and 0 < len(input_images) < batch_size:
+        input_images += [input_images[-1]] * (batch_size - len(input_images))
+    results = yolo_detector.inference(input_images)
+    return results[:len(frames)]
+
+
+def batch_inference(images):
+    """
+    同一分辨率的多张图像合并为一次引擎调用，返回与images一一对应的推理结果。
+    images的数量补齐到YOLO_BATCH_SIZES中的一档，而不是每种数量各创建一个引擎，images不能超过YOLO_MAX_BATCH_SIZE张
+    """
+    batch_size = padded_batch_size(len(images))
+    config = init_yolo_detector_config(images[0].shape[1], images[0].shape[0], batch_size=batch_size)
+    yolov8_detector = init_yolo_detector_by_config(config)
+    return inference_batch(yolov8_detector, images, batch_size)
+
+
 def parse_results(results):
     parsed = []
     # 获取输出结果
@@ -156,6 +204,34 @@ def draw_track_results(input_images, yolo_rects, save_path=None):
         cv2.imwrite(save_path, input_images[0])
 
 
+def yolo_rects_to_json(yolo_rects):
+    json_items = []
+    for yolo_rect in yolo_rects:
+        json_item = {
+            'xmin': yolo_rect.xmin,
+            'ymin': yolo_rect.ymin,
+            'w': yolo_rect.w,
+            'h': yolo_rect.h,
+            'label': yolo_rect.label,
+            'score': yolo_rect.score,
+            'track_id': yolo_rect.track_id,
+        }
+        json_items.append(json_item)
+    return json_items
+
+
+def draw_json_items(image, json_items):
+    # 根据json格式的结果在图像上绘制矩形框，带有track_id时一并绘制
+    for json_item in json_items:
+        xmin, ymin, w, h = json_item['xmin'], json_item['ymin'], json_item['w'], json_item['h']
+        cv2.rectangle(image, (int(xmin), int(ymin)), (int(xmin + w), int(ymin + h)), (0, 255, 0), 2)
+        label_text = f"cls{int(json_item['label'])} conf{json_item['score']:.2f}"
+        if 'track_id' in json_item:
+            label_text += f" track_id{int(json_item['track_id'])}"
+        cv2.putText(image, label_text, (int(xmin), int(ymin) - 5), cv2.FONT_HERSHEY_SIMPLEX, 0.5,
+                    (0, 255, 0), 2)
+
+
 def convert_parsed_to_yolo_rect(parsed):
     yolo_rects = []
     for parse_item in parsed:
@@ -6,7 +6,8 @@ from cgi.manage import model_manage_bp
 from cgi.monitor import monitor_bp
 from cgi.object_storage import object_storage_bp
 from cgi.recognition import recognition_bp
-from cgi.singleton import socketio
+from cgi.singleton import socketio, namespace_registry, channel_subscriber
+from cgi.socketio_namespace import DynamicNamespace
 from cgi.track import track_bp
 from cgi.user import user_bp
 from common.config import config
@@ -26,7 +27,12 @@ def create_app():
     flaskApp.register_blueprint(object_storage_bp)
     flaskApp.register_blueprint(monitor_bp)
 
-    socketio.init_app(flaskApp, cors_allowed_origins='*')
+    # 配置了消息队列时，多个网关进程可以通过消息队列向任意一个进程上的客户端发送消息
+    message_queue = config.get("socketio_message_queue") or None
+    socketio.init_app(flaskApp, cors_allowed_origins='*', message_queue=message_queue)
+    # 前端可能连接到任意一个网关进程，每个进程都要注册其他进程创建的namespace
+    namespace_registry.start(DynamicNamespace.from_info)
+    channel_subscriber.start()
 
     CORS(flaskApp)
     return flaskApp
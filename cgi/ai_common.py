@@ -3,32 +3,26 @@ from datetime import datetime
 
 from flask import g, request
 
-from cgi.singleton import socketio, rpc
+from cgi.singleton import rpc, redis_client, namespace_registry
 from common.api_response import APIResponse
-from common.error_code import ErrorCodeEnum
+from common.dispatch import dispatch_call
+from common.task_state import update_task_state, STATE_QUEUED, STATE_FAILED
 from model.support_input import CAMERA_TYPE, VIDEO_URL_TYPE
 
 
-def default_busy_check_function(output):
-    return output['busy']
+def recall(service_name, json_data):
+    # 请求放入服务的共享分派队列，由空闲的实例拉取执行，无空闲或无在线实例时抛出DispatchError
+    return dispatch_call(redis_client, service_name, json_data)
 
 
-def recall(call_function, busy_check_function, json_data, max_call_times=10):
-    # 因为我们无法指定nameko要调用的rpc实例，所以这里使用重复调用的方法轮询到空闲的实例
-    call_cnt = 0
-    output = call_function(json_data)
-    while busy_check_function(output):
-        output = call_function(json_data)
-        call_cnt += 1
-        if call_cnt >= max_call_times:
-            return None
-    return output
-
-
-def async_call(call_function, busy_check_function, json_data, namespace, dynamicNamespace, max_call_times=10):
-    output = recall(call_function, busy_check_function, json_data, max_call_times)
-    if output is None:
-        return APIResponse.fail_with_error_code_enum(ErrorCodeEnum.SERVICE_BUSY_ERROR).flask_response()
+def async_call(service_name, json_data, namespace, dynamicNamespace):
+    task_id = dynamicNamespace.unique_id
+    update_task_state(redis_client, task_id, STATE_QUEUED, service_name=service_name, source=dynamicNamespace.source)
+    try:
+        output = recall(service_name, json_data)
+    except Exception as e:
+        update_task_state(redis_client, task_id, STATE_FAILED, error=str(e))
+        raise
     if type(output) == str:
         service_unique_id = json.loads(output)['unique_id']
     elif type(output) == dict:
@@ -37,10 +31,24 @@ def async_call(call_function, busy_check_function, json_data, namespace, dynamic
         raise ValueError("output type error")
     dynamicNamespace.service_unique_id = service_unique_id
     insert_task(dynamicNamespace.unique_id, dynamicNamespace.source)
-    socketio.on_namespace(dynamicNamespace)
+    # 在所有网关进程上注册，前端连接到任意一个进程都能进入该namespace
+    namespace_registry.register(dynamicNamespace)
     return APIResponse.success_with_data(namespace).flask_response()
 
 
+def query_result():
+    """
+    按帧范围或时间分页查询视频和摄像头任务的结果
+    """
+    task_id = request.args.get('taskId', default="", type=str)
+    start_frame = request.args.get('start', default=0, type=int)
+    end_frame = request.args.get('end', default=None, type=int)
+    start_time = request.args.get('startTime', default=None, type=float)
+    page_size = request.args.get('pageSize', default=None, type=int)
+    result = rpc.result_service.get_result(task_id, start_frame, end_frame, start_time, page_size)
+    return APIResponse.success_with_data(result).flask_response()
+
+
 def if_async_call_type(json_data):
     return json_data['supportInput']['type'] in [CAMERA_TYPE, VIDEO_URL_TYPE]
 
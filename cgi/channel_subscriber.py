@@ -0,0 +1,56 @@
+"""
+网关进程共享的redis订阅。
+
+每个网关进程只有一个订阅连接，以pattern订阅所有摄像头结果channel和视频进度channel，在一个后台任务中阻塞等待消息，
+再按channel把消息交给本进程上对应namespace注册的回调；本进程没有对应namespace的消息直接丢弃。
+没有消息时后台任务阻塞在连接上，不再为每个namespace单独轮询
+"""
+from typing import Callable, Dict
+
+from flask_socketio import SocketIO
+
+from common.camera_channel import camera_channel_key
+from common.config import config
+from common.log import LOGGER
+from common.progress_publisher import progress_channel_key
+
+CHANNEL_PATTERNS = [camera_channel_key('*'), progress_channel_key('*')]
+
+
+class ChannelSubscriber:
+
+    def __init__(self, socketio: SocketIO, redis_client):
+        self.socketio = socketio
+        self.redis_client = redis_client
+        self.handlers: Dict[str, Callable[[bytes], None]] = {}
+        self.listen_task = None
+
+    def start(self):
+        if self.listen_task is None:
+            self.listen_task = self.socketio.start_background_task(self._listen)
+
+    def subscribe(self, channel, handler: Callable[[bytes], None]):
+        self.handlers[channel] = handler
+
+    def unsubscribe(self, channel):
+        self.handlers.pop(channel, None)
+
+    def _listen(self):
+        pubsub = self.redis_client.pubsub(ignore_subscribe_messages=True)
+        pubsub.psubscribe(*CHANNEL_PATTERNS)
+        # 阻塞等待的超时只用于定期检查连接，不影响消息的转发延迟
+        listen_timeout = config.get("socketio_channel_listen_timeout", 1)
+        try:
+            while True:
+                message = pubsub.get_message(timeout=listen_timeout)
+                if message is None:
+                    continue
+                handler = self.handlers.get(message['channel'].decode('utf-8'))
+                if handler is None:
+                    continue
+                try:
+                    handler(message['data'])
+                except Exception as e:
+                    LOGGER.error(f"handle channel message failed: {message['channel']}, error: {e}")
+        finally:
+            pubsub.close()
@@ -1,3 +1,8 @@
+import eventlet
+
+# socketio以eventlet方式运行，订阅redis channel的阻塞读取需要让出执行权，使用消息队列时同样需要
+eventlet.monkey_patch()
+
 import multiprocessing
 import time
 from datetime import datetime
@@ -12,6 +17,7 @@ from cgi import app
 from cgi.singleton import rpc, socketio, enforcer
 from common import config
 from common.api_response import APIResponse
+from common.dispatch import DispatchError
 from common.error_code import ErrorCodeEnum
 from common.log import LOGGER
 from common.util import decode_jwt
@@ -94,6 +100,12 @@ def after_request(response):
     return response
 
 
+@app.errorhandler(DispatchError)
+def handle_dispatch_error(error: DispatchError):
+    LOGGER.warning("dispatch error: %s", error)
+    return APIResponse.fail_with_error_code_enum(error.error_code_enum).flask_response()
+
+
 @app.errorhandler(Exception)
 def handle_error(error):
     LOGGER.error("error: %s", error, exc_info=True)
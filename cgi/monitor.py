@@ -1,9 +1,12 @@
 from flask import request, Blueprint
 
 from common.api_response import APIResponse
+from common.camera_backpressure import get_fps_from_redis
+from common.latency_recorder import get_latency_from_redis
+from common.task_state import get_task_states, list_active_tasks
 from model.request_log import RequestLog
 from model.statistics import Statistics
-from .singleton import rpc, register_route
+from .singleton import rpc, register_route, redis_client
 
 url_prefix = "/monitor"
 monitor_bp = Blueprint('monitor', __name__, url_prefix=url_prefix)
@@ -70,3 +73,35 @@ def get_chart():
     end_time = request.args.get('endTime', default=0, type=int)
     chart_data = rpc.monitor_service.get_chart(start_time, end_time)
     return APIResponse.success_with_data(chart_data).flask_response()
+
+
+@monitor_bp.route('/latency', methods=['GET'])
+@register_route(url_prefix + "/latency", "获取摄像头任务各阶段延迟", "GET")
+def get_latency():
+    task_id = request.args.get('taskId', default="", type=str)
+    latency = get_latency_from_redis(redis_client, task_id + "_latency")
+    return APIResponse.success_with_data(latency).flask_response()
+
+
+@monitor_bp.route('/camera_fps', methods=['GET'])
+@register_route(url_prefix + "/camera_fps", "获取摄像头任务的视频源帧率和有效帧率", "GET")
+def get_camera_fps():
+    task_id = request.args.get('taskId', default="", type=str)
+    camera_fps = get_fps_from_redis(redis_client, task_id)
+    return APIResponse.success_with_data(camera_fps).flask_response()
+
+
+@monitor_bp.route('/tasks', methods=['GET'])
+@register_route(url_prefix + "/tasks", "批量获取异步任务的状态", "GET")
+def get_tasks():
+    task_ids = [task_id for task_id in request.args.get('taskIds', default="", type=str).split(',') if task_id]
+    task_states = get_task_states(redis_client, task_ids)
+    return APIResponse.success_with_data(task_states).flask_response()
+
+
+@monitor_bp.route('/active_tasks', methods=['GET'])
+@register_route(url_prefix + "/active_tasks", "获取未结束的异步任务", "GET")
+def get_active_tasks():
+    service_name = request.args.get('serviceName', default="", type=str)
+    tasks = list_active_tasks(redis_client, service_name if service_name else None)
+    return APIResponse.success_with_data(tasks).flask_response()
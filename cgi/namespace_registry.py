@@ -0,0 +1,104 @@
+"""
+动态namespace在所有网关worker上的注册。
+
+namespace由处理调用请求的worker创建，而前端的socketio连接可能被负载均衡到其他worker上，
+python-socketio会拒绝连接本进程没有注册的namespace。因此创建namespace时把构造参数写入redis hash，
+并在channel上广播created消息，每个worker订阅该channel后在本地注册同样的namespace；
+worker启动时先从hash加载已有的namespace，namespace结束时广播removed消息，各worker同时删除
+"""
+import json
+import time
+from typing import Callable
+
+from flask_socketio import Namespace, SocketIO
+
+from common.config import config
+from common.log import LOGGER
+
+NAMESPACE_REGISTRY_KEY = "socketio_namespaces"
+NAMESPACE_CHANNEL = "socketio_namespace_channel"
+ACTION_CREATED = 'created'
+ACTION_REMOVED = 'removed'
+
+
+class NamespaceRegistry:
+    """
+    namespace_factory根据namespace_handler.to_info()的返回值在其他worker上重新创建namespace_handler
+    """
+
+    def __init__(self, socketio: SocketIO, redis_client):
+        self.socketio = socketio
+        self.redis_client = redis_client
+        self.namespace_factory: Callable[[dict], Namespace] = None
+        self.listen_task = None
+
+    def start(self, namespace_factory: Callable[[dict], Namespace]):
+        self.namespace_factory = namespace_factory
+        if self.listen_task is None:
+            self.listen_task = self.socketio.start_background_task(self._listen)
+
+    def register(self, namespace_handler):
+        info = namespace_handler.to_info()
+        self.socketio.on_namespace(namespace_handler)
+        pipeline = self.redis_client.pipeline()
+        pipeline.hset(NAMESPACE_REGISTRY_KEY, namespace_handler.namespace,
+                      json.dumps({'info': info, 'created_at': time.time()}))
+        pipeline.publish(NAMESPACE_CHANNEL, json.dumps({'action': ACTION_CREATED, 'info': info}))
+        pipeline.execute()
+
+    def remove(self, namespace):
+        self._remove_local(namespace)
+        pipeline = self.redis_client.pipeline()
+        pipeline.hdel(NAMESPACE_REGISTRY_KEY, namespace)
+        pipeline.publish(NAMESPACE_CHANNEL, json.dumps({'action': ACTION_REMOVED, 'namespace': namespace}))
+        pipeline.execute()
+
+    def _listen(self):
+        pubsub = self.redis_client.pubsub(ignore_subscribe_messages=True)
+        # 先订阅再加载，加载期间创建的namespace不会遗漏
+        pubsub.subscribe(NAMESPACE_CHANNEL)
+        self._load_existing()
+        listen_timeout = config.get("socketio_channel_listen_timeout", 1)
+        try:
+            while True:
+                message = pubsub.get_message(timeout=listen_timeout)
+                if message is None:
+                    continue
+                try:
+                    self._handle_message(json.loads(message['data']))
+                except Exception as e:
+                    LOGGER.error(f"handle namespace message failed: {e}")
+        finally:
+            pubsub.close()
+
+    def _load_existing(self):
+        ttl = config.get("socketio_namespace_ttl", 86400)
+        expired = []
+        for namespace, value in self.redis_client.hgetall(NAMESPACE_REGISTRY_KEY).items():
+            entry = json.loads(value)
+            if time.time() - entry['created_at'] > ttl:
+                # 网关异常退出时没有广播removed，过期的namespace顺便删除
+                expired.append(namespace)
+                continue
+            self._register_local(entry['info'])
+        if len(expired) > 0:
+            self.redis_client.hdel(NAMESPACE_REGISTRY_KEY, *expired)
+
+    def _handle_message(self, message):
+        if message['action'] == ACTION_CREATED:
+            self._register_local(message['info'])
+        elif message['action'] == ACTION_REMOVED:
+            self._remove_local(message['namespace'])
+
+    def _register_local(self, info):
+        # 创建namespace的worker自己也会收到广播，已经注册的namespace不再重复创建
+        if info['namespace'] in self._namespace_handlers():
+            return
+        self.socketio.on_namespace(self.namespace_factory(info))
+        LOGGER.info(f"namespace registered from other worker: {info['namespace']}")
+
+    def _remove_local(self, namespace):
+        self._namespace_handlers().pop(namespace, None)
+
+    def _namespace_handlers(self):
+        return self.socketio.server.namespace_handlers
@@ -1,6 +1,7 @@
-from flask import request, Blueprint
+from flask import request, Blueprint, Response
 
 from common.api_response import APIResponse
+from common.error_code import ErrorCodeEnum
 from .singleton import rpc, register_route
 
 url_prefix = "/object_storage"
@@ -21,3 +22,21 @@ def get_url():
     object_name = request.args.get("objectName")
     url = rpc.object_storage_service.get_object_url(object_name)
     return APIResponse.success_with_data(url).to_dict()
+
+
+@object_storage_bp.route('/progressive_playlist', methods=['GET'])
+@register_route(url_prefix + "/progressive_playlist", "获取视频任务处理过程中的HLS播放列表", "GET")
+def get_progressive_playlist():
+    task_id = request.args.get("taskId", default="", type=str)
+    playlist = rpc.result_service.get_progressive_playlist(task_id)
+    if playlist is None:
+        return APIResponse.fail_with_error_code_enum(ErrorCodeEnum.RESULT_NOT_READY_ERROR).flask_response()
+    return Response(playlist, mimetype="application/vnd.apple.mpegurl")
+
+
+@object_storage_bp.route('/progressive_results', methods=['GET'])
+@register_route(url_prefix + "/progressive_results", "获取视频任务处理过程中的结果分块", "GET")
+def get_progressive_results():
+    task_id = request.args.get("taskId", default="", type=str)
+    results = rpc.result_service.get_progressive_results(task_id)
+    return APIResponse.success_with_data(results).flask_response()
@@ -1,20 +1,15 @@
 from flask import request, Blueprint
 
 from common.api_response import APIResponse
-from common.error_code import ErrorCodeEnum
 from model.cls_result import ClsResult
-from .ai_common import recall, async_call, if_async_call_type, default_busy_check_function
-from .singleton import rpc, register_route
+from .ai_common import query_result, recall, async_call, if_async_call_type
+from .singleton import register_route
 from .socketio_namespace import DynamicNamespace
 
 url_prefix = "/model/recognition"
 recognition_bp = Blueprint('recognition', __name__, url_prefix=url_prefix)
 
 
-def call_function(json_data):
-    return rpc.recognition_service.call(json_data)
-
-
 @recognition_bp.route('/call', methods=['POST'])
 @register_route(url_prefix + "/call", "调用分类服务", "POST")
 def call():
@@ -25,11 +20,9 @@ def call():
                                             service_name="recognition_service",
                                             source=source)
         json_data = dynamicNamespace.set_json_data(json_data)
-        return async_call(call_function, default_busy_check_function, json_data, namespace, dynamicNamespace)
+        return async_call("recognition_service", json_data, namespace, dynamicNamespace)
     else:
-        output_dict: dict = recall(call_function, default_busy_check_function, json_data)
-        if output_dict is None:
-            return APIResponse.fail_with_error_code_enum(ErrorCodeEnum.SERVICE_BUSY_ERROR).flask_response()
+        output_dict: dict = recall("recognition_service", json_data)
         data = {
             'frames': output_dict['frames'],
             'logs': output_dict['logs'],
@@ -40,3 +33,9 @@ def call():
         else:
             response = APIResponse.success_with_data(data)
         return response.flask_response()
+
+
+@recognition_bp.route('/result', methods=['GET'])
+@register_route(url_prefix + "/result", "获取识别任务的结果", "GET")
+def result():
+    return query_result()
@@ -4,9 +4,16 @@ import casbin
 from flask_nameko import FlaskPooledClusterRpcProxy
 from flask_socketio import SocketIO
 
+from cgi.channel_subscriber import ChannelSubscriber
+from cgi.namespace_registry import NamespaceRegistry
+from common.util import create_redis_client
+
 rpc = FlaskPooledClusterRpcProxy()
 rpc_before_time = datetime.now()
 socketio = SocketIO()
+redis_client = create_redis_client()
+namespace_registry = NamespaceRegistry(socketio, redis_client)
+channel_subscriber = ChannelSubscriber(socketio, redis_client)
 
 enforcer = casbin.Enforcer("model.conf", "policy.csv")
 enforcer.enable_auto_save(True)
@@ -1,13 +1,19 @@
 import time
 import uuid
-from datetime import timedelta
-from typing import Union
+from typing import Dict
 
 from flask import request
 from flask_socketio import Namespace
 
-from cgi.singleton import rpc
+from cgi.singleton import rpc, namespace_registry, channel_subscriber
+from common.camera_backpressure import BackpressureAdjuster, ViewerWindow, flush_fps
+from common.camera_channel import camera_channel_key, unpack_camera_message
+from common.camera_codec import CameraDataFormat, is_delta_payload
+from common.config import config
+from common.latency_recorder import LatencyRecorder
 from common.log import LOGGER
+from common.progress_publisher import progress_channel_key, unpack_progress_message, PROGRESS_EVENT, DONE_EVENT
+from common.task_state import get_task_state, request_task_stop, TERMINAL_STATES
 from common.util import get_log_from_redis, create_redis_client
 from microservice.mqtt_storage import MQTTStorage
 from model.support_input import VIDEO_URL_TYPE, CAMERA_TYPE
@@ -23,7 +29,6 @@ class DynamicNamespace(Namespace):
         self.source: str = source if source else VIDEO_URL_TYPE
         self.service_name: str = service_name
         self.unique_id: str = unique_id
-        self.stop_signal_key: str = unique_id + "_stop"
         self.queue_name: str = unique_id + "_queue_name"
         self.service_unique_id = service_unique_id
         self.log_key = unique_id + "_log"
@@ -32,57 +37,178 @@ class DynamicNamespace(Namespace):
         self.mqtt_storage = MQTTStorage()
         self.consumer_id = None
         self.producer_id = None
+        # 网关转发摄像头数据的延迟，与摄像头进程的各阶段延迟写入同一个hash
+        self.latency_recorder = LatencyRecorder()
+        self.latency_key = unique_id + "_latency"
+        self.latency_flush_interval = config.get("latency_flush_interval", 5)
+        self.last_latency_flush_time = time.time()
+        # 前端协商的camera_data格式，默认json，二进制格式的数据由网关原样转发
+        self.camera_data_format = CameraDataFormat.JSON.value
+        # 同一个namespace的所有观看者加入同一个room，共享同一路摄像头的推理结果
+        self.viewers_room = unique_id + "_viewers"
+        # 每个观看者的确认窗口，前端通过set_camera_ack_window开启确认后才做流控
+        self.viewer_windows: Dict[str, ViewerWindow] = {}
+        self.backpressure_adjuster = BackpressureAdjuster(self.redis_client, unique_id)
+        # 摄像头结果和视频进度都通过网关进程共享的订阅转发，见ChannelSubscriber
+        self.camera_channel = camera_channel_key(unique_id)
+        self.camera_subscribed = False
+        # 视频任务的进度由网关订阅redis channel后主动推送，最新的进度缓存在内存中，用于应答仍在轮询的前端
+        self.progress_channel = progress_channel_key(unique_id)
+        self.progress_subscribed = False
+        self.latest_progress = None
+        self.video_done_data = None
+
+    def to_info(self):
+        """
+        其他网关进程重新创建该namespace所需的参数，见NamespaceRegistry
+        """
+        return {
+            'namespace': self.namespace,
+            'unique_id': self.unique_id,
+            'service_unique_id': self.service_unique_id,
+            'service_name': self.service_name,
+            'source': self.source,
+        }
+
+    @staticmethod
+    def from_info(info):
+        return DynamicNamespace(info['namespace'], info['unique_id'], info['service_unique_id'],
+                                info['service_name'], info['source'])
 
     def set_json_data(self, json_data):
         json_data['taskId'] = self.unique_id
         json_data['namespace'] = self.namespace
         if self.source == CAMERA_TYPE:
-            json_data['stopSignalKey'] = self.stop_signal_key
             json_data['queueName'] = self.queue_name
             json_data['logKey'] = self.log_key
         elif self.source == VIDEO_URL_TYPE:
-            json_data['stopSignalKey'] = self.stop_signal_key
             json_data['logKey'] = self.log_key
             json_data['videoProgressKey'] = self.video_progress_key
         return json_data
 
     def on_connect(self):
-        LOGGER.info(f'Client connected to namespace: {self.namespace}, stop_key = {self.stop_signal_key}')
+        LOGGER.info(f'Client connected to namespace: {self.namespace}, task_id = {self.unique_id}')
+        if self.source == VIDEO_URL_TYPE and not self.progress_subscribed:
+            self.progress_subscribed = True
+            channel_subscriber.subscribe(self.progress_channel, self.relay_progress_message)
+            # 订阅之前任务可能已经产生了进度和日志，先补发一次当前状态
+            self.emit_progress_snapshot()
+            if self.video_done_data is not None:
+                channel_subscriber.unsubscribe(self.progress_channel)
+
+    def relay_progress_message(self, message):
+        """
+        把视频任务发布的进度、日志和完成事件推送给前端，任务完成后取消订阅
+        """
+        if self.video_done_data is not None:
+            return
+        event, data = unpack_progress_message(message)
+        if event == PROGRESS_EVENT:
+            self.latest_progress = data
+        elif event == DONE_EVENT:
+            self.video_done_data = data
+            channel_subscriber.unsubscribe(self.progress_channel)
+            LOGGER.info(f'emit video_task_done event, task_id: {self.unique_id}')
+        self.emit(event=event, namespace=self.namespace, data=data)
 
     def on_post_consumer_id(self):
         self.consumer_id = request.sid
-        LOGGER.info(f'sid received on post_consumer_id: {self.consumer_id}')
+        self.viewer_windows.setdefault(request.sid, ViewerWindow())
+        self.enter_room(request.sid, self.viewers_room)
+        LOGGER.info(f'sid received on post_consumer_id: {self.consumer_id}, viewers: {len(self.viewer_windows)}')
+        if self.source == CAMERA_TYPE and not self.camera_subscribed:
+            # 配置了socketio消息队列时，观看者可以连接在任意一个网关进程上
+            self.camera_subscribed = True
+            channel_subscriber.subscribe(self.camera_channel, self.relay_camera_message)
+
+    def relay_camera_message(self, message):
+        payload, emit_timestamp = unpack_camera_message(message)
+        self.relay_camera_data(payload, emit_timestamp)
 
     def on_post_producer_id(self):
         self.producer_id = request.sid
         LOGGER.info(f'sid received on post_producer_id: {self.producer_id}')
 
     def on_progress_retrieve(self, data):
+        if not self.progress_subscribed:
+            self.emit_progress_snapshot()
+            return
+        # 进度已经由订阅推送，轮询直接使用缓存的状态应答，不再访问redis
+        if self.video_done_data is not None:
+            self.emit(event='video_task_done', namespace=self.namespace, data=self.video_done_data)
+        else:
+            self.emit(event='progress_data', namespace=self.namespace,
+                      data=self.latest_progress if self.latest_progress else '0.00')
+
+    def emit_progress_snapshot(self):
         client = self.redis_client
         logs = get_log_from_redis(client, self.log_key)
         if logs and len(logs) > 0:
             self.emit(event='video_log', namespace=self.namespace, data=logs)
-        task_done = client.hlen(self.unique_id) == 2
-        if task_done:
-            video_url = client.hget(name=self.unique_id, key="video_url").decode('utf-8')
-            json_url = client.hget(name=self.unique_id, key="json_url").decode('utf-8')
-            self.emit(event='video_task_done', namespace=self.namespace, data=[video_url, json_url])
+        # 状态、进度和结果地址都在任务状态记录中，一次读取
+        task_state = get_task_state(client, self.unique_id) or {}
+        if task_state.get('state') in TERMINAL_STATES and 'json_url' in task_state:
+            self.video_done_data = [task_state['video_url'], task_state['json_url']]
+            self.emit(event='video_task_done', namespace=self.namespace, data=self.video_done_data)
             LOGGER.info(f'emit video_task_done event, task_id: {self.unique_id}')
         else:
-            progress: Union[bytes, None] = client.get(self.video_progress_key)
-            if progress:
-                self.emit(event='progress_data', namespace=self.namespace, data=progress.decode('utf-8'))
-            else:
-                self.emit(event='progress_data', namespace=self.namespace, data='0.00')
+            self.latest_progress = task_state.get('progress')
+            self.emit(event='progress_data', namespace=self.namespace,
+                      data=self.latest_progress if self.latest_progress else '0.00')
 
     def on_log(self, data):
-        self.emit(event='log', data=data, room=self.consumer_id, namespace=self.namespace)
+        self.emit(event='log', data=data, room=self.viewers_room, namespace=self.namespace)
 
     def on_camera_retrieve(self):
         self.emit('camera_retrieve', room=self.producer_id, namespace=self.namespace)
 
-    def on_camera_data(self, data):
-        self.emit(event='camera_data', data=data, room=self.consumer_id, namespace=self.namespace)
+    def on_camera_data(self, data, emit_timestamp=None):
+        # 兼容仍然通过socketio连接发送结果的摄像头脚本
+        self.relay_camera_data(data, emit_timestamp)
+
+    def relay_camera_data(self, data, emit_timestamp=None):
+        receive_time = time.time()
+        if emit_timestamp:
+            # 摄像头进程发送到网关收到之间的延迟，摄像头进程与网关不在同一台机器时包含两者的时钟偏差
+            self.latency_recorder.record('relay', receive_time * 1000 - emit_timestamp)
+        is_delta = is_delta_payload(data)
+        viewer_windows = list(self.viewer_windows.items())
+        for viewer_id, viewer_window in viewer_windows:
+            if not viewer_window.acquire(is_delta):
+                continue
+            # 开启确认的观看者收到数据后回调确认，释放窗口中的位置
+            callback = (lambda *args, window=viewer_window: window.ack()) if viewer_window.window_size > 0 else None
+            self.emit(event='camera_data', data=data, room=viewer_id, namespace=self.namespace, callback=callback)
+        forward_time = time.time()
+        self.latency_recorder.record_interval('gateway_emit', receive_time, forward_time)
+        self.backpressure_adjuster.adjust([viewer_window for _, viewer_window in viewer_windows])
+        if forward_time - self.last_latency_flush_time >= self.latency_flush_interval:
+            self.last_latency_flush_time = forward_time
+            self.latency_recorder.flush(self.redis_client, self.latency_key)
+            # 送达帧率取最慢的观看者
+            delivered_fps = [viewer_window.delivered.take() for _, viewer_window in viewer_windows]
+            if len(delivered_fps) > 0:
+                flush_fps(self.redis_client, self.unique_id, {'delivered_fps': min(delivered_fps)})
+
+    def on_set_camera_ack_window(self, window_size):
+        """
+        前端开启确认窗口，之后每收到一条camera_data都需要调用确认回调
+        """
+        window_size = max(int(window_size), 0)
+        self.viewer_windows[request.sid] = ViewerWindow(window_size)
+        LOGGER.info(f'camera ack window: {window_size}, sid: {request.sid}')
+
+    def on_set_camera_data_format(self, camera_data_format):
+        if camera_data_format not in [data_format.value for data_format in CameraDataFormat]:
+            LOGGER.error(f"unsupported camera data format: {camera_data_format}")
+            return
+        self.camera_data_format = camera_data_format
+        # 广播给摄像头进程和前端，摄像头进程之后发送的数据使用新的格式
+        self.emit(event='camera_data_format', data=camera_data_format, namespace=self.namespace)
+
+    def on_camera_data_format_retrieve(self):
+        self.emit(event='camera_data_format', data=self.camera_data_format, room=request.sid,
+                  namespace=self.namespace)
 
     def on_time_sync_request(self):
         self.emit(event='time_sync', data=int(time.time() * 1000), room=self.consumer_id, namespace=self.namespace)
@@ -90,25 +216,30 @@ class DynamicNamespace(Namespace):
     def on_stop_camera(self):
         LOGGER.info(f"{self.namespace} stop camera...")
         self.emit(event='stop_camera', room=self.producer_id, namespace=self.namespace)
-        rpc.manage_service.change_state_to_ready(self.service_name, self.service_unique_id)
+        rpc.manage_service.change_state_to_ready(self.service_name, self.service_unique_id, self.unique_id)
 
     def clear_video_resource(self):
+        channel_subscriber.unsubscribe(self.progress_channel)
         pipeline = self.redis_client.pipeline()
-        pipeline.set(self.stop_signal_key, "1", ex=timedelta(seconds=60))
+        request_task_stop(pipeline, self.unique_id)
         pipeline.delete(self.log_key)
-        pipeline.expire(self.log_key, time=timedelta(seconds=60))
-        pipeline.delete(self.video_progress_key)
-        pipeline.expire(self.video_progress_key, time=timedelta(seconds=60))
         pipeline.execute()
-        rpc.manage_service.change_state_to_ready(self.service_name, self.service_unique_id)
+        rpc.manage_service.change_state_to_ready(self.service_name, self.service_unique_id, self.unique_id)
 
     def on_disconnect(self):
         LOGGER.info(f'Client disconnected from namespace: {self.namespace}')
         if self.source == VIDEO_URL_TYPE:
             self.clear_video_resource()
         elif self.source == CAMERA_TYPE:
+            self.viewer_windows.pop(request.sid, None)
+            if len(self.viewer_windows) > 0:
+                # 还有其他观看者，摄像头继续推理
+                LOGGER.info(f'viewer left namespace: {self.namespace}, viewers: {len(self.viewer_windows)}')
+                return
+            channel_subscriber.unsubscribe(self.camera_channel)
             self.on_stop_camera()
-        self.socketio.server.namespace_handlers.pop(self.namespace)
+        # 任务结束，所有网关进程上的namespace一起删除
+        namespace_registry.remove(self.namespace)
 
     @staticmethod
     def init_parameter(json_data):
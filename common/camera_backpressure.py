@@ -0,0 +1,200 @@
+"""
+摄像头结果发送的背压控制。
+
+网关为每个开启了确认窗口的观看者维护已发送未确认的消息数，超过窗口的帧不再发送给该观看者；
+某个观看者丢帧时提高背压等级，所有观看者都空闲一段时间后降低等级，等级写入redis hash。
+摄像头进程定期读取背压等级，等级为n时每2^n帧只发送一帧，同时降低预览帧的jpg质量，被跳过的帧不经过编码，
+因此二进制格式的差分编码不受影响；网关对单个观看者丢帧后，该观看者只能从关键帧恢复，
+网关会在hash中请求摄像头进程尽快发送关键帧。
+
+视频源帧率、摄像头进程发送帧率和网关送达帧率写入同一个hash，用于比较有效帧率和视频源帧率
+"""
+import time
+from datetime import timedelta
+
+from common.config import config
+
+LEVEL_FIELD = 'level'
+KEYFRAME_FIELD = 'keyframe'
+
+
+def camera_backpressure_key(task_id):
+    return task_id + "_camera_backpressure"
+
+
+def camera_fps_key(task_id):
+    return task_id + "_camera_fps"
+
+
+class FpsCounter:
+    """
+    统计两次take()之间的帧率
+    """
+
+    def __init__(self):
+        self.count = 0
+        self.start_time = time.time()
+
+    def add(self, count=1):
+        self.count += count
+
+    def take(self):
+        now = time.time()
+        elapsed = now - self.start_time
+        fps = self.count / elapsed if elapsed > 0 else 0
+        self.count = 0
+        self.start_time = now
+        return round(fps, 2)
+
+
+def flush_fps(redis_client, task_id, fps_mapping, ttl=timedelta(days=1)):
+    pipeline = redis_client.pipeline()
+    pipeline.hset(camera_fps_key(task_id), mapping=fps_mapping)
+    pipeline.expire(camera_fps_key(task_id), ttl)
+    pipeline.execute()
+
+
+def get_fps_from_redis(redis_client, task_id):
+    result = redis_client.hgetall(camera_fps_key(task_id))
+    return {field.decode('utf-8'): float(value) for field, value in result.items()}
+
+
+class AdaptiveEmitController:
+    """
+    摄像头进程使用，根据网关写入的背压等级决定每一帧是否发送
+    """
+
+    def __init__(self, redis_client, task_id, poll_interval=None, max_level=None):
+        self.redis_client = redis_client
+        self.key = camera_backpressure_key(task_id)
+        self.poll_interval = poll_interval if poll_interval else \
+            config.get("camera_backpressure_poll_interval", 0.5)
+        self.max_level = max_level if max_level is not None else config.get("camera_backpressure_max_level", 3)
+        self.jpeg_quality_max = config.get("camera_preview_jpeg_quality", 90)
+        self.jpeg_quality_min = config.get("camera_preview_jpeg_quality_min", 40)
+        self.jpeg_quality_step = config.get("camera_preview_jpeg_quality_step", 15)
+        self.level = 0
+        self.keyframe_requested = False
+        self.frame_index = 0
+        self.last_poll_time = 0
+
+    def should_emit(self):
+        now = time.time()
+        if now - self.last_poll_time >= self.poll_interval:
+            self.last_poll_time = now
+            self._poll()
+        emit = self.frame_index % (1 << self.level) == 0
+        self.frame_index += 1
+        return emit
+
+    def jpeg_quality(self):
+        """
+        预览帧的jpg质量，背压等级每升高一级降低jpeg_quality_step，不低于jpeg_quality_min
+        """
+        return max(self.jpeg_quality_max - self.level * self.jpeg_quality_step, self.jpeg_quality_min)
+
+    def take_keyframe_request(self):
+        """
+        返回网关是否请求了关键帧，请求只生效一次
+        """
+        keyframe_requested = self.keyframe_requested
+        self.keyframe_requested = False
+        return keyframe_requested
+
+    def _poll(self):
+        pipeline = self.redis_client.pipeline()
+        pipeline.hget(self.key, LEVEL_FIELD)
+        pipeline.hget(self.key, KEYFRAME_FIELD)
+        pipeline.hdel(self.key, KEYFRAME_FIELD)
+        level, keyframe, _ = pipeline.execute()
+        level = min(max(int(level), 0), self.max_level) if level else 0
+        if level != self.level:
+            self.level = level
+            self.frame_index = 0
+        if keyframe:
+            self.keyframe_requested = True
+
+
+class ViewerWindow:
+    """
+    网关为每个观看者维护的确认窗口，window_size为0表示观看者不确认消息，不做流控
+    """
+
+    def __init__(self, window_size=0, ack_timeout=None):
+        self.window_size = window_size
+        self.ack_timeout = ack_timeout if ack_timeout else config.get("camera_ack_timeout", 5)
+        self.in_flight = 0
+        self.last_ack_time = time.time()
+        self.need_keyframe = False
+        self.dropped = False
+        self.delivered = FpsCounter()
+
+    def acquire(self, is_delta):
+        """
+        判断当前帧能否发送给该观看者，可以发送时占用窗口中的一个位置
+        """
+        if self.need_keyframe and is_delta:
+            return False
+        if 0 < self.window_size <= self.in_flight and time.time() - self.last_ack_time > self.ack_timeout:
+            # 长时间没有收到确认，认为已发送的消息丢失，重新开始计数
+            self.in_flight = 0
+        if 0 < self.window_size <= self.in_flight:
+            # 丢弃的帧之后的差分帧无法解码，需要等待关键帧
+            self.need_keyframe = True
+            self.dropped = True
+            return False
+        self.need_keyframe = False
+        if self.window_size > 0:
+            self.in_flight += 1
+        else:
+            self.delivered.add()
+        return True
+
+    def ack(self):
+        self.in_flight = max(self.in_flight - 1, 0)
+        self.last_ack_time = time.time()
+        self.delivered.add()
+
+    def idle(self):
+        return self.in_flight <= self.window_size // 2
+
+
+class BackpressureAdjuster:
+    """
+    网关根据所有观看者的确认窗口调整背压等级
+    """
+
+    def __init__(self, redis_client, task_id, adjust_interval=None, max_level=None):
+        self.redis_client = redis_client
+        self.key = camera_backpressure_key(task_id)
+        self.adjust_interval = adjust_interval if adjust_interval else \
+            config.get("camera_backpressure_adjust_interval", 1)
+        self.max_level = max_level if max_level is not None else config.get("camera_backpressure_max_level", 3)
+        self.level = 0
+        self.last_adjust_time = time.time()
+
+    def adjust(self, viewer_windows):
+        now = time.time()
+        if now - self.last_adjust_time < self.adjust_interval:
+            return
+        self.last_adjust_time = now
+        windows = [window for window in viewer_windows if window.window_size > 0]
+        dropped = any(window.dropped for window in windows)
+        need_keyframe = any(window.need_keyframe for window in windows)
+        for window in windows:
+            window.dropped = False
+        level = self.level
+        if dropped:
+            level = min(level + 1, self.max_level)
+        elif all(window.idle() for window in windows):
+            level = max(level - 1, 0)
+        if level == self.level and not need_keyframe:
+            return
+        self.level = level
+        mapping = {LEVEL_FIELD: level}
+        if need_keyframe:
+            mapping[KEYFRAME_FIELD] = 1
+        pipeline = self.redis_client.pipeline()
+        pipeline.hset(self.key, mapping=mapping)
+        pipeline.expire(self.key, timedelta(days=1))
+        pipeline.execute()
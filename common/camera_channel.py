@@ -0,0 +1,28 @@
+import struct
+
+# 摄像头结果消息：payload类型(uint8) + 发送时间(int64, 毫秒) + payload
+MESSAGE_HEADER_STRUCT = struct.Struct('<Bq')
+PAYLOAD_JSON = 0
+PAYLOAD_BINARY = 1
+
+
+def camera_channel_key(task_id):
+    # 摄像头进程把每一帧的结果发布到该channel，网关订阅后转发给该namespace的所有观看者
+    return task_id + "_camera_channel"
+
+
+def pack_camera_message(payload, emit_timestamp):
+    if isinstance(payload, str):
+        return MESSAGE_HEADER_STRUCT.pack(PAYLOAD_JSON, emit_timestamp) + payload.encode('utf-8')
+    return MESSAGE_HEADER_STRUCT.pack(PAYLOAD_BINARY, emit_timestamp) + payload
+
+
+def unpack_camera_message(message: bytes):
+    """
+    返回(payload, emit_timestamp)，json格式的payload解码为字符串，二进制格式的payload保持bytes
+    """
+    payload_type, emit_timestamp = MESSAGE_HEADER_STRUCT.unpack_from(message)
+    payload = message[MESSAGE_HEADER_STRUCT.size:]
+    if payload_type == PAYLOAD_JSON:
+        payload = payload.decode('utf-8')
+    return payload, emit_timestamp
@@ -0,0 +1,174 @@
+"""
+camera_data二进制格式（小端）：
+
+header: magic(2s, b'CD') version(uint8) flags(uint8) seq(uint32) timestamp(int64, 毫秒)
+        frame_age_ms(uint32) count(uint16)
+flags: bit0 带有track_id，bit1 差分帧
+
+关键帧的body按列存放：xmin/ymin/w/h各count个int16，label count个uint8，score count个uint16（score * 65535），
+带有track_id时再跟count个uint32的track_id。
+
+差分帧只在所有目标都带有track_id、且都出现在上一帧中时使用：body先是count个uint32的track_id，
+然后是xmin/ymin/w/h相对于上一帧同一track_id的差值，各count个int8，最后是label和score，格式与关键帧相同。
+任一差值超出int8范围、出现新目标或到达关键帧间隔时发送关键帧。解码端需要按顺序解码每一帧以维护上一帧的状态
+"""
+import struct
+from enum import Enum
+from typing import Dict, List, Tuple
+
+from common.config import config
+
+
+class CameraDataFormat(Enum):
+    JSON = "json"
+    BINARY = "binary"
+
+
+MAGIC = b'CD'
+VERSION = 1
+FLAG_TRACK_ID = 0x01
+FLAG_DELTA = 0x02
+HEADER_STRUCT = struct.Struct('<2sBBIqIH')
+SCORE_SCALE = 65535
+
+
+def _clamp_int16(value):
+    return max(-32768, min(32767, int(round(value))))
+
+
+def _quantize(json_item):
+    return (_clamp_int16(json_item['xmin']), _clamp_int16(json_item['ymin']),
+            _clamp_int16(json_item['w']), _clamp_int16(json_item['h']))
+
+
+class CameraDataEncoder:
+    """
+    把一帧的json_items编码为二进制，同一路摄像头需要使用同一个编码器，以便进行差分编码
+    """
+
+    def __init__(self, keyframe_interval=None):
+        self.keyframe_interval = keyframe_interval if keyframe_interval else \
+            config.get("camera_codec_keyframe_interval", 30)
+        self.seq = 0
+        self.frames_since_keyframe = 0
+        # 上一帧中每个track_id量化后的坐标
+        self.previous_rects: Dict[int, Tuple[int, int, int, int]] = {}
+
+    def encode(self, json_items: List[dict], timestamp=0, frame_age_ms=0):
+        count = len(json_items)
+        has_track_id = count > 0 and all('track_id' in json_item for json_item in json_items)
+        rects = [_quantize(json_item) for json_item in json_items]
+        labels = [int(json_item['label']) & 0xFF for json_item in json_items]
+        scores = [max(0, min(SCORE_SCALE, int(round(float(json_item['score']) * SCORE_SCALE))))
+                  for json_item in json_items]
+        track_ids = [int(json_item['track_id']) for json_item in json_items] if has_track_id else []
+
+        deltas = self._try_delta(rects, track_ids) if has_track_id else None
+        flags = FLAG_TRACK_ID if has_track_id else 0
+        if deltas is not None:
+            flags |= FLAG_DELTA
+            self.frames_since_keyframe += 1
+        else:
+            self.frames_since_keyframe = 0
+        self.previous_rects = dict(zip(track_ids, rects)) if has_track_id else {}
+
+        parts = [HEADER_STRUCT.pack(MAGIC, VERSION, flags, self.seq & 0xFFFFFFFF, int(timestamp),
+                                    max(0, int(frame_age_ms)), count)]
+        self.seq += 1
+        if count == 0:
+            return b''.join(parts)
+        if deltas is not None:
+            parts.append(struct.pack(f'<{count}I', *track_ids))
+            for column in range(4):
+                parts.append(struct.pack(f'<{count}b', *[delta[column] for delta in deltas]))
+        else:
+            for column in range(4):
+                parts.append(struct.pack(f'<{count}h', *[rect[column] for rect in rects]))
+        parts.append(struct.pack(f'<{count}B', *labels))
+        parts.append(struct.pack(f'<{count}H', *scores))
+        if has_track_id and deltas is None:
+            parts.append(struct.pack(f'<{count}I', *track_ids))
+        return b''.join(parts)
+
+    def force_keyframe(self):
+        # 下一帧发送关键帧，用于接收端丢失差分帧之后恢复
+        self.previous_rects = {}
+
+    def _try_delta(self, rects, track_ids):
+        if self.frames_since_keyframe + 1 >= self.keyframe_interval:
+            return None
+        deltas = []
+        for rect, track_id in zip(rects, track_ids):
+            previous_rect = self.previous_rects.get(track_id)
+            if previous_rect is None:
+                return None
+            delta = tuple(value - previous_value for value, previous_value in zip(rect, previous_rect))
+            if any(value < -128 or value > 127 for value in delta):
+                return None
+            deltas.append(delta)
+        return deltas
+
+
+def is_delta_payload(payload):
+    """
+    判断要发送的camera_data是否为二进制格式的差分帧，json格式返回False
+    """
+    return isinstance(payload, (bytes, bytearray)) and len(payload) >= HEADER_STRUCT.size \
+        and payload[:2] == MAGIC and bool(payload[3] & FLAG_DELTA)
+
+
+class CameraDataDecoder:
+    """
+    解码CameraDataEncoder编码的二进制数据，返回与json格式camera_data相同结构的字典
+    """
+
+    def __init__(self):
+        self.previous_rects: Dict[int, Tuple[int, int, int, int]] = {}
+
+    def decode(self, data: bytes):
+        magic, version, flags, seq, timestamp, frame_age_ms, count = HEADER_STRUCT.unpack_from(data)
+        if magic != MAGIC or version != VERSION:
+            raise ValueError(f"unsupported camera data, magic: {magic}, version: {version}")
+        offset = HEADER_STRUCT.size
+        has_track_id = bool(flags & FLAG_TRACK_ID)
+
+        def read(fmt):
+            nonlocal offset
+            values = struct.unpack_from(f'<{count}{fmt}', data, offset)
+            offset += struct.calcsize(f'<{count}{fmt}')
+            return values
+
+        if count == 0:
+            self.previous_rects = {}
+            return {'data': [], 'timestamp': timestamp, 'frame_age_ms': frame_age_ms, 'seq': seq}
+        if flags & FLAG_DELTA:
+            track_ids = read('I')
+            columns = [read('b') for _ in range(4)]
+            rects = []
+            for i, track_id in enumerate(track_ids):
+                previous_rect = self.previous_rects[track_id]
+                rects.append(tuple(previous_rect[column] + columns[column][i] for column in range(4)))
+            labels = read('B')
+            scores = read('H')
+        else:
+            columns = [read('h') for _ in range(4)]
+            rects = list(zip(*columns))
+            labels = read('B')
+            scores = read('H')
+            track_ids = read('I') if has_track_id else []
+        self.previous_rects = dict(zip(track_ids, rects)) if has_track_id else {}
+
+        json_items = []
+        for i, (xmin, ymin, w, h) in enumerate(rects):
+            json_item = {
+                'xmin': xmin,
+                'ymin': ymin,
+                'w': w,
+                'h': h,
+                'label': labels[i],
+                'score': scores[i] / SCORE_SCALE,
+            }
+            if has_track_id:
+                json_item['track_id'] = track_ids[i]
+            json_items.append(json_item)
+        return {'data': json_items, 'timestamp': timestamp, 'frame_age_ms': frame_age_ms, 'seq': seq}
@@ -7,8 +7,8 @@ class Config:
         with open("config.json", "r") as f:
             self.config = json.load(f)
 
-    def get(self, query):
-        return self.config.get(query)
+    def get(self, query, default=None):
+        return self.config.get(query, default)
 
 
 config = Config()
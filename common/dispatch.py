@@ -0,0 +1,120 @@
+import json
+import time
+import uuid
+from datetime import timedelta
+
+import redis
+
+from common.config import config
+from common.error_code import ErrorCodeEnum
+
+
+class DispatchError(Exception):
+    """
+    分派失败时抛出，携带需要返回给前端的错误码
+    """
+
+    def __init__(self, error_code_enum: ErrorCodeEnum):
+        super().__init__(error_code_enum.value.message)
+        self.error_code_enum = error_code_enum
+
+
+def dispatch_queue_key(service_name):
+    # 同名服务的所有实例共享同一个任务队列，空闲的实例从队列中拉取任务
+    return f"{service_name}_dispatch_queue"
+
+
+def dispatch_instances_key(service_name):
+    # zset，member为实例的unique_id，score为过期时间戳，用于淘汰已经下线的实例
+    return f"{service_name}_dispatch_instances"
+
+
+def dispatch_capacity_key(service_name):
+    # hash，field为实例的unique_id，value为实例当前的空闲容量
+    return f"{service_name}_dispatch_capacity"
+
+
+def dispatch_reply_key(request_id):
+    return f"dispatch_reply_{request_id}"
+
+
+def dump_dispatch_payload(payload):
+    return json.dumps(payload, default=lambda o: o.__json__() if hasattr(o, '__json__') else o.__dict__)
+
+
+def get_live_capacity(redis_client: redis.StrictRedis, service_name):
+    """
+    获取在线实例的空闲容量，返回值为 {unique_id: free_capacity}
+    """
+    instances_key = dispatch_instances_key(service_name)
+    pipeline = redis_client.pipeline()
+    pipeline.zremrangebyscore(instances_key, '-inf', time.time())
+    pipeline.zrange(instances_key, 0, -1)
+    pipeline.hgetall(dispatch_capacity_key(service_name))
+    _, members, capacity = pipeline.execute()
+    live_capacity = {}
+    for member in members:
+        free = capacity.get(member)
+        live_capacity[member.decode('utf-8')] = int(free) if free else 0
+    return live_capacity
+
+
+def dispatch_call(redis_client: redis.StrictRedis, service_name, args, timeout=None):
+    """
+    网关侧的分派函数：将调用参数放入服务的共享队列，由有空闲容量的实例拉取执行，再从应答队列中阻塞获取结果。
+    请求只会被一个空闲实例取走，不再需要轮询rpc来碰运气地找到空闲实例。
+    """
+    if timeout is None:
+        timeout = config.get("dispatch_reply_timeout", 60)
+    if len(get_live_capacity(redis_client, service_name)) == 0:
+        raise DispatchError(ErrorCodeEnum.SERVICE_UNAVAILABLE_ERROR)
+    request_id = str(uuid.uuid4())
+    reply_key = dispatch_reply_key(request_id)
+    queue_key = dispatch_queue_key(service_name)
+    raw_request = dump_dispatch_payload({
+        'request_id': request_id,
+        'reply_key': reply_key,
+        'args': args,
+    })
+    redis_client.rpush(queue_key, raw_request)
+    reply = redis_client.blpop(reply_key, timeout=timeout)
+    if reply is None:
+        # 超时仍未被任何实例取走，撤回请求；如果已经被取走，则再等待一个周期的执行结果
+        if redis_client.lrem(queue_key, 1, raw_request) > 0:
+            raise DispatchError(ErrorCodeEnum.SERVICE_BUSY_ERROR)
+        reply = redis_client.blpop(reply_key, timeout=timeout)
+        if reply is None:
+            raise DispatchError(ErrorCodeEnum.SERVICE_BUSY_ERROR)
+    redis_client.delete(reply_key)
+    reply_dict = json.loads(reply[1])
+    if 'error' in reply_dict:
+        raise RuntimeError(reply_dict['error'])
+    return reply_dict['result']
+
+
+def submit_dispatch_request(redis_client: redis.StrictRedis, service_name, args):
+    """
+    只把请求放入服务的共享队列，不等待执行结果，返回放入队列的原始请求，用于之后撤回
+    """
+    request_id = str(uuid.uuid4())
+    raw_request = dump_dispatch_payload({
+        'request_id': request_id,
+        'reply_key': dispatch_reply_key(request_id),
+        'args': args,
+    })
+    redis_client.rpush(dispatch_queue_key(service_name), raw_request)
+    return raw_request
+
+
+def withdraw_dispatch_request(redis_client: redis.StrictRedis, service_name, raw_request):
+    """
+    撤回还没有被任何实例取走的请求，撤回成功返回True
+    """
+    return redis_client.lrem(dispatch_queue_key(service_name), 1, raw_request) > 0
+
+
+def push_dispatch_reply(redis_client: redis.StrictRedis, reply_key, reply):
+    pipeline = redis_client.pipeline()
+    pipeline.rpush(reply_key, dump_dispatch_payload(reply))
+    pipeline.expire(reply_key, timedelta(minutes=10))
+    pipeline.execute()
@@ -0,0 +1,89 @@
+import os
+import threading
+from collections import OrderedDict
+from typing import Any, Callable, Tuple
+
+from common.config import config
+from common.log import LOGGER
+
+
+def estimate_engine_cost(model_path, src_width, src_height, batch_size):
+    """
+    估算一个推理引擎占用的显存字节数：反序列化后的引擎大小近似为trt文件大小，
+    再加上输入图像在host和device两侧的缓冲区
+    """
+    model_size = os.path.getsize(model_path) if os.path.exists(model_path) else 0
+    input_size = src_width * src_height * 3 * max(batch_size, 1)
+    return model_size + input_size * 2
+
+
+class EnginePool:
+    """
+    进程内的推理引擎池，以(engine路径, src_width, src_height, batch_size)为键缓存已经反序列化的引擎。
+
+    引擎在第一次使用时才创建，之后的调用直接复用，超过显存预算时按LRU淘汰最久未使用的引擎。
+    引擎的创建在锁内进行，避免并发请求重复反序列化同一个引擎。
+    """
+
+    def __init__(self, memory_budget_mb=None):
+        if memory_budget_mb is None:
+            memory_budget_mb = config.get("engine_pool_memory_mb", 4096)
+        self.memory_budget = int(memory_budget_mb * 1024 * 1024)
+        self.entries: "OrderedDict[Tuple, Tuple[Any, int]]" = OrderedDict()
+        self.used_bytes = 0
+        self.hit_count = 0
+        self.miss_count = 0
+        self.eviction_count = 0
+        self.lock = threading.Lock()
+
+    def get(self, key: Tuple, factory: Callable[[], Any]):
+        """
+        key为(engine路径, src_width, src_height, batch_size)，factory用于在未命中时创建引擎
+        """
+        self.lock.acquire()
+        try:
+            if key in self.entries:
+                self.entries.move_to_end(key)
+                self.hit_count += 1
+                return self.entries[key][0]
+            self.miss_count += 1
+            model_path, src_width, src_height, batch_size = key
+            cost = estimate_engine_cost(model_path, src_width, src_height, batch_size)
+            # 先淘汰再创建，保证新引擎创建时显存中不会同时存在超出预算的引擎
+            while len(self.entries) > 0 and self.used_bytes + cost > self.memory_budget:
+                evicted_key, (_, evicted_cost) = self.entries.popitem(last=False)
+                self.used_bytes -= evicted_cost
+                self.eviction_count += 1
+                LOGGER.info(f"engine pool evict: {evicted_key}")
+            LOGGER.info(f"engine pool create: {key}")
+            engine = factory()
+            self.entries[key] = (engine, cost)
+            self.used_bytes += cost
+            return engine
+        finally:
+            self.lock.release()
+
+    def clear(self):
+        self.lock.acquire()
+        try:
+            self.entries.clear()
+            self.used_bytes = 0
+        finally:
+            self.lock.release()
+
+    def metrics(self):
+        self.lock.acquire()
+        try:
+            return {
+                'engine_count': len(self.entries),
+                'used_mb': round(self.used_bytes / 1024 / 1024, 2),
+                'budget_mb': round(self.memory_budget / 1024 / 1024, 2),
+                'hit_count': self.hit_count,
+                'miss_count': self.miss_count,
+                'eviction_count': self.eviction_count,
+            }
+        finally:
+            self.lock.release()
+
+
+engine_pool = EnginePool()
@@ -11,5 +11,7 @@ class ErrorCode:
 class ErrorCodeEnum(Enum):
     UNSUPPORTED_INPUT_ERROR = ErrorCode(501, "不支持的输入形式")
     SERVICE_BUSY_ERROR = ErrorCode(502, "服务忙碌，请稍后再试")
+    SERVICE_UNAVAILABLE_ERROR = ErrorCode(503, "暂无可用的服务实例")
     ARGUMENT_ERROR = ErrorCode(401, "参数异常")
     AUTH_ERROR = ErrorCode(403, "权限不足")
+    RESULT_NOT_READY_ERROR = ErrorCode(404, "结果尚未生成")
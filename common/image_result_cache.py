@@ -0,0 +1,130 @@
+import hashlib
+import json
+import threading
+import time
+
+import redis
+
+from common.config import config
+from common.log import LOGGER
+
+# 结果中的url是对象存储24小时有效的预签名地址，缓存必须在此之前过期
+PRESIGNED_URL_EXPIRES_SECONDS = 24 * 3600
+
+IMAGE_RESULT_CACHE_INDEX_KEY = "image_result_cache_index"
+
+_PUT_SCRIPT = """
+    -- KEYS[1] 是结果key（hash，result为结果json，deadline为结果中的url失效前必须过期的时间戳），
+    -- KEYS[2] 是缓存索引zset（score为最近一次使用的时间戳）
+    -- ARGV[1] 是结果json，ARGV[2] 是过期时间（秒），ARGV[3] 是当前时间戳，ARGV[4] 是最大条目数，ARGV[5] 是deadline
+    redis.call('HSET', KEYS[1], 'result', ARGV[1], 'deadline', ARGV[5])
+    redis.call('EXPIRE', KEYS[1], ARGV[2])
+    redis.call('ZADD', KEYS[2], ARGV[3], KEYS[1])
+    -- 已经过期的条目先移出索引，再按最近最少使用淘汰超出上限的条目
+    redis.call('ZREMRANGEBYSCORE', KEYS[2], '-inf', tonumber(ARGV[3]) - tonumber(ARGV[2]))
+    local excess = redis.call('ZCARD', KEYS[2]) - tonumber(ARGV[4])
+    if excess > 0 then
+        local evicted = redis.call('ZRANGE', KEYS[2], 0, excess - 1)
+        redis.call('ZREMRANGEBYRANK', KEYS[2], 0, excess - 1)
+        redis.call('DEL', unpack(evicted))
+    end
+    return excess > 0 and excess or 0
+"""
+
+_GET_SCRIPT = """
+    -- KEYS[1] 是结果key，KEYS[2] 是缓存索引zset
+    -- ARGV[1] 是过期时间（秒），ARGV[2] 是当前时间戳
+    local entry = redis.call('HMGET', KEYS[1], 'result', 'deadline')
+    if not entry[1] then
+        -- key已经过期或被删除，索引中的条目一起删除
+        redis.call('ZREM', KEYS[2], KEYS[1])
+        return false
+    end
+    -- 命中时按最近一次使用重新计算过期时间，但不能晚于结果中的url失效之前
+    local ttl = math.min(tonumber(ARGV[1]), math.floor(tonumber(entry[2]) - tonumber(ARGV[2])))
+    if ttl <= 0 then
+        redis.call('DEL', KEYS[1])
+        redis.call('ZREM', KEYS[2], KEYS[1])
+        return false
+    end
+    redis.call('EXPIRE', KEYS[1], ttl)
+    redis.call('ZADD', KEYS[2], 'XX', ARGV[2], KEYS[1])
+    return entry[1]
+"""
+
+
+def image_result_cache_key(digest):
+    return f"image_result_cache_{digest}"
+
+
+class ImageResultCache:
+    """
+    单张图像推理结果的缓存，以(服务名, 模型版本, 超参数, 图像内容的sha256)为键，
+    缓存handle_single_image的返回值（frames、log_strs以及已经上传的绘制结果url），
+    相同的图像以相同的参数重复请求时不再推理、绘制和上传。
+
+    缓存保存在redis中，所有实例共享；进程内只统计本实例的命中次数，随ServiceInfo上报
+    """
+
+    def __init__(self):
+        self.hit_count = 0
+        self.miss_count = 0
+        self.eviction_count = 0
+        self.lock = threading.Lock()
+
+    @staticmethod
+    def compute_digest(service_name, model_version, hyperparameters, img_path):
+        sha256 = hashlib.sha256()
+        sha256.update(service_name.encode('utf-8'))
+        sha256.update(str(model_version).encode('utf-8'))
+        sha256.update(json.dumps(hyperparameters, sort_keys=True,
+                                 default=lambda o: o.__json__() if hasattr(o, '__json__') else o.__dict__)
+                      .encode('utf-8'))
+        with open(img_path, 'rb') as f:
+            for data in iter(lambda: f.read(1024 * 1024), b''):
+                sha256.update(data)
+        return sha256.hexdigest()
+
+    @staticmethod
+    def _ttl():
+        return min(int(config.get("image_result_cache_ttl", 43200)), PRESIGNED_URL_EXPIRES_SECONDS - 600)
+
+    def get(self, redis_client: redis.StrictRedis, digest):
+        """
+        命中时返回缓存的结果，并刷新其最近使用时间和过期时间，未命中返回None
+        """
+        cached = redis_client.eval(_GET_SCRIPT, 2, image_result_cache_key(digest), IMAGE_RESULT_CACHE_INDEX_KEY,
+                                   self._ttl(), time.time())
+        with self.lock:
+            if cached is None:
+                self.miss_count += 1
+                return None
+            self.hit_count += 1
+        return json.loads(cached)
+
+    def put(self, redis_client: redis.StrictRedis, digest, result):
+        max_entries = int(config.get("image_result_cache_max_entries", 10000))
+        now = time.time()
+        try:
+            evicted = redis_client.eval(_PUT_SCRIPT, 2, image_result_cache_key(digest), IMAGE_RESULT_CACHE_INDEX_KEY,
+                                        json.dumps(result), self._ttl(), now, max_entries,
+                                        now + PRESIGNED_URL_EXPIRES_SECONDS - 600)
+        except Exception as e:
+            # 缓存写入失败不影响本次请求的结果
+            LOGGER.error(f"put image result cache failed: {e}")
+            return
+        with self.lock:
+            self.eviction_count += evicted
+
+    def metrics(self):
+        with self.lock:
+            total = self.hit_count + self.miss_count
+            return {
+                'hit_count': self.hit_count,
+                'miss_count': self.miss_count,
+                'hit_rate': round(self.hit_count / total, 4) if total > 0 else 0,
+                'eviction_count': self.eviction_count,
+            }
+
+
+image_result_cache = ImageResultCache()
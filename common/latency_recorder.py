@@ -0,0 +1,72 @@
+import json
+import math
+import threading
+from collections import deque
+from datetime import timedelta
+from typing import Deque, Dict
+
+from common.config import config
+
+
+def percentile(sorted_values, p):
+    # 最近秩法计算百分位数，sorted_values需要已经升序排列
+    if len(sorted_values) == 0:
+        return 0
+    index = max(math.ceil(p / 100 * len(sorted_values)) - 1, 0)
+    return sorted_values[min(index, len(sorted_values) - 1)]
+
+
+class LatencyRecorder:
+    """
+    按阶段记录延迟（毫秒），每个阶段保留最近window_size个样本，统计p50/p95/p99，
+    统计结果以阶段名为field写入redis hash，多个进程（例如摄像头脚本和网关）可以写入同一个hash的不同field
+    """
+
+    def __init__(self, window_size=None):
+        self.window_size = window_size if window_size else config.get("latency_window_size", 1000)
+        self.samples: Dict[str, Deque[float]] = {}
+        self.lock = threading.Lock()
+
+    def record(self, stage, latency_ms):
+        self.lock.acquire()
+        try:
+            if stage not in self.samples:
+                self.samples[stage] = deque(maxlen=self.window_size)
+            self.samples[stage].append(latency_ms)
+        finally:
+            self.lock.release()
+
+    def record_interval(self, stage, start_time, end_time):
+        # start_time和end_time为time.time()返回的秒数
+        self.record(stage, (end_time - start_time) * 1000)
+
+    def summary(self):
+        self.lock.acquire()
+        try:
+            samples = {stage: sorted(values) for stage, values in self.samples.items()}
+        finally:
+            self.lock.release()
+        result = {}
+        for stage, values in samples.items():
+            result[stage] = {
+                'count': len(values),
+                'p50': round(percentile(values, 50), 3),
+                'p95': round(percentile(values, 95), 3),
+                'p99': round(percentile(values, 99), 3),
+                'max': round(values[-1], 3) if len(values) > 0 else 0,
+            }
+        return result
+
+    def flush(self, redis_client, key, ttl=timedelta(days=1)):
+        summary = self.summary()
+        if len(summary) == 0:
+            return
+        pipeline = redis_client.pipeline()
+        pipeline.hset(key, mapping={stage: json.dumps(stats) for stage, stats in summary.items()})
+        pipeline.expire(key, ttl)
+        pipeline.execute()
+
+
+def get_latency_from_redis(redis_client, key):
+    result = redis_client.hgetall(key)
+    return {stage.decode('utf-8'): json.loads(stats) for stage, stats in result.items()}
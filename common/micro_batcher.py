@@ -0,0 +1,139 @@
+import threading
+import time
+from typing import Any, Callable, Dict, Hashable, List
+
+
+class _PendingRequest:
+
+    def __init__(self, item):
+        self.item = item
+        self.result = None
+        self.error = None
+        self.done = threading.Event()
+
+
+class _PendingBatch:
+
+    def __init__(self):
+        self.requests: List[_PendingRequest] = []
+
+
+class MicroBatcher:
+    """
+    动态微批处理：把一个时间窗口内到达的同类请求合并为一次批量调用，再把结果按顺序分发回各个调用方。
+
+    每个key（例如图像分辨率）对应一个待执行的batch，第一个进入batch的请求负责等待窗口结束后执行整个batch，
+    如果窗口内batch已满，则由使batch变满的请求立即执行。第一个请求到达时没有其他请求正在处理（低负载），
+    等待窗口不会有其他请求加入，立即单独执行。batch_func接收key和item列表，返回与item一一对应的结果列表。
+    在nameko（eventlet）环境下，等待窗口时的sleep会让出执行权，其他请求得以加入同一个batch。
+    """
+
+    def __init__(self, batch_func: Callable[[Hashable, List[Any]], List[Any]], window_ms=10, max_batch_size=8):
+        self.batch_func = batch_func
+        self.window_ms = window_ms
+        self.max_batch_size = max(int(max_batch_size), 1)
+        self.lock = threading.Lock()
+        self.pending: Dict[Hashable, _PendingBatch] = {}
+        # 已经提交、还没有返回的请求数，包括正在等待窗口和正在执行batch的请求
+        self.in_flight = 0
+        self.batch_count = 0
+        self.request_count = 0
+        self.full_batch_count = 0
+        self.lone_flush_count = 0
+        self.batch_size_histogram: Dict[int, int] = {}
+
+    def submit(self, key: Hashable, item):
+        request = _PendingRequest(item)
+        self.lock.acquire()
+        try:
+            self.in_flight += 1
+            batch = self.pending.get(key)
+            if batch is None:
+                batch = _PendingBatch()
+                self.pending[key] = batch
+            batch.requests.append(request)
+            is_leader = len(batch.requests) == 1
+            is_full = len(batch.requests) >= self.max_batch_size
+            is_lone = is_leader and self.in_flight == 1
+            if is_full or is_lone:
+                self.pending.pop(key)
+            if is_lone and not is_full:
+                self.lone_flush_count += 1
+        finally:
+            self.lock.release()
+
+        try:
+            return self._submit(key, batch, request, is_leader, is_full or is_lone)
+        finally:
+            self.lock.acquire()
+            self.in_flight -= 1
+            self.lock.release()
+
+    def _submit(self, key, batch: _PendingBatch, request: _PendingRequest, is_leader, run_now):
+        if run_now:
+            self._run(key, batch)
+        elif is_leader:
+            time.sleep(self.window_ms / 1000)
+            self.lock.acquire()
+            try:
+                # batch可能在窗口期间已经因为满了而被其他请求执行
+                own_batch = self.pending.get(key) is batch
+                if own_batch:
+                    self.pending.pop(key)
+            finally:
+                self.lock.release()
+            if own_batch:
+                self._run(key, batch)
+        request.done.wait()
+        if request.error is not None:
+            raise request.error
+        return request.result
+
+    def _run(self, key, batch: _PendingBatch):
+        requests = batch.requests
+        try:
+            results = self.batch_func(key, [request.item for request in requests])
+            if len(results) != len(requests):
+                raise ValueError(f"batch result size mismatch: {len(results)} != {len(requests)}")
+            for request, result in zip(requests, results):
+                request.result = result
+        except Exception as e:
+            for request in requests:
+                request.error = e
+        finally:
+            self._record(len(requests))
+            for request in requests:
+                request.done.set()
+
+    def _record(self, batch_size):
+        self.lock.acquire()
+        try:
+            self.batch_count += 1
+            self.request_count += batch_size
+            if batch_size >= self.max_batch_size:
+                self.full_batch_count += 1
+            self.batch_size_histogram[batch_size] = self.batch_size_histogram.get(batch_size, 0) + 1
+        finally:
+            self.lock.release()
+
+    def metrics(self):
+        """
+        batch填充情况的统计，avg_fill_ratio为平均batch大小与最大batch大小之比
+        """
+        self.lock.acquire()
+        try:
+            avg_batch_size = self.request_count / self.batch_count if self.batch_count > 0 else 0
+            return {
+                'window_ms': self.window_ms,
+                'max_batch_size': self.max_batch_size,
+                'batch_count': self.batch_count,
+                'request_count': self.request_count,
+                'full_batch_count': self.full_batch_count,
+                # 低负载时不等待窗口、单独执行的batch数，这些batch不计入批处理的收益
+                'lone_flush_count': self.lone_flush_count,
+                'avg_batch_size': round(avg_batch_size, 2),
+                'avg_fill_ratio': round(avg_batch_size / self.max_batch_size, 4),
+                'batch_size_histogram': {str(size): count for size, count in self.batch_size_histogram.items()},
+            }
+        finally:
+            self.lock.release()
@@ -0,0 +1,75 @@
+import json
+import time
+from datetime import timedelta
+
+from common.config import config
+from common.task_state import update_task_progress
+
+# 推送给前端的事件名，与轮询progress_retrieve时网关发送的事件相同
+PROGRESS_EVENT = 'progress_data'
+LOG_EVENT = 'video_log'
+DONE_EVENT = 'video_task_done'
+# 处理过程中已经可以访问的部分结果（视频分片、结果分块），见common.progressive_result
+PARTIAL_EVENT = 'video_partial_result'
+
+
+def progress_channel_key(task_id):
+    # 视频任务把进度、日志和完成事件发布到该channel，网关订阅后推送给前端
+    return task_id + "_progress_channel"
+
+
+def pack_progress_message(event, data):
+    return json.dumps({'event': event, 'data': data})
+
+
+def unpack_progress_message(message):
+    """
+    返回(event, data)
+    """
+    message = json.loads(message)
+    return message['event'], message['data']
+
+
+def publish_video_done(redis_client, task_id, video_url, json_url):
+    redis_client.publish(progress_channel_key(task_id), pack_progress_message(DONE_EVENT, [video_url, json_url]))
+
+
+class ProgressPublisher:
+    """
+    节流发布视频任务的进度：进度增加超过publish_step，或距离上一次发布超过publish_interval秒时才发布，
+    同时更新任务状态记录中的进度，兼容仍然通过progress_retrieve轮询的前端
+    """
+
+    def __init__(self, redis_client, task_id, publish_interval=None, publish_step=None):
+        self.redis_client = redis_client
+        self.task_id = task_id
+        self.channel = progress_channel_key(task_id)
+        self.log_key = task_id + "_log"
+        self.publish_interval = publish_interval if publish_interval else \
+            config.get("video_progress_publish_interval", 0.5)
+        self.publish_step = publish_step if publish_step else config.get("video_progress_publish_step", 0.01)
+        self.last_progress = -1.0
+        self.last_publish_time = 0
+
+    def update(self, progress, force=False):
+        now = time.time()
+        if not force:
+            if progress <= self.last_progress:
+                return
+            if progress - self.last_progress < self.publish_step and now - self.last_publish_time < self.publish_interval:
+                return
+        self.last_progress = progress
+        self.last_publish_time = now
+        progress_str = "%.2f" % progress
+        pipeline = self.redis_client.pipeline()
+        update_task_progress(pipeline, self.task_id, progress_str)
+        pipeline.publish(self.channel, pack_progress_message(PROGRESS_EVENT, progress_str))
+        pipeline.execute()
+
+    def log(self, log_str):
+        # 日志同时写入列表，网关订阅之前产生的日志在订阅后一次性补发
+        pipeline = self.redis_client.pipeline()
+        pipeline.rpush(self.log_key, log_str)
+        pipeline.expire(self.log_key, timedelta(days=1))
+        pipeline.publish(self.channel, pack_progress_message(LOG_EVENT, [log_str]))
+        pipeline.execute()
@@ -0,0 +1,86 @@
+"""
+视频任务处理过程中的部分结果：
+
+- 视频分片：输出视频同时切分为HLS的fmp4分片，每个分片编码完成后上传，前端通过playlist边处理边播放
+- 结果分块：每chunk_frames帧的jsonl结果作为一个对象上传，前端可以浏览已经处理过的帧的检测结果
+
+上传后的对象记录在redis中，同时通过进度channel发布PARTIAL_EVENT事件，data为
+{'type': 'segment', 'index', 'duration', 'url'}、{'type': 'result', 'start_frame', 'end_frame', 'url'}
+或任务结束时的{'type': 'end'}
+"""
+import json
+
+PARTIAL_SEGMENT = 'segment'
+PARTIAL_RESULT = 'result'
+PARTIAL_END = 'end'
+
+
+def progressive_object_prefix(task_id):
+    return f"progressive/{task_id}/"
+
+
+def progressive_state_key(task_id):
+    # hash，init为初始化分片的对象名，target_duration为分片的最大时长，ended表示所有分片已经上传
+    return task_id + "_progressive_state"
+
+
+def progressive_segments_key(task_id):
+    # list，元素为{'object_name', 'duration'}的json
+    return task_id + "_progressive_segments"
+
+
+def progressive_results_key(task_id):
+    # list，元素为{'object_name', 'start_frame', 'end_frame'}的json
+    return task_id + "_progressive_results"
+
+
+def parse_hls_playlist(playlist_text):
+    """
+    解析ffmpeg写入的playlist，返回(初始化分片文件名, 最大分片时长, [(分片文件名, 时长)])。
+    ffmpeg在分片写完之后才把分片加入playlist，因此playlist中的分片都可以上传
+    """
+    init_name = None
+    target_duration = 0
+    segments = []
+    duration = None
+    for line in playlist_text.splitlines():
+        line = line.strip()
+        if line.startswith('#EXT-X-MAP:'):
+            init_name = line.split('URI="', 1)[1].split('"', 1)[0]
+        elif line.startswith('#EXT-X-TARGETDURATION:'):
+            target_duration = int(line.split(':', 1)[1])
+        elif line.startswith('#EXTINF:'):
+            duration = float(line.split(':', 1)[1].split(',', 1)[0])
+        elif line and not line.startswith('#') and duration is not None:
+            segments.append((line, duration))
+            duration = None
+    return init_name, target_duration, segments
+
+
+def build_hls_playlist(target_duration, init_url, segments, ended):
+    """
+    segments为[(分片url, 时长)]，任务还在处理时为EVENT类型的playlist，播放器会定期重新获取
+    """
+    lines = ['#EXTM3U', '#EXT-X-VERSION:7', f'#EXT-X-TARGETDURATION:{int(target_duration)}',
+             '#EXT-X-PLAYLIST-TYPE:EVENT', '#EXT-X-MEDIA-SEQUENCE:0', '#EXT-X-INDEPENDENT-SEGMENTS']
+    if init_url:
+        lines.append(f'#EXT-X-MAP:URI="{init_url}"')
+    for url, duration in segments:
+        lines.append(f'#EXTINF:{duration:.6f},')
+        lines.append(url)
+    if ended:
+        lines.append('#EXT-X-ENDLIST')
+    return '\n'.join(lines) + '\n'
+
+
+def load_progressive_state(redis_client, task_id):
+    """
+    返回(state字典, 分片列表, 结果分块列表)
+    """
+    pipeline = redis_client.pipeline()
+    pipeline.hgetall(progressive_state_key(task_id))
+    pipeline.lrange(progressive_segments_key(task_id), 0, -1)
+    pipeline.lrange(progressive_results_key(task_id), 0, -1)
+    state, segments, results = pipeline.execute()
+    state = {key.decode('utf-8'): value.decode('utf-8') for key, value in state.items()}
+    return state, [json.loads(segment) for segment in segments], [json.loads(result) for result in results]
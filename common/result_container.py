@@ -0,0 +1,235 @@
+"""
+视频/摄像头结果的列式二进制容器（小端），用于按帧范围读取结果，不需要下载和解析整个jsonl文件：
+
+header:  magic(4s, b'RC01') version(uint16) reserved(uint16)
+chunk:   连续chunk_frames帧的结果按列存放
+         chunk header: first_frame(uint32) frame_count(uint32) item_count(uint32) flags(uint32)
+         frame_item_count: frame_count个uint32，每一帧的目标数
+         pts:              frame_count个float64，毫秒
+         xmin/ymin/w/h:    各item_count个float32
+         label:            item_count个int32
+         score:            item_count个float32
+         track_id:         item_count个int32，只在flags带有FLAG_TRACK_ID时存在，没有track_id的目标为-1
+index:   chunk_count(uint32)，然后每个chunk为
+         first_frame(uint32) frame_count(uint32) offset(uint64) length(uint64) first_pts(float64)
+trailer: index_offset(uint64) frame_count(uint32) magic(4s, b'RCIX')
+
+读取时先读取文件末尾固定长度的trailer，再读取index，之后只读取与帧范围有交集的chunk，
+因此配合对象存储的范围读取，每次查询只需要三次小的读取。容器是视频和摄像头结果唯一的索引格式，
+由结果服务按帧范围或时间分页查询
+"""
+import bisect
+import json
+import struct
+from array import array
+from typing import Callable, List
+
+from common.config import config
+
+MAGIC = b'RC01'
+INDEX_MAGIC = b'RCIX'
+VERSION = 1
+FLAG_TRACK_ID = 0x01
+HEADER_STRUCT = struct.Struct('<4sHH')
+CHUNK_HEADER_STRUCT = struct.Struct('<IIII')
+INDEX_ENTRY_STRUCT = struct.Struct('<IIQQd')
+TRAILER_STRUCT = struct.Struct('<QI4s')
+BOX_COLUMNS = ['xmin', 'ymin', 'w', 'h']
+
+
+def result_jsonl_object_name(task_id):
+    # 视频和摄像头任务的jsonl结果以固定的对象名上传，结果服务据此找到结果并生成容器
+    return f"output_{task_id}.jsonl"
+
+
+def result_container_object_name(task_id):
+    return f"result_{task_id}.rc"
+
+
+def _frame_items(frame_result):
+    """
+    jsonl中每一行的格式因服务而异：目标列表、分类结果字典，或摄像头带时间戳的{'data': [...], 'timestamp': ...}，
+    统一转换为(目标列表, 时间戳)
+    """
+    timestamp = None
+    if isinstance(frame_result, dict) and 'data' in frame_result:
+        timestamp = frame_result.get('timestamp')
+        frame_result = frame_result['data']
+    if isinstance(frame_result, dict):
+        frame_result = [frame_result]
+    return frame_result if frame_result else [], timestamp
+
+
+def _to_little_endian(column: array):
+    if struct.pack('=I', 1) != struct.pack('<I', 1):
+        column.byteswap()
+    return column.tobytes()
+
+
+def _encode_chunk(first_frame, frames):
+    frame_item_counts = array('I')
+    pts_column = array('d')
+    box_columns = [array('f') for _ in BOX_COLUMNS]
+    label_column = array('i')
+    score_column = array('f')
+    track_id_column = array('i')
+    has_track_id = False
+    for pts, json_items in frames:
+        frame_item_counts.append(len(json_items))
+        pts_column.append(pts)
+        for json_item in json_items:
+            for column, name in zip(box_columns, BOX_COLUMNS):
+                column.append(float(json_item.get(name, 0)))
+            label_column.append(int(json_item.get('label', 0)))
+            score_column.append(float(json_item.get('score', 0)))
+            track_id = json_item.get('track_id')
+            has_track_id = has_track_id or track_id is not None
+            track_id_column.append(int(track_id) if track_id is not None else -1)
+    flags = FLAG_TRACK_ID if has_track_id else 0
+    parts = [CHUNK_HEADER_STRUCT.pack(first_frame, len(frames), len(label_column), flags),
+             _to_little_endian(frame_item_counts), _to_little_endian(pts_column)]
+    parts.extend(_to_little_endian(column) for column in box_columns)
+    parts.append(_to_little_endian(label_column))
+    parts.append(_to_little_endian(score_column))
+    if has_track_id:
+        parts.append(_to_little_endian(track_id_column))
+    return b''.join(parts)
+
+
+def write_result_container(jsonl_path, container_path, fps=0, chunk_frames=None):
+    """
+    把jsonl结果转换为列式容器。jsonl中没有时间戳时按fps计算pts，fps为0时pts为帧号
+    """
+    chunk_frames = chunk_frames if chunk_frames else config.get("result_container_chunk_frames", 256)
+    index = []
+    frame_count = 0
+    with open(jsonl_path, 'r') as jsonl_file, open(container_path, 'wb') as container_file:
+        container_file.write(HEADER_STRUCT.pack(MAGIC, VERSION, 0))
+
+        def flush_chunk(first_frame, frames):
+            chunk = _encode_chunk(first_frame, frames)
+            index.append((first_frame, len(frames), container_file.tell(), len(chunk), frames[0][0]))
+            container_file.write(chunk)
+
+        frames = []
+        for line in jsonl_file:
+            if not line.strip():
+                continue
+            json_items, timestamp = _frame_items(json.loads(line))
+            if timestamp is not None:
+                pts = float(timestamp)
+            else:
+                pts = frame_count * 1000 / fps if fps else float(frame_count)
+            frames.append((pts, json_items))
+            frame_count += 1
+            if len(frames) >= chunk_frames:
+                flush_chunk(frame_count - len(frames), frames)
+                frames = []
+        if len(frames) > 0:
+            flush_chunk(frame_count - len(frames), frames)
+
+        index_offset = container_file.tell()
+        container_file.write(struct.pack('<I', len(index)))
+        for entry in index:
+            container_file.write(INDEX_ENTRY_STRUCT.pack(*entry))
+        container_file.write(TRAILER_STRUCT.pack(index_offset, frame_count, INDEX_MAGIC))
+    return frame_count
+
+
+def _read_column(data, offset, typecode, count):
+    column = array(typecode)
+    end = offset + column.itemsize * count
+    column.frombytes(data[offset:end])
+    if struct.pack('=I', 1) != struct.pack('<I', 1):
+        column.byteswap()
+    return column, end
+
+
+def _decode_chunk(data, start_frame, end_frame):
+    first_frame, frame_count, item_count, flags = CHUNK_HEADER_STRUCT.unpack_from(data)
+    offset = CHUNK_HEADER_STRUCT.size
+    frame_item_counts, offset = _read_column(data, offset, 'I', frame_count)
+    pts_column, offset = _read_column(data, offset, 'd', frame_count)
+    box_columns = []
+    for _ in BOX_COLUMNS:
+        column, offset = _read_column(data, offset, 'f', item_count)
+        box_columns.append(column)
+    label_column, offset = _read_column(data, offset, 'i', item_count)
+    score_column, offset = _read_column(data, offset, 'f', item_count)
+    track_id_column = None
+    if flags & FLAG_TRACK_ID:
+        track_id_column, offset = _read_column(data, offset, 'i', item_count)
+
+    frames = []
+    item_index = 0
+    for i in range(frame_count):
+        frame_idx = first_frame + i
+        next_item_index = item_index + frame_item_counts[i]
+        if start_frame <= frame_idx < end_frame:
+            json_items = []
+            for j in range(item_index, next_item_index):
+                json_item = {name: column[j] for name, column in zip(BOX_COLUMNS, box_columns)}
+                json_item['label'] = label_column[j]
+                json_item['score'] = round(score_column[j], 6)
+                if track_id_column is not None and track_id_column[j] >= 0:
+                    json_item['track_id'] = track_id_column[j]
+                json_items.append(json_item)
+            frames.append({'frame_idx': frame_idx, 'pts': pts_column[i], 'data': json_items})
+        item_index = next_item_index
+    return frames
+
+
+class ResultContainerReader:
+    """
+    read_func(offset, length)返回文件中从offset开始的length个字节，可以是本地文件读取，也可以是对象存储的范围读取。
+    index和frame_count为之前load_index()读取的结果，传入时不再重复读取
+    """
+
+    def __init__(self, read_func: Callable[[int, int], bytes], size, index=None, frame_count=0):
+        self.read_func = read_func
+        self.size = size
+        self.frame_count = frame_count
+        self.index = index
+
+    def load_index(self):
+        if self.index is not None:
+            return
+        index_offset, self.frame_count, magic = TRAILER_STRUCT.unpack(
+            self.read_func(self.size - TRAILER_STRUCT.size, TRAILER_STRUCT.size))
+        if magic != INDEX_MAGIC:
+            raise ValueError("invalid result container")
+        data = self.read_func(index_offset, self.size - TRAILER_STRUCT.size - index_offset)
+        chunk_count = struct.unpack_from('<I', data)[0]
+        self.index = [INDEX_ENTRY_STRUCT.unpack_from(data, 4 + i * INDEX_ENTRY_STRUCT.size)
+                      for i in range(chunk_count)]
+
+    def frame_at_timestamp(self, timestamp):
+        """
+        返回pts不早于timestamp（毫秒）的第一帧，所有帧都早于timestamp时返回frame_count。
+        根据index中每个chunk的first_pts找到所在的chunk，只读取该chunk的帧数和pts列
+        """
+        self.load_index()
+        position = bisect.bisect_right([entry[4] for entry in self.index], timestamp) - 1
+        if position < 0:
+            return 0
+        first_frame, frame_count, offset, _, _ = self.index[position]
+        pts_offset = CHUNK_HEADER_STRUCT.size + frame_count * 4
+        data = self.read_func(offset, pts_offset + frame_count * 8)
+        pts_column, _ = _read_column(data, pts_offset, 'd', frame_count)
+        for i, pts in enumerate(pts_column):
+            if pts >= timestamp:
+                return first_frame + i
+        return first_frame + frame_count
+
+    def read_frames(self, start_frame, end_frame) -> List[dict]:
+        """
+        返回[start_frame, end_frame)范围内每一帧的结果
+        """
+        self.load_index()
+        end_frame = min(end_frame, self.frame_count)
+        frames = []
+        for first_frame, frame_count, offset, length, _ in self.index:
+            if first_frame + frame_count <= start_frame or first_frame >= end_frame:
+                continue
+            frames.extend(_decode_chunk(self.read_func(offset, length), start_frame, end_frame))
+        return frames
@@ -0,0 +1,128 @@
+"""
+异步任务（视频、摄像头）的状态记录，每个任务一个hash，取代之前分散在各个key中的进度、停止信号和完成标记：
+
+- state：queued（已放入分派队列）、running（实例已经开始处理）、uploading（正在上传结果）、done、failed
+- service_name、source、instance_id、progress、stop_requested、error，以及完成后的video_url、json_url、result_object、fps
+- created_at、updated_at，以及进入每个状态的时间{state}_at，均为秒级时间戳
+
+未结束的任务同时记录在活跃任务索引（zset，score为创建时间）中，结束后移出索引。
+状态转换在lua脚本中完成，已经结束的任务不会被迟到的更新改回未结束的状态。日志仍然保存在{task_id}_log列表中
+"""
+import time
+
+import redis
+
+from common.config import config
+
+STATE_QUEUED = 'queued'
+STATE_RUNNING = 'running'
+STATE_UPLOADING = 'uploading'
+STATE_DONE = 'done'
+STATE_FAILED = 'failed'
+TERMINAL_STATES = [STATE_DONE, STATE_FAILED]
+
+ACTIVE_TASKS_KEY = "active_tasks"
+
+_UPDATE_STATE_SCRIPT = """
+    -- KEYS[1] 是任务状态hash，KEYS[2] 是活跃任务索引
+    -- ARGV[1] 是task_id，ARGV[2] 是新状态，ARGV[3] 是当前时间戳，ARGV[4] 是过期时间（秒）
+    -- ARGV[5] 表示新状态是否为结束状态，之后为需要同时写入的field和value
+    local current = redis.call('HGET', KEYS[1], 'state')
+    if current == 'done' or current == 'failed' then
+        return 0
+    end
+    if not current then
+        redis.call('HSET', KEYS[1], 'created_at', ARGV[3])
+    end
+    redis.call('HSET', KEYS[1], 'state', ARGV[2], 'updated_at', ARGV[3], ARGV[2] .. '_at', ARGV[3])
+    for i = 6, #ARGV, 2 do
+        redis.call('HSET', KEYS[1], ARGV[i], ARGV[i + 1])
+    end
+    redis.call('EXPIRE', KEYS[1], ARGV[4])
+    if ARGV[5] == '1' then
+        redis.call('ZREM', KEYS[2], ARGV[1])
+    else
+        local created_at = redis.call('HGET', KEYS[1], 'created_at')
+        redis.call('ZADD', KEYS[2], 'NX', created_at, ARGV[1])
+    end
+    return 1
+"""
+
+def task_state_key(task_id):
+    return task_id + "_state"
+
+
+def _ttl():
+    return int(config.get("task_state_ttl", 86400))
+
+
+def _decode_record(record):
+    return {key.decode('utf-8'): value.decode('utf-8') for key, value in record.items()}
+
+
+def update_task_state(redis_client: redis.StrictRedis, task_id, state, **fields):
+    """
+    把任务转换到state并同时写入fields，任务已经结束时不做修改并返回False
+    """
+    args = [task_id, state, time.time(), _ttl(), 1 if state in TERMINAL_STATES else 0]
+    for field, value in fields.items():
+        if value is not None:
+            args += [field, value]
+    return redis_client.eval(_UPDATE_STATE_SCRIPT, 2, task_state_key(task_id), ACTIVE_TASKS_KEY, *args) == 1
+
+
+def update_task_progress(pipeline, task_id, progress_str):
+    """
+    只更新进度，不改变状态，pipeline可以是redis客户端，也可以是调用方正在使用的pipeline
+    """
+    pipeline.hset(task_state_key(task_id), mapping={'progress': progress_str, 'updated_at': time.time()})
+    pipeline.expire(task_state_key(task_id), _ttl())
+
+
+def request_task_stop(pipeline, task_id):
+    # 取代之前的{task_id}_stop，前端断开连接时写入
+    pipeline.hset(task_state_key(task_id), 'stop_requested', 1)
+    pipeline.expire(task_state_key(task_id), _ttl())
+
+
+def get_task_state(redis_client: redis.StrictRedis, task_id):
+    """
+    返回任务的状态记录，没有记录时返回None
+    """
+    record = redis_client.hgetall(task_state_key(task_id))
+    return _decode_record(record) if record else None
+
+
+def get_task_states(redis_client: redis.StrictRedis, task_ids):
+    """
+    一次往返批量获取多个任务的状态记录，返回{task_id: 状态记录或None}
+    """
+    pipeline = redis_client.pipeline(transaction=False)
+    for task_id in task_ids:
+        pipeline.hgetall(task_state_key(task_id))
+    records = pipeline.execute()
+    return {task_id: _decode_record(record) if record else None for task_id, record in zip(task_ids, records)}
+
+
+def list_active_tasks(redis_client: redis.StrictRedis, service_name=None, limit=None):
+    """
+    获取未结束的任务，按创建时间排序，返回[状态记录]，记录中带有task_id。
+    redis集群要求脚本访问的key都通过KEYS传入，因此不在脚本中拼接状态hash的key，而是先读取索引，
+    再通过pipeline一次往返批量读取各任务的状态记录
+    """
+    limit = limit if limit else config.get("task_state_list_limit", 1000)
+    task_ids = [task_id.decode('utf-8') for task_id in redis_client.zrange(ACTIVE_TASKS_KEY, 0, limit - 1)]
+    tasks = []
+    expired = []
+    for task_id, record in get_task_states(redis_client, task_ids).items():
+        if record is None:
+            # 状态hash已经过期（例如处理进程崩溃后没有再更新）的任务顺便移出索引
+            expired.append(task_id)
+            continue
+        if service_name and record.get('service_name') != service_name:
+            continue
+        record['task_id'] = task_id
+        tasks.append(record)
+    if len(expired) > 0:
+        redis_client.zrem(ACTIVE_TASKS_KEY, *expired)
+    return tasks
@@ -131,12 +131,13 @@ def connect_to_database():
         return None
 
 
-def download_file(url, temp_dir='temp'):
+def download_file(url, temp_dir='temp', file_prefix=''):
+    # file_prefix加在保存的文件名之前，用于同一目录下多个url的文件名相同的情况
     response = requests.get(url)
     if response.status_code == 200:
         url_path = urlparse(url).path
         file_name = unquote(os.path.basename(url_path))
-        file_path = f'{temp_dir}/{file_name}'
+        file_path = f'{temp_dir}/{file_prefix}{file_name}'
         with open(file_path, 'wb') as f:
             f.write(response.content)
         return file_name, file_path
@@ -1,26 +1,36 @@
 import json
 import os
+import shutil
 import subprocess
 import sys
 import threading
 import time
 import uuid
 from abc import ABC
+from concurrent.futures import ThreadPoolExecutor
 from datetime import timedelta
 from typing import List, Union
 
 from nameko.events import event_handler, BROADCAST
 from nameko.rpc import rpc
 
+from common.config import config
+from common.engine_pool import engine_pool
+from common.image_result_cache import image_result_cache
 from common.log import LOGGER
+from common.task_state import update_task_state, STATE_RUNNING, STATE_FAILED
 from common.util import download_file, clear_image_temp_resource
+from microservice.camera_host_process import CameraHostProcess
+from microservice.dispatch_queue import dispatch_queue
 from microservice.manage import ManageService
 from microservice.mqtt_storage import MQTTStorage
 from microservice.redis_storage import RedisStorage
+from microservice.task_worker_pool import TaskWorkerPool
 from model.hyperparameter import Hyperparameter
-from model.service_info import ServiceInfo, ServiceReadyState, ServiceRunningState
+from model.service_info import ServiceInfo, ServiceSlot, ServiceReadyState, ServiceRunningState
 from model.support_input import SupportInput, SINGLE_PICTURE_URL_TYPE, MULTIPLE_PICTURE_URL_TYPE, VIDEO_URL_TYPE, \
     CAMERA_TYPE
+from video.video_segment import is_segment_task_id, get_segment_num, probe_duration
 
 
 class AIBaseService(ABC):
@@ -37,6 +47,13 @@ class AIBaseService(ABC):
 
     video_script_name = ""
     camera_script_name = ""
+    # 摄像头脚本提供了camera_batch_func和create_stream_func时，可以由多路摄像头推理宿主统一推理
+    camera_host_supported = False
+    # 视频逐帧独立推理、不依赖前后帧状态（例如不做跟踪）的服务，可以把长视频切分为多段由多个实例并行处理
+    video_split_supported = False
+    video_split_script_name = "scripts/video_split.py"
+    # 参与单张图像结果缓存的键，模型或推理逻辑更新后修改该值，使之前缓存的结果失效
+    model_version = "1"
 
     unique_id = str(uuid.uuid4())
     service_info = ServiceInfo()
@@ -44,6 +61,8 @@ class AIBaseService(ABC):
 
     redis_storage = RedisStorage()
     mqtt_storage = MQTTStorage()
+    task_worker_pool = TaskWorkerPool()
+    camera_host = CameraHostProcess()
 
     def __init__(self):
         self.hyperparameters: Union[List[Hyperparameter], None] = None
@@ -59,10 +78,14 @@ class AIBaseService(ABC):
         redis_list_key = payload
         self.state_lock.acquire()
         try:
+            self.init_slots()
+            self.service_info.batch_metrics = self.get_batch_metrics()
+            self.service_info.engine_pool_metrics = engine_pool.metrics()
+            self.service_info.image_cache_metrics = image_result_cache.metrics()
             state_string = self.service_info.__str__()
-            self.redis_storage.client.rpush(redis_list_key, state_string)
         finally:
             self.state_lock.release()
+        self.redis_storage.client.rpush(redis_list_key, state_string)
 
     @event_handler(ManageService.name, name + "close_event", handler_type=BROADCAST, reliable_delivery=False)
     def close_event_handler(self, payload):
@@ -92,26 +115,137 @@ class AIBaseService(ABC):
     @event_handler(ManageService.name, name + "state_change", handler_type=BROADCAST, reliable_delivery=False)
     def state_to_ready_handler(self, payload):
         """
-        在异步调用的场景下，需要在任务计算结束后通知AI微服务实例更新自己的服务状态，以便接收后续的调用
+        在异步调用的场景下，需要在任务计算结束后通知AI微服务实例释放任务占用的槽位，以便接收后续的调用
+
+        payload为{'unique_id': 实例id, 'task_id': 任务id}，旧版本的调用方只传递实例id字符串，
+        此时释放该实例上所有被异步任务占用的槽位
         """
-        if self.unique_id == payload:
-            self.state_lock.acquire()
-            self.service_info.state = ServiceReadyState
+        if isinstance(payload, dict):
+            unique_id, task_id = payload['unique_id'], payload.get('task_id')
+        else:
+            unique_id, task_id = payload, None
+        if self.unique_id != unique_id:
+            return
+        self.state_lock.acquire()
+        try:
+            for slot in self.service_info.slots:
+                if slot.state == ServiceReadyState or slot.task_type not in [CAMERA_TYPE, VIDEO_URL_TYPE]:
+                    continue
+                if task_id is None or slot.task_id == task_id:
+                    self._reset_slot(slot)
+            self._refresh_service_state()
+        finally:
             self.state_lock.release()
 
+    @classmethod
+    def get_batch_metrics(cls):
+        """
+        上报到ServiceInfo的批处理统计，使用了微批处理的子类需要覆盖该函数
+        """
+        return {}
+
+    @classmethod
+    def get_slot_num(cls):
+        # 子类可以通过声明slot_num类属性覆盖全局配置
+        slot_num = getattr(cls, 'slot_num', None)
+        if not slot_num:
+            slot_num = config.get("service_slot_num", 1)
+        return max(int(slot_num), 1)
+
+    @classmethod
+    def init_slots(cls):
+        # service_info在子类定义时才创建，所以槽位在第一次使用时按子类的配置懒加载，调用方需持有state_lock
+        if len(cls.service_info.slots) == 0:
+            cls.service_info.slots = [ServiceSlot(slot_id) for slot_id in range(cls.get_slot_num())]
+
+    @classmethod
+    def _refresh_service_state(cls):
+        # 只要还有空闲槽位，实例整体就处于ready状态
+        ready = any(slot.state == ServiceReadyState for slot in cls.service_info.slots)
+        cls.service_info.state = ServiceReadyState if ready else ServiceRunningState
+
+    @staticmethod
+    def _reset_slot(slot: ServiceSlot):
+        slot.state = ServiceReadyState
+        slot.task_type = ""
+        slot.task_id = ""
+
+    @classmethod
+    def has_free_slot(cls):
+        return cls.get_free_capacity() > 0
+
+    @classmethod
+    def get_free_capacity(cls):
+        if len(cls.service_info.slots) == 0:
+            return cls.get_slot_num()
+        return sum(1 for slot in cls.service_info.slots if slot.state == ServiceReadyState)
+
+    @classmethod
+    def try_acquire_slot(cls):
+        """
+        尝试占用一个空闲槽位，成功时返回槽位id，没有空闲槽位时返回None。
+        槽位在同步调用结束时释放，异步调用则在收到对应任务的state_change事件时释放
+        """
+        cls.state_lock.acquire()
+        try:
+            cls.init_slots()
+            for slot in cls.service_info.slots:
+                if slot.state == ServiceReadyState:
+                    slot.state = ServiceRunningState
+                    slot.task_start_time = int(time.time() * 1000)
+                    cls._refresh_service_state()
+                    return slot.slot_id
+            return None
+        finally:
+            cls.state_lock.release()
+
+    @classmethod
+    def release_slot(cls, slot_id):
+        cls.state_lock.acquire()
+        try:
+            cls._reset_slot(cls.service_info.slots[slot_id])
+            cls._refresh_service_state()
+        finally:
+            cls.state_lock.release()
+
     @rpc
     def call(self, args: dict):
+        """
+        rpc直接调用的入口，保留给不经过网关分派的调用方，实例没有空闲槽位时返回busy
+        """
+        slot_id = self.try_acquire_slot()
+        if slot_id is None:
+            output = {
+                'busy': True,
+                'unique_id': self.unique_id,
+            }
+            if 'taskId' in args:
+                output['task_id'] = args['taskId']
+            return output
+        return self.handle_call(args, slot_id)
+
+    @dispatch_queue
+    def dispatch_call(self, args: dict, slot_id: int):
+        """
+        分派队列的入口，入口在拉取任务时已经为本次调用占用了槽位
+        """
+        return self.handle_call(args, slot_id)
+
+    def handle_call(self, args: dict, slot_id: int):
         """
         核心函数，同时也是模板方法模式的核心模板，定义了标准的调用流程和参数处理方法。
+        调用前需要已经通过try_acquire_slot占用了槽位，不同槽位上的调用可以并发执行，
+        因此这里不再持有state_lock，只在修改槽位状态时加锁。
         """
-        self.state_lock.acquire()
-        supportInput = SupportInput().from_dict(args['supportInput'])
-        self.support_input = supportInput
-        self.args = args
-        output = self.call_init()
+        is_async_call = False
         try:
-            if output['busy']:
-                return output
+            supportInput = SupportInput().from_dict(args['supportInput'])
+            is_async_call = supportInput.type in [CAMERA_TYPE, VIDEO_URL_TYPE]
+            self.support_input = supportInput
+            self.args = args
+            output = self.call_init(slot_id)
+            if is_async_call and 'taskId' in args:
+                update_task_state(self.redis_storage.client, args['taskId'], STATE_RUNNING, instance_id=self.unique_id)
             hyperparameters = AIBaseService.parse_hyperparameters(args)
             self.hyperparameters = hyperparameters
             if supportInput.type == SINGLE_PICTURE_URL_TYPE:
@@ -124,10 +258,7 @@ class AIBaseService(ABC):
                 return output
             elif supportInput.type == MULTIPLE_PICTURE_URL_TYPE:
                 img_urls = supportInput.value
-                merged_result = {}
-                for img_url in img_urls:
-                    result = self.handle_single_image(img_url)
-                    AIBaseService.merge_single_result(merged_result, result)
+                merged_result = self.handle_multiple_images(img_urls)
                 output.update(merged_result)
                 self.mqtt_storage.push_message(
                     json.dumps(output, default=lambda o: o.__json__() if hasattr(o, '__json__') else o.__dict__)
@@ -142,12 +273,14 @@ class AIBaseService(ABC):
             else:
                 raise NotImplementedError("input type not support")
         except Exception as e:
-            self.service_info.state = ServiceReadyState
+            if is_async_call:
+                self.release_slot(slot_id)
+                if 'taskId' in args:
+                    update_task_state(self.redis_storage.client, args['taskId'], STATE_FAILED, error=str(e))
             raise e
         finally:
-            if supportInput.type not in [CAMERA_TYPE, VIDEO_URL_TYPE]:
-                self.service_info.state = ServiceReadyState
-            self.state_lock.release()
+            if not is_async_call:
+                self.release_slot(slot_id)
 
     def handle_single_image(self, img_url) -> dict:
         """
@@ -165,9 +298,21 @@ class AIBaseService(ABC):
         try:
             os.makedirs(output_path, exist_ok=True)
             LOGGER.info(f"Folder '{output_path}' created successfully.")
+            digest = None
+            if config.get("image_result_cache_enabled", False):
+                # 相同的图像和参数直接返回缓存的结果，不再推理、绘制和上传
+                digest = image_result_cache.compute_digest(self.name, self.model_version, self.hyperparameters,
+                                                           img_path)
+                cached_result = image_result_cache.get(self.redis_storage.client, digest)
+                if cached_result is not None:
+                    return cached_result
             # 这里使用【self】.single_image_cpp_call来进行函数调用而不是AIBaseService.single_image_cpp_call
             # 目的是为了将函数调用动态分派，调用子类的实现函数。下同。
-            return self.single_image_cpp_call(img_path, output_path, self.hyperparameters)
+            result = self.single_image_cpp_call(img_path, output_path, self.hyperparameters)
+            # 推理出错时结果中带有日志，不缓存
+            if digest is not None and not result.get('logs'):
+                image_result_cache.put(self.redis_storage.client, digest, result)
+            return result
         finally:
             clear_image_temp_resource(img_path, output_path)
 
@@ -175,14 +320,52 @@ class AIBaseService(ABC):
     def single_image_cpp_call(img_path, output_path, hyperparameters):
         raise NotImplementedError("please implement single_image_cpp_call")
 
+    def handle_multiple_images(self, img_urls) -> dict:
+        """
+        并发下载所有图像后统一交给multiple_image_cpp_call处理，返回值的格式与handle_single_image合并后的结果相同
+        """
+        unique_id = str(uuid.uuid4())
+        output_path = f"temp/multiple_{unique_id}/"
+        input_path = f"{output_path}input"
+        os.makedirs(input_path, exist_ok=True)
+        try:
+            # 下载到本次请求独占的目录下，避免并发请求中的同名文件互相覆盖；
+            # 不同url的文件名可能相同（例如不同目录下的image.jpg），文件名前加上下标，结果与img_urls的顺序一致
+            max_workers = max(min(len(img_urls), config.get("image_download_concurrency", 8)), 1)
+            with ThreadPoolExecutor(max_workers=max_workers) as executor:
+                downloaded = list(executor.map(lambda idx_url: download_file(idx_url[1], temp_dir=input_path,
+                                                                             file_prefix=f"{idx_url[0]}_"),
+                                               enumerate(img_urls)))
+            img_paths = []
+            for img_url, download_result in zip(img_urls, downloaded):
+                if download_result is None:
+                    raise ValueError(f"download image failed: {img_url}")
+                img_paths.append(download_result[1])
+            return self.multiple_image_cpp_call(img_paths, output_path, self.hyperparameters)
+        finally:
+            shutil.rmtree(output_path, ignore_errors=True)
+            LOGGER.info(f"Folder '{output_path}' deleted successfully.")
+
+    def multiple_image_cpp_call(self, img_paths, output_path, hyperparameters):
+        """
+        默认逐张调用single_image_cpp_call并合并结果，支持批量推理的子类可以将其覆盖为静态函数，
+        第i张图像的输出文件需要以f"{output_path}{i}"为前缀
+        """
+        merged_result = {}
+        for i, img_path in enumerate(img_paths):
+            result = self.single_image_cpp_call(img_path, f"{output_path}{i}", hyperparameters)
+            AIBaseService.merge_single_result(merged_result, result)
+        return merged_result
+
     def handle_video(self):
         video_url = self.support_input.value
-        video_progress_key = self.args['videoProgressKey']
-
-        video_name, video_path = download_file(video_url)
         if 'taskId' not in self.args:
             raise ValueError("task id not found!")
         task_id = self.args['taskId']
+        # 进度通过任务状态和进度channel发布，不再需要前端传入videoProgressKey，兼容仍然传入的请求
+        video_progress_key = self.args.get('videoProgressKey', task_id + "_video_progress")
+
+        video_name, video_path = download_file(video_url)
         output_video_path = f"temp/output_{video_name}"
         output_jsonl_path = f"temp/output_{task_id}.jsonl"
 
@@ -200,8 +383,29 @@ class AIBaseService(ABC):
         # 那么在这种方式下，传参的类型为字符串，需要将所有参数都转换为字符串再传递给子进程
         # 那么这里为什么使用多【进程】进行调用呢
         # 因为多【线程】情况下，cpp侧在计算的时候不会让出cpu，导致Nameko服务无法接收其他请求（如服务信息上报事件响应等）
+        # 热进程池中的进程同样是以命令的方式启动的，只是提前完成了模块导入和引擎预热
+        if self.should_split_video(task_id, video_path):
+            # 分段时各段作为普通视频任务放入分派队列，本实例的槽位由协调进程占用到拼接完成。
+            # 协调进程同样交给视频脚本的热进程执行，本地处理的分段直接使用已经预热的引擎
+            split_args = [self.name, self.video_script_name] + arg_to_subprocess
+            if self.task_worker_pool.submit(self.video_script_name, split_args,
+                                            entry_script_name=self.video_split_script_name):
+                return
+            subprocess.Popen([interpreter_path, self.video_split_script_name] + split_args)
+            return
+        if self.task_worker_pool.submit(self.video_script_name, arg_to_subprocess):
+            return
         subprocess.Popen([interpreter_path, self.video_script_name] + arg_to_subprocess)
 
+    def should_split_video(self, task_id, video_path):
+        """
+        在实例中判断是否分段：视频太短或者没有其他空闲实例时按普通视频任务交给热进程，不再经过协调进程
+        """
+        if not self.video_split_supported or not config.get("video_split_enabled", False) \
+                or is_segment_task_id(task_id):
+            return False
+        return get_segment_num(self.redis_storage.client, self.name, probe_duration(video_path)) > 1
+
     @staticmethod
     def video_cpp_call(video_path, output_video_path, output_jsonl_path, video_progress_key,
                        hyperparameters, task_id, unique_id):
@@ -223,22 +427,31 @@ class AIBaseService(ABC):
                              task_id, self.unique_id, output_video_path, output_jsonl_path]
         os.environ['PYTHONPATH'] = os.getcwd()
         interpreter_path = sys.executable
-        # 这里的设计与handle_video()相同
+        # 这里的设计与handle_video()相同，支持多路摄像头推理宿主的服务优先交给宿主进程
+        if self.camera_host.submit(arg_to_subprocess):
+            return
+        if self.task_worker_pool.submit(self.camera_script_name, arg_to_subprocess):
+            return
         subprocess.Popen([interpreter_path, self.camera_script_name] + arg_to_subprocess)
 
-    def call_init(self):
+    def call_init(self, slot_id):
         output = {
             'busy': False,
             'unique_id': self.unique_id,
         }
+        task_id = ""
         if 'taskId' in self.args:
-            output['task_id'] = self.args['taskId']
-        if self.service_info.state != ServiceReadyState:
-            output['busy'] = True
-            return output
-        self.service_info.task_start_time = int(time.time() * 1000)
-        self.service_info.task_type = self.support_input.type
-        self.service_info.state = ServiceRunningState
+            task_id = self.args['taskId']
+            output['task_id'] = task_id
+        self.state_lock.acquire()
+        try:
+            slot = self.service_info.slots[slot_id]
+            slot.task_type = self.support_input.type
+            slot.task_id = task_id
+            self.service_info.task_start_time = slot.task_start_time
+            self.service_info.task_type = slot.task_type
+        finally:
+            self.state_lock.release()
         return output
 
     @staticmethod
@@ -0,0 +1,74 @@
+import json
+import os
+import subprocess
+import sys
+import threading
+from typing import List
+
+from nameko.extensions import DependencyProvider
+
+from common.config import config
+from common.log import LOGGER
+
+CAMERA_HOST_SCRIPT = "scripts/camera_host.py"
+
+
+class CameraHostProcess(DependencyProvider):
+    """
+    多路摄像头推理宿主进程。
+
+    服务类的camera_host_supported为True时（摄像头脚本提供了camera_batch_func和create_stream_func），
+    该服务实例的所有摄像头任务都交给同一个宿主进程，宿主进程在第一个摄像头任务到来时启动，
+    任务参数以一行json的形式写入宿主进程的stdin。宿主进程意外退出后，下一个任务到来时会重新启动。
+    """
+
+    def __init__(self):
+        self.enabled = config.get("camera_host_enabled", False)
+        self.process = None
+        self.script_name = ""
+        self.lock = threading.Lock()
+
+    def setup(self):
+        service_cls = self.container.service_cls
+        self.enabled = self.enabled and getattr(service_cls, 'camera_host_supported', False)
+        self.script_name = getattr(service_cls, 'camera_script_name', "")
+
+    def stop(self):
+        # 关闭stdin后宿主进程不再接收新的摄像头，已有的摄像头结束后自行退出
+        if self.process and self.process.poll() is None:
+            try:
+                self.process.stdin.close()
+            except OSError:
+                pass
+
+    def get_dependency(self, worker_ctx):
+        return self
+
+    def _spawn(self):
+        env = os.environ.copy()
+        env['PYTHONPATH'] = os.getcwd()
+        self.process = subprocess.Popen([sys.executable, CAMERA_HOST_SCRIPT, self.script_name,
+                                         self.container.service_name], stdin=subprocess.PIPE, env=env)
+        LOGGER.info(f"camera host started: {self.script_name}, pid: {self.process.pid}")
+
+    def submit(self, args: List[str]):
+        """
+        把摄像头任务交给宿主进程，成功返回True；未启用宿主进程时返回False，由调用方单独启动摄像头脚本
+        """
+        if not self.enabled:
+            return False
+        self.lock.acquire()
+        try:
+            if self.process is None or self.process.poll() is not None:
+                self._spawn()
+            try:
+                self.process.stdin.write((json.dumps(args) + '\n').encode('utf-8'))
+                self.process.stdin.flush()
+            except OSError as e:
+                LOGGER.error(f"submit camera task to host {self.process.pid} failed: {e}")
+                self.process.kill()
+                self.process = None
+                return False
+            return True
+        finally:
+            self.lock.release()
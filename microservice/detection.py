@@ -5,6 +5,7 @@ from nameko.standalone.rpc import ClusterRpcProxy
 
 from ais import tensorrt_alpha_pybind
 from common import config
+from common.engine_pool import engine_pool
 from microservice.ai_base import AIBaseService
 from microservice.manage import ManageService
 from model.ai_model import AIModel
@@ -72,7 +73,8 @@ class DetectionService(AIBaseService):
             detector_config.src_width = width
             detector_config.src_height = height
             detector_config.batch_size = 1
-            detector = tensorrt_alpha_pybind.Detector(detector_config)
+            detector = engine_pool.get((detector_config.model_file_path, width, height, detector_config.batch_size),
+                                       lambda: tensorrt_alpha_pybind.Detector(detector_config))
             frames = detector.inference(np.asarray(img.copy(), dtype=np.uint8))
             if frames and len(frames) > 0:
                 boxes = frames[0]
@@ -2,8 +2,9 @@ import cv2
 from nameko.events import event_handler, BROADCAST
 from nameko.standalone.rpc import ClusterRpcProxy
 
-from ais.yolo_hx import inference, parse_results, draw_results, parsed_to_json
+from ais.yolo_hx import batch_inference, parse_results, draw_results, parsed_to_json, YOLO_MAX_BATCH_SIZE
 from common import config
+from common.micro_batcher import MicroBatcher
 from microservice.ai_base import AIBaseService
 from microservice.manage import ManageService
 from model.ai_model import AIModel
@@ -31,6 +32,15 @@ class DetectionService(AIBaseService):
 
     video_script_name = "scripts/detection_hx_video.py"
     camera_script_name = "scripts/detection_hx_camera.py"
+    video_split_supported = True
+    camera_host_supported = True
+
+    # 每个槽位同一时间只有一个请求在等待推理结果，batch大小不会超过槽位数，超过槽位数的max_batch_size永远凑不满
+    image_batcher = MicroBatcher(lambda key, images: batch_inference(images),
+                                 window_ms=config.config.get("micro_batch_window_ms", 10),
+                                 max_batch_size=min(config.config.get("micro_batch_max_size", YOLO_MAX_BATCH_SIZE),
+                                                    config.config.get("service_slot_num", 1),
+                                                    YOLO_MAX_BATCH_SIZE))
 
     @event_handler(ManageService.name, name + "state_report", handler_type=BROADCAST, reliable_delivery=False)
     def state_report(self, payload):
@@ -48,10 +58,16 @@ class DetectionService(AIBaseService):
     def state_to_ready_handler(self, payload):
         super().state_to_ready_handler(payload)
 
+    @classmethod
+    def get_batch_metrics(cls):
+        return cls.image_batcher.metrics()
+
     @staticmethod
     def single_image_cpp_call(img_path, output_path, hyperparameters):
         img = cv2.imread(img_path)
-        results, input_images = inference(img)
+        # 同一时间窗口内到达的同分辨率图像会被合并为一次引擎调用
+        result = DetectionService.image_batcher.submit((img.shape[1], img.shape[0]), img)
+        results, input_images = [result], [img]
         frames = parse_results(results)
         output_img_path = output_path + "_0.jpg"
         draw_results(input_images, results, output_img_path)
@@ -63,3 +79,37 @@ class DetectionService(AIBaseService):
             'logs': [],
             'frames': parsed_to_json(frames),
         }
+
+    @staticmethod
+    def multiple_image_cpp_call(img_paths, output_path, hyperparameters):
+        images = [cv2.imread(img_path) for img_path in img_paths]
+        # 按分辨率分组，每组再按引擎的maxBatchSize切分，50张同分辨率的图像只需要7次引擎调用
+        resolution_groups = {}
+        for i, img in enumerate(images):
+            resolution_groups.setdefault((img.shape[1], img.shape[0]), []).append(i)
+        results = [None] * len(images)
+        for indices in resolution_groups.values():
+            for start in range(0, len(indices), YOLO_MAX_BATCH_SIZE):
+                batch_indices = indices[start:start + YOLO_MAX_BATCH_SIZE]
+                batch_results = batch_inference([images[i] for i in batch_indices])
+                for i, result in zip(batch_indices, batch_results):
+                    results[i] = result
+
+        frames = []
+        output_img_paths = []
+        for i, (img, result) in enumerate(zip(images, results)):
+            frames.extend(parsed_to_json(parse_results([result])))
+            output_img_path = f"{output_path}{i}_0.jpg"
+            draw_results([img], [result], output_img_path)
+            output_img_paths.append(output_img_path)
+
+        with ClusterRpcProxy(config.get_rpc_config()) as cluster_rpc:
+            # 异步发起全部上传请求后再统一等待结果，多张图像的上传并行进行
+            replies = [cluster_rpc.object_storage_service.upload_object.call_async(output_img_path)
+                       for output_img_path in output_img_paths]
+            urls = [reply.result() for reply in replies]
+        return {
+            'urls': urls,
+            'logs': [],
+            'frames': frames,
+        }
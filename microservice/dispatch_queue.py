@@ -0,0 +1,106 @@
+import json
+import time
+from functools import partial
+
+from nameko.extensions import Entrypoint
+
+from common.config import config
+from common.dispatch import dispatch_queue_key, dispatch_instances_key, dispatch_capacity_key, \
+    push_dispatch_reply
+from common.log import LOGGER
+from common.util import create_redis_client
+
+
+class DispatchQueueEntrypoint(Entrypoint):
+    """
+    基于redis list的任务分派入口。
+
+    实例只有在自身存在空闲容量时才会从共享队列中拉取任务，拉取到任务后占用实例容量并启动nameko worker执行，
+    执行结果写入请求携带的应答队列，由网关阻塞读取。
+    同时入口会周期性地把实例的存活时间和空闲容量上报到redis，网关据此判断是否存在可用的实例。
+
+    服务类需要提供has_free_slot、try_acquire_slot和get_free_capacity三个类方法，以及unique_id类属性，
+    try_acquire_slot返回的槽位id会以slot_id关键字参数传递给入口函数
+    """
+
+    def __init__(self, poll_interval=None, instance_ttl=None, **kwargs):
+        self.poll_interval = poll_interval if poll_interval else config.get("dispatch_poll_interval", 1)
+        self.instance_ttl = instance_ttl if instance_ttl else config.get("dispatch_instance_ttl", 10)
+        self.redis_client = None
+        self.queue_key = None
+        self.should_stop = False
+        self.gt = None
+        self.last_report_time = 0
+        super().__init__(**kwargs)
+
+    def setup(self):
+        self.redis_client = create_redis_client()
+        self.queue_key = dispatch_queue_key(self.container.service_name)
+
+    def start(self):
+        self.gt = self.container.spawn_managed_thread(self._consume)
+
+    def stop(self):
+        self.should_stop = True
+        if self.gt:
+            self.gt.wait()
+        self._remove_instance()
+
+    def kill(self):
+        self.should_stop = True
+        if self.gt:
+            self.gt.kill()
+
+    def _consume(self):
+        service_cls = self.container.service_cls
+        while not self.should_stop:
+            self.report_capacity()
+            if not service_cls.has_free_slot():
+                time.sleep(self.poll_interval / 10)
+                continue
+            item = self.redis_client.blpop(self.queue_key, timeout=self.poll_interval)
+            if item is None:
+                continue
+            _, raw_request = item
+            slot_id = service_cls.try_acquire_slot()
+            if slot_id is None:
+                # 拉取后容量被其他入口（例如rpc直接调用）占用了，把任务放回队首交给其他实例
+                self.redis_client.lpush(self.queue_key, raw_request)
+                continue
+            self.report_capacity(force=True)
+            request = json.loads(raw_request)
+            LOGGER.info(f"dispatch request received: {request['request_id']}, slot: {slot_id}")
+            self.container.spawn_worker(self, (request['args'],), {'slot_id': slot_id},
+                                        handle_result=partial(self.handle_result, request['reply_key']))
+
+    def handle_result(self, reply_key, worker_ctx, result, exc_info):
+        if exc_info is None:
+            reply = {'result': result}
+        else:
+            reply = {'error': f"{exc_info[0].__name__}: {exc_info[1]}"}
+        push_dispatch_reply(self.redis_client, reply_key, reply)
+        self.report_capacity(force=True)
+        return result, exc_info
+
+    def report_capacity(self, force=False):
+        now = time.time()
+        if not force and now - self.last_report_time < self.poll_interval:
+            return
+        self.last_report_time = now
+        service_cls = self.container.service_cls
+        service_name = self.container.service_name
+        pipeline = self.redis_client.pipeline()
+        pipeline.zadd(dispatch_instances_key(service_name), {service_cls.unique_id: now + self.instance_ttl})
+        pipeline.hset(dispatch_capacity_key(service_name), service_cls.unique_id, service_cls.get_free_capacity())
+        pipeline.execute()
+
+    def _remove_instance(self):
+        service_cls = self.container.service_cls
+        service_name = self.container.service_name
+        pipeline = self.redis_client.pipeline()
+        pipeline.zrem(dispatch_instances_key(service_name), service_cls.unique_id)
+        pipeline.hdel(dispatch_capacity_key(service_name), service_cls.unique_id)
+        pipeline.execute()
+
+
+dispatch_queue = DispatchQueueEntrypoint.decorator
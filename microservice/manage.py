@@ -74,8 +74,12 @@ class ManageService:
         return ret
 
     @rpc
-    def change_state_to_ready(self, service_name, service_unique_id):
-        self.dispatch(f"{service_name}state_change", service_unique_id)
+    def change_state_to_ready(self, service_name, service_unique_id, task_id=None):
+        payload = {
+            'unique_id': service_unique_id,
+            'task_id': task_id,
+        }
+        self.dispatch(f"{service_name}state_change", payload)
 
     @rpc
     def get_services(self, service_name):
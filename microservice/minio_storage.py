@@ -6,6 +6,15 @@ from nameko.extensions import DependencyProvider
 from common.config import config
 
 
+def create_minio_client():
+    return Minio(
+        config.get("minio_url"),
+        access_key=config.get("minio_access_key"),
+        secret_key=config.get("minio_secret_key"),
+        secure=False  # 如果Minio服务器不启用SSL，请将此值设置为False
+    )
+
+
 class MinioStorageWrapper:
 
     def __init__(self, client):
@@ -20,12 +29,7 @@ class MinioStorage(DependencyProvider):
         self.bucket_name = config.config.get("bucket_name")
 
     def setup(self):
-        self.client = Minio(
-            config.get("minio_url"),
-            access_key=config.get("minio_access_key"),
-            secret_key=config.get("minio_secret_key"),
-            secure=False  # 如果Minio服务器不启用SSL，请将此值设置为False
-        )
+        self.client = create_minio_client()
 
     def get_dependency(self, worker_ctx):
         return MinioStorageWrapper(self.client)
@@ -44,5 +44,3 @@ class ObjectStorageService:
         object_name = result.object_name
         url = self.get_object_url(object_name)
         return url
-
-
@@ -3,6 +3,7 @@ import numpy as np
 from nameko.events import event_handler, BROADCAST
 
 from ais import tensorrt_cls_pybind
+from common.engine_pool import engine_pool
 from common.log import LOGGER
 from microservice.ai_base import AIBaseService
 from model.ai_model import AIModel
@@ -10,6 +11,13 @@ from model.service_info import ServiceInfo
 from model.support_input import *
 
 
+def get_classifier():
+    config = tensorrt_cls_pybind.ClassifierConfig()
+    config.model_file_path = "E:/GraduationDesign/yolov8n-cls.trt"
+    # 分类模型的输入与原图分辨率无关，引擎池中按模型路径复用即可
+    return engine_pool.get((config.model_file_path, 0, 0, 1), lambda: tensorrt_cls_pybind.Classifier(config))
+
+
 def init_state_info():
     serviceInfo = ServiceInfo()
 
@@ -30,6 +38,7 @@ class RecognitionService(AIBaseService):
 
     video_script_name = "scripts/recognition_video.py"
     camera_script_name = "scripts/recognition_camera.py"
+    video_split_supported = True
 
     @event_handler("manage_service", name + "state_report", handler_type=BROADCAST, reliable_delivery=False)
     def state_report(self, payload):
@@ -53,9 +62,7 @@ class RecognitionService(AIBaseService):
         log_strs = []
         box_json = []
         try:
-            config = tensorrt_cls_pybind.ClassifierConfig()
-            config.model_file_path = "E:/GraduationDesign/yolov8n-cls.trt"
-            model = tensorrt_cls_pybind.Classifier(config)
+            model = get_classifier()
             idx, score = model.inference(np.asarray(img, dtype=np.uint8))
             box_json.append({
                 'label': idx,
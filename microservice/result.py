@@ -0,0 +1,144 @@
+import threading
+from collections import OrderedDict
+from datetime import timedelta
+from functools import partial
+
+from minio.error import S3Error
+from nameko.rpc import rpc
+
+from common.config import config
+from common.log import LOGGER
+from common.progressive_result import load_progressive_state, build_hls_playlist
+from common.result_container import ResultContainerReader, write_result_container, result_jsonl_object_name, \
+    result_container_object_name
+from common.task_state import get_task_state
+from common.util import remove_file
+from microservice.minio_storage import MinioStorage
+from microservice.redis_storage import RedisStorage
+
+
+class ResultService:
+    """
+    视频和摄像头任务结果的查询服务。
+
+    结果通过列式结果容器（common.result_container）查询：任务完成时由任务进程生成并上传容器，
+    没有生成时（未开启result_container_enabled，或生成失败）在第一次查询时从已上传的jsonl补建。
+    查询时根据容器的索引只通过范围读取获取与帧范围相交的chunk，不需要下载整个结果。
+
+    视频任务处理过程中上传的部分结果（HLS分片、结果分块）也通过该服务查询
+    """
+    name = "result_service"
+    minio_storage = MinioStorage()
+    redis_storage = RedisStorage()
+
+    # 最近使用的容器索引缓存在进程内，同一个任务连续翻页时不需要重复读取索引，元素为(size, frame_count, index)
+    index_cache = OrderedDict()
+    index_cache_lock = threading.Lock()
+
+    @rpc
+    def build_container(self, task_id, fps=None):
+        """
+        从已上传的jsonl结果生成列式容器并上传，返回帧数。fps为None时使用任务状态中记录的fps
+        """
+        if fps is None:
+            task_state = get_task_state(self.redis_storage.client, task_id) or {}
+            fps = float(task_state.get('fps', 0))
+        client = self.minio_storage.client
+        bucket_name = self.minio_storage.bucket_name
+        jsonl_path = f"temp/result_{task_id}.jsonl"
+        container_path = f"temp/result_{task_id}.rc"
+        try:
+            client.fget_object(bucket_name, result_jsonl_object_name(task_id), jsonl_path)
+            frame_count = write_result_container(jsonl_path, container_path, fps)
+            client.fput_object(bucket_name, result_container_object_name(task_id), container_path)
+        finally:
+            remove_file(jsonl_path)
+            remove_file(container_path)
+        LOGGER.info(f"result container built, task_id: {task_id}, frame_count: {frame_count}")
+        return frame_count
+
+    @rpc
+    def get_result(self, task_id, start_frame=0, end_frame=None, start_time=None, page_size=None):
+        """
+        返回[start_frame, end_frame)范围内每一帧的结果，每一帧为{'frame_idx', 'pts', 'data'}；
+        指定start_time（毫秒）时从pts不早于该时间的第一帧开始。
+        单次最多返回page_size帧，返回值中的next_frame用于获取下一页，没有下一页时为None
+        """
+        reader = self._open_container(task_id)
+        if start_time is not None:
+            start_frame = reader.frame_at_timestamp(start_time)
+        max_page_size = config.get("result_page_size_max", 1000)
+        page_size = min(page_size, max_page_size) if page_size else max_page_size
+        end_frame = reader.frame_count if end_frame is None else end_frame
+        end_frame = min(end_frame, start_frame + page_size, reader.frame_count)
+        frames = reader.read_frames(start_frame, end_frame) if end_frame > start_frame else []
+        return {
+            'frame_count': reader.frame_count,
+            'frames': frames,
+            'next_frame': end_frame if end_frame < reader.frame_count else None,
+        }
+
+    @rpc
+    def get_progressive_playlist(self, task_id):
+        """
+        返回处理过程中已经上传的视频分片组成的HLS playlist，分片地址为预签名URL，任务还在处理时播放器会定期重新获取
+        """
+        state, segments, _ = load_progressive_state(self.redis_storage.client, task_id)
+        if 'init' not in state:
+            return None
+        segment_urls = [(self._object_url(segment['object_name']), segment['duration']) for segment in segments]
+        return build_hls_playlist(state.get('target_duration', 0), self._object_url(state['init']), segment_urls,
+                                  'ended' in state)
+
+    @rpc
+    def get_progressive_results(self, task_id):
+        """
+        返回处理过程中已经上传的结果分块，每个分块为连续若干帧的jsonl结果
+        """
+        state, _, results = load_progressive_state(self.redis_storage.client, task_id)
+        for result in results:
+            result['url'] = self._object_url(result.pop('object_name'))
+        return {
+            'ended': 'ended' in state,
+            'results': results,
+        }
+
+    def _object_url(self, object_name):
+        return self.minio_storage.client.presigned_get_object(self.minio_storage.bucket_name, object_name,
+                                                              expires=timedelta(hours=24))
+
+    def _read_range(self, object_name, offset, length):
+        response = self.minio_storage.client.get_object(self.minio_storage.bucket_name, object_name,
+                                                        offset=offset, length=length)
+        try:
+            return response.read()
+        finally:
+            response.close()
+            response.release_conn()
+
+    def _open_container(self, task_id):
+        object_name = result_container_object_name(task_id)
+        read_func = partial(self._read_range, object_name)
+        with self.index_cache_lock:
+            cached = self.index_cache.get(task_id)
+            if cached is not None:
+                self.index_cache.move_to_end(task_id)
+                size, frame_count, index = cached
+                return ResultContainerReader(read_func, size, index, frame_count)
+        client = self.minio_storage.client
+        try:
+            size = client.stat_object(self.minio_storage.bucket_name, object_name).size
+        except S3Error as e:
+            if e.code != 'NoSuchKey':
+                raise
+            # 任务完成时没有生成容器，查询时补建
+            self.build_container(task_id)
+            size = client.stat_object(self.minio_storage.bucket_name, object_name).size
+        reader = ResultContainerReader(read_func, size)
+        reader.load_index()
+        with self.index_cache_lock:
+            self.index_cache[task_id] = (size, reader.frame_count, reader.index)
+            self.index_cache.move_to_end(task_id)
+            while len(self.index_cache) > config.get("result_index_cache_size", 128):
+                self.index_cache.popitem(last=False)
+        return reader
@@ -0,0 +1,99 @@
+import json
+import os
+import subprocess
+import sys
+import threading
+from typing import Dict, List
+
+from nameko.extensions import DependencyProvider
+
+from common.config import config
+from common.log import LOGGER
+
+TASK_WORKER_SCRIPT = "scripts/task_worker.py"
+
+
+class TaskWorkerPool(DependencyProvider):
+    """
+    视频/摄像头任务的热进程池。
+
+    每个脚本预先启动若干个task_worker进程，进程启动后即导入cv2、numpy、pybind模块并预热推理引擎，
+    然后阻塞在stdin上等待任务描述（即原本传给脚本的命令行参数列表，以一行json发送）。
+    热进程执行完一个任务后退出，进程池在派发任务的同时补充一个新的热进程，使启动开销发生在任务到来之前。
+
+    热进程仍然使用subprocess.Popen以命令的方式启动，不会继承Nameko进程的rabbitmq连接等状态，
+    与原先每个任务Popen一个脚本的隔离性相同。
+    """
+
+    def __init__(self, warm_num=None):
+        self.warm_num = warm_num if warm_num is not None else config.get("task_worker_warm_num", 1)
+        self.workers: Dict[str, List[subprocess.Popen]] = {}
+        self.lock = threading.Lock()
+
+    def setup(self):
+        service_cls = self.container.service_cls
+        script_names = [getattr(service_cls, 'video_script_name', "")]
+        # 摄像头任务交给推理宿主进程时不会用到摄像头脚本的热进程，不再预先启动
+        camera_host_enabled = (config.get("camera_host_enabled", False)
+                               and getattr(service_cls, 'camera_host_supported', False))
+        if not camera_host_enabled:
+            script_names.append(getattr(service_cls, 'camera_script_name', ""))
+        script_warm_nums = config.get("task_worker_script_warm_num", {})
+        for script_name in script_names:
+            if script_name and os.path.exists(script_name):
+                # 每个脚本的热进程数，task_worker_script_warm_num中没有配置的脚本使用task_worker_warm_num
+                warm_num = int(script_warm_nums.get(script_name, self.warm_num))
+                if warm_num <= 0:
+                    continue
+                self.workers[script_name] = []
+                for _ in range(warm_num):
+                    self._spawn(script_name)
+
+    def stop(self):
+        for workers in self.workers.values():
+            for worker in workers:
+                if worker.poll() is None:
+                    worker.terminate()
+        self.workers.clear()
+
+    def get_dependency(self, worker_ctx):
+        return self
+
+    def _spawn(self, script_name):
+        env = os.environ.copy()
+        env['PYTHONPATH'] = os.getcwd()
+        worker = subprocess.Popen([sys.executable, TASK_WORKER_SCRIPT, script_name],
+                                  stdin=subprocess.PIPE, env=env)
+        self.workers[script_name].append(worker)
+        LOGGER.info(f"task worker started: {script_name}, pid: {worker.pid}")
+
+    def submit(self, script_name, args: List[str], entry_script_name=None):
+        """
+        把任务交给一个空闲的热进程，成功返回True；没有可用的热进程时返回False，由调用方冷启动脚本。
+        entry_script_name不为None时热进程以args执行entry_script_name，而不是script_name
+        """
+        if script_name not in self.workers:
+            return False
+        self.lock.acquire()
+        try:
+            workers = self.workers[script_name]
+            # 剔除已经意外退出的热进程
+            workers[:] = [worker for worker in workers if worker.poll() is None]
+            if len(workers) == 0:
+                self._spawn(script_name)
+                return False
+            worker = workers.pop(0)
+            try:
+                task = args if entry_script_name is None else {'script': entry_script_name, 'args': args}
+                worker.stdin.write((json.dumps(task) + '\n').encode('utf-8'))
+                worker.stdin.close()
+            except OSError as e:
+                LOGGER.error(f"submit task to worker {worker.pid} failed: {e}")
+                worker.kill()
+                self._spawn(script_name)
+                return False
+            LOGGER.info(f"task submitted to warm worker: {script_name}, pid: {worker.pid}")
+            self._spawn(script_name)
+            return True
+        finally:
+            self.lock.release()
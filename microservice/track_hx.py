@@ -27,6 +27,7 @@ class TrackService(AIBaseService):
 
     video_script_name = "scripts/track_hx_video.py"
     camera_script_name = "scripts/track_hx_camera.py"
+    camera_host_supported = True
 
     @event_handler(ManageService.name, name + "state_report", handler_type=BROADCAST, reliable_delivery=False)
     def state_report(self, payload):
@@ -1,4 +1,5 @@
 import time
+from typing import List
 
 from common.util import JsonBase, get_hostname
 from model.ai_model import AIModel
@@ -7,6 +8,22 @@ ServiceReadyState = "ready"
 ServiceRunningState = "running"
 
 
+class ServiceSlot(JsonBase):
+    """
+    服务实例中的一个并发槽位，每个槽位同一时刻只承载一个任务
+    """
+    def __init__(self, slot_id=0):
+        super().__init__()
+        self.slot_id: int = slot_id
+        self.state: str = ServiceReadyState
+        self.task_start_time: int = 0
+        self.task_type: str = ""
+        self.task_id: str = ""
+
+    def __json__(self):
+        return self.__str__()
+
+
 class ServiceInfo(JsonBase):
     def __init__(self):
         super().__init__()
@@ -14,6 +31,10 @@ class ServiceInfo(JsonBase):
         self.task_start_time: int = int(time.time() * 1000)
         self.hostname: str = get_hostname()
         self.task_type: str = ""
+        self.slots: List[ServiceSlot] = []
+        self.batch_metrics: dict = {}
+        self.engine_pool_metrics: dict = {}
+        self.image_cache_metrics: dict = {}
 
         self.model: AIModel = AIModel()
 
@@ -6,14 +6,18 @@ from nameko.standalone.rpc import ClusterRpcProxy
 
 from common import config
 from common.log import LOGGER
-from common.util import is_integer
+from common.result_container import write_result_container, result_jsonl_object_name, result_container_object_name
+from common.task_state import update_task_state, STATE_UPLOADING, STATE_DONE
+from common.util import is_integer, remove_file, create_redis_client
 from microservice.mqtt_storage import MQTTStorage
 from model.hyperparameter import Hyperparameter
 from model.task import Task
 
 
-def parse_camera_command_args():
-    args = sys.argv[1:]
+def parse_camera_command_args(args=None):
+    # args为None时从命令行读取参数，多路摄像头推理宿主从stdin读取参数后直接传入
+    if args is None:
+        args = sys.argv[1:]
     print("Received arguments:", args)
     if len(args) != 7:
         raise ValueError('args length error')
@@ -31,9 +35,15 @@ def parse_camera_command_args():
 
 
 def after_camera_call(camera_output_path, camera_output_json_path, task_id, service_name, service_unique_id):
+    redis_client = create_redis_client()
+    update_task_state(redis_client, task_id, STATE_UPLOADING)
     with ClusterRpcProxy(config.get_rpc_config()) as cluster_rpc:
         video_url = cluster_rpc.object_storage_service.upload_object(camera_output_path)
-        json_url = cluster_rpc.object_storage_service.upload_object(camera_output_json_path)
+        json_url = cluster_rpc.object_storage_service.upload_object(camera_output_json_path,
+                                                                    result_jsonl_object_name(task_id))
+        result_object = upload_result_container(cluster_rpc, camera_output_json_path, task_id)
+        update_task_state(redis_client, task_id, STATE_DONE, video_url=video_url, json_url=json_url,
+                          result_object=result_object)
 
         mqtt_storage = MQTTStorage()
         mqtt_storage.setup()
@@ -42,14 +52,36 @@ def after_camera_call(camera_output_path, camera_output_json_path, task_id, serv
             'video_url': video_url,
             'json_url': json_url,
         }
+        if result_object:
+            msg['result_object'] = result_object
         LOGGER.info(f"msg = {msg}")
         insert_async_task_request_log(cluster_rpc, msg)
         mqtt_storage.push_message(json.dumps(msg))
         mqtt_storage.client.loop(timeout=1)
-        cluster_rpc.manage_service.change_state_to_ready(service_name, service_unique_id)
+        cluster_rpc.manage_service.change_state_to_ready(service_name, service_unique_id, task_id)
         LOGGER.info(f"camera task done, task_id:{task_id}")
 
 
+def upload_result_container(cluster_rpc, output_json_path, task_id, fps=0):
+    """
+    把本地的jsonl结果转换为列式容器并上传，返回对象名，结果服务通过容器按帧范围或时间分页查询结果。
+    未开启或转换失败时返回None，不影响jsonl结果的上传，结果服务在第一次查询时从已上传的jsonl生成容器
+    """
+    if not config.config.get("result_container_enabled", False):
+        return None
+    container_path = f"temp/output_{task_id}.rc"
+    object_name = result_container_object_name(task_id)
+    try:
+        write_result_container(output_json_path, container_path, fps)
+        cluster_rpc.object_storage_service.upload_object(container_path, object_name)
+        return object_name
+    except Exception as e:
+        LOGGER.error(f"upload result container failed, task_id: {task_id}, error: {e}")
+        return None
+    finally:
+        remove_file(container_path)
+
+
 def insert_async_task_request_log(rpc_obj, msg):
     task_id = msg['task_id']
     task_dict: dict = rpc_obj.monitor_service.get_task_by_task_id(task_id)
@@ -0,0 +1,48 @@
+import json
+import sys
+import threading
+
+from common.log import LOGGER
+from scripts.camera_common import parse_camera_command_args
+from scripts.task_worker import load_script_module
+from video.camera_host import CameraHost
+
+
+def read_camera_tasks(camera_host: CameraHost):
+    # 每一行是一个摄像头任务的参数列表，与单独启动摄像头脚本时的命令行参数相同
+    for line in sys.stdin:
+        line = line.strip()
+        if not line:
+            continue
+        try:
+            camera_host.add_stream(*parse_camera_command_args(json.loads(line)))
+        except Exception as e:
+            LOGGER.error(f"camera host parse task failed: {e}")
+    # stdin被关闭表示服务实例停止，不再接收新的摄像头
+    camera_host.close()
+
+
+def main():
+    """
+    多路摄像头推理宿主入口：python scripts/camera_host.py <camera_script_name> <service_name>
+
+    摄像头脚本需要提供camera_batch_func(frames)和create_stream_func()，
+    可选提供warm_up()以及创建CameraTemplate时的额外参数camera_template_options
+    """
+    script_name, service_name = sys.argv[1], sys.argv[2]
+    module = load_script_module(script_name)
+    warm_up = getattr(module, 'warm_up', None)
+    if warm_up:
+        try:
+            warm_up()
+        except Exception as e:
+            LOGGER.error(f"camera host warm up failed: {e}")
+    camera_host = CameraHost(service_name, module.camera_batch_func, module.create_stream_func,
+                             template_options=getattr(module, 'camera_template_options', None))
+    threading.Thread(target=read_camera_tasks, args=[camera_host], daemon=True).start()
+    LOGGER.info(f"camera host ready: {script_name}")
+    camera_host.run()
+
+
+if __name__ == '__main__':
+    main()
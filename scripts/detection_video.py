@@ -1,10 +1,10 @@
 import json
-from datetime import timedelta
 
 import cv2
 import numpy as np
 
 from common.log import LOGGER
+from common.progress_publisher import ProgressPublisher
 from common.util import create_redis_client, clear_video_temp_resource
 from microservice.detection import DetectionService
 from scripts.video_common import after_video_call, parse_video_command_args
@@ -36,7 +36,8 @@ def video_cpp_call(video_path, video_output_path, video_output_json_path, video_
 
         out = cv2.VideoWriter(video_output_path, cv2.VideoWriter_fourcc(*'avc1'), fps, (frame_width, frame_height))
         redis_client = create_redis_client()
-        redis_client.setex(name=video_progress_key, time=timedelta(days=1), value="0.00")
+        progress_publisher = ProgressPublisher(redis_client, task_id)
+        progress_publisher.update(0, force=True)
         with open(video_output_json_path, 'w') as f:
             # 逐帧读取视频
             while True:
@@ -46,8 +47,7 @@ def video_cpp_call(video_path, video_output_path, video_output_json_path, video_
                 if not ret:
                     break
                 current_frame_count += 1
-                progress_str = "%.2f" % (current_frame_count / total_frame_count)
-                redis_client.setex(name=video_progress_key, time=timedelta(days=1), value=progress_str)
+                progress_publisher.update(current_frame_count / total_frame_count)
                 # 对帧进行处理
                 frame_boxes = detector.inference(np.asarray(image.copy(), dtype=np.uint8))
                 json_items = []
@@ -78,6 +78,8 @@ def video_cpp_call(video_path, video_output_path, video_output_json_path, video_
                 f.write(json.dumps(json_items) + '\n')
                 out.write(image)
 
+            if current_frame_count > 0:
+                progress_publisher.update(current_frame_count / total_frame_count, force=True)
             # 释放资源
             video_capture.release()
             out.release()
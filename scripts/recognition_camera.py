@@ -1,16 +1,17 @@
-from ais import tensorrt_cls_pybind
 from common.util import clear_camera_temp_resource
-from microservice.recognition import RecognitionService
+from microservice.recognition import RecognitionService, get_classifier
 from scripts.camera_common import after_camera_call, parse_camera_command_args
 from video.camera_template import CameraTemplate
 
 
+def warm_up():
+    get_classifier()
+
+
 def camera_cpp_call(camera_id, hyperparameters, namespace, task_id, service_unique_id,
                     camera_output_path, camera_output_json_path):
     try:
-        config = tensorrt_cls_pybind.ClassifierConfig()
-        config.model_file_path = "E:/GraduationDesign/yolov8n-cls.trt"
-        model = tensorrt_cls_pybind.Classifier(config)
+        model = get_classifier()
 
         def ai_func(img):
             idx, score = model.inference(img)
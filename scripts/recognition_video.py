@@ -1,18 +1,19 @@
 import numpy as np
 
-from ais import tensorrt_cls_pybind
 from common.util import clear_video_temp_resource
-from microservice.recognition import RecognitionService
+from microservice.recognition import RecognitionService, get_classifier
 from scripts.video_common import parse_video_command_args
 from video.video_template import VideoTemplate
 
 
+def warm_up():
+    get_classifier()
+
+
 def video_cpp_call(video_path, video_output_path, video_output_json_path, video_progress_key,
                    hyperparameters, task_id, service_unique_id):
     try:
-        config = tensorrt_cls_pybind.ClassifierConfig()
-        config.model_file_path = "E:/GraduationDesign/yolov8n-cls.trt"
-        model = tensorrt_cls_pybind.Classifier(config)
+        model = get_classifier()
 
         def ai_func(image):
             idx, score = model.inference(np.asarray(image, dtype=np.uint8))
@@ -0,0 +1,51 @@
+import importlib.util
+import json
+import runpy
+import sys
+
+from common.log import LOGGER
+
+
+def load_script_module(script_name):
+    # 以普通模块的方式导入任务脚本，脚本的__main__分支不会执行，只会导入其依赖的重量级模块
+    spec = importlib.util.spec_from_file_location("task_worker_script", script_name)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+def main():
+    """
+    热进程入口：python scripts/task_worker.py <script_name>
+
+    启动时先导入任务脚本并调用脚本中可选的warm_up()函数预热推理引擎，
+    然后从stdin读取一行json格式的参数列表，以__main__的方式执行脚本，执行完毕后进程退出。
+    由于依赖模块已经在sys.modules中，引擎也已经在common.engine_pool中，脚本执行时不会再重复这部分开销。
+
+    读取到的是{'script': 入口脚本, 'args': 参数列表}时改为执行入口脚本，
+    例如长视频的协调进程在视频脚本的热进程中运行，本地处理分段时直接使用已经预热的引擎
+    """
+    script_name = sys.argv[1]
+    module = load_script_module(script_name)
+    warm_up = getattr(module, 'warm_up', None)
+    if warm_up:
+        try:
+            warm_up()
+        except Exception as e:
+            LOGGER.error(f"task worker warm up failed: {e}")
+    LOGGER.info(f"task worker ready: {script_name}")
+
+    line = sys.stdin.readline()
+    if not line:
+        # 进程池关闭时stdin被关闭，没有收到任务直接退出
+        return
+    task = json.loads(line)
+    entry_script_name = script_name
+    if isinstance(task, dict):
+        entry_script_name, task = task['script'], task['args']
+    sys.argv = [entry_script_name] + task
+    runpy.run_path(entry_script_name, run_name='__main__')
+
+
+if __name__ == '__main__':
+    main()
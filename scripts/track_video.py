@@ -12,7 +12,8 @@ def video_cpp_call(video_path, video_output_path, video_output_json_path, video_
                    hyperparameters, task_id, service_unique_id):
     try:
         video_template = VideoTemplate(video_path, video_output_path, video_output_json_path, video_progress_key,
-                                       hyperparameters, task_id, service_unique_id, RecognitionService.name)
+                                       hyperparameters, task_id, service_unique_id, RecognitionService.name,
+                                       stateful=True)
 
         detector_config = tensorrt_alpha_pybind.DetectorConfig()
         detector_config.model_file_path = "E:/GraduationDesign/yolov8n.trt"
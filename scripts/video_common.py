@@ -1,19 +1,25 @@
 import json
 import sys
-from datetime import timedelta
 
 from nameko.standalone.rpc import ClusterRpcProxy
 
 from common import config
 from common.log import LOGGER
-from common.util import create_redis_client
+from common.progress_publisher import publish_video_done
+from common.result_container import result_jsonl_object_name
+from common.task_state import update_task_state, STATE_UPLOADING, STATE_DONE, STATE_FAILED
+from common.util import create_redis_client, get_video_fps
 from microservice.mqtt_storage import MQTTStorage
 from model.hyperparameter import Hyperparameter
-from scripts.camera_common import insert_async_task_request_log
+from scripts.camera_common import insert_async_task_request_log, upload_result_container
+from video.stream_upload import result_video_object_name
+from video.video_segment import is_segment_task_id, push_segment_result
 
 
-def parse_video_command_args():
-    args = sys.argv[1:]
+def parse_video_command_args(args=None):
+    # args为None时从命令行读取参数，长视频的协调进程在本进程中处理分段时直接传入
+    if args is None:
+        args = sys.argv[1:]
     print("Received arguments:", args)
     if len(args) != 7:
         raise ValueError('args length error')
@@ -28,21 +34,49 @@ def parse_video_command_args():
         hps, task_id, service_unique_id
 
 
-def after_video_call(video_output_path, video_output_json_path, task_id, service_name, service_unique_id):
+def after_video_call(video_output_path, video_output_json_path, task_id, service_name, service_unique_id,
+                     stream_uploaded=False, stream_failed=False, fps=None, error=None):
     """
     由于多进程进行传参时，无法将rpc对象以及redis client对象进行传递，所以只能重新创建对象来进行服务调用。
     如果你有更好的方法，可以将其改进。
+
+    stream_uploaded为True表示输出视频和jsonl已经在处理过程中上传完毕（本地没有完整的输出视频），只需要生成下载链接；
+    stream_failed为True表示边处理边上传中途失败，没有输出视频，只上传本地的jsonl，任务状态记为failed。
+    error不为None表示处理中途失败，已经输出的部分结果照常上传，任务状态记为failed
     """
+    client = create_redis_client()
+    update_task_state(client, task_id, STATE_UPLOADING)
     with ClusterRpcProxy(config.get_rpc_config()) as cluster_rpc:
-        video_url = cluster_rpc.object_storage_service.upload_object(video_output_path)
-        json_url = cluster_rpc.object_storage_service.upload_object(video_output_json_path)
-        client = create_redis_client()
-        mapping = {
-            "video_url": video_url,
-            "json_url": json_url,
-        }
-        client.hset(name=task_id, mapping=mapping)
-        client.expire(name=task_id, time=timedelta(hours=24))
+        object_storage_service = cluster_rpc.object_storage_service
+        if stream_uploaded:
+            video_url = object_storage_service.get_object_url(result_video_object_name(task_id))
+            json_url = object_storage_service.get_object_url(result_jsonl_object_name(task_id))
+        elif stream_failed:
+            video_url = None
+            json_url = object_storage_service.upload_object(video_output_json_path, result_jsonl_object_name(task_id))
+            error = error if error is not None else "stream upload failed"
+        else:
+            # 视频和jsonl同时上传，不再串行等待
+            video_reply = object_storage_service.upload_object.call_async(video_output_path)
+            json_reply = object_storage_service.upload_object.call_async(video_output_json_path,
+                                                                         result_jsonl_object_name(task_id))
+            video_url = video_reply.result()
+            json_url = json_reply.result()
+        final_state = STATE_FAILED if error is not None else STATE_DONE
+        if is_segment_task_id(task_id):
+            # 长视频的分段只把结果交给协调进程，由协调进程拼接后作为父任务的结果发布，失败的分段不参与拼接
+            push_segment_result(client, task_id, video_url, json_url, error)
+            update_task_state(client, task_id, final_state, video_url=video_url, json_url=json_url, error=error)
+            cluster_rpc.manage_service.change_state_to_ready(service_name, service_unique_id, task_id)
+            LOGGER.info(f"video segment done, task_id:{task_id}")
+            return
+        if not fps:
+            fps = get_video_fps(video_output_path) or 0
+        result_object = upload_result_container(cluster_rpc, video_output_json_path, task_id, fps)
+        # 没有在这里生成容器时，结果服务根据记录的fps从jsonl补建容器
+        update_task_state(client, task_id, final_state, video_url=video_url, json_url=json_url,
+                          result_object=result_object, fps=fps, error=error)
+        publish_video_done(client, task_id, video_url, json_url)
         mqtt_storage = MQTTStorage()
         mqtt_storage.setup()
         msg = {
@@ -50,8 +84,10 @@ def after_video_call(video_output_path, video_output_json_path, task_id, service
             'video_url': video_url,
             'json_url': json_url,
         }
+        if result_object:
+            msg['result_object'] = result_object
         insert_async_task_request_log(cluster_rpc, msg)
         mqtt_storage.push_message(json.dumps(msg))
         mqtt_storage.client.loop(timeout=1)
-        cluster_rpc.manage_service.change_state_to_ready(service_name, service_unique_id)
+        cluster_rpc.manage_service.change_state_to_ready(service_name, service_unique_id, task_id)
         LOGGER.info(f"video task done, task_id:{task_id}")
@@ -0,0 +1,214 @@
+import json
+import math
+import shutil
+import sys
+import threading
+import time
+
+from nameko.standalone.rpc import ClusterRpcProxy
+
+from common import config
+from common.dispatch import submit_dispatch_request, withdraw_dispatch_request
+from common.log import LOGGER
+from common.progress_publisher import ProgressPublisher
+from common.task_state import update_task_state, get_task_states, STATE_QUEUED, STATE_RUNNING, STATE_FAILED
+from common.util import create_redis_client, download_file, clear_video_temp_resource
+from model.support_input import VIDEO_URL_TYPE
+from scripts.task_worker import load_script_module
+from scripts.video_common import after_video_call, parse_video_command_args
+from video.video_segment import probe_duration, split_video, concat_videos, concat_jsonl, segment_task_id, \
+    segment_result_key, get_segment_num
+
+
+class SegmentTask:
+
+    def __init__(self, index, task_id, segment_path, segment_url):
+        self.index = index
+        self.task_id = task_id
+        self.segment_path = segment_path
+        self.segment_url = segment_url
+        self.video_progress_key = task_id + "_video_progress"
+        # 放入分派队列的原始请求，为None表示由本进程处理
+        self.raw_request = None
+
+
+def run_video_script(video_script_name, args):
+    """
+    在本进程中执行视频脚本的video_cpp_call，等待其结束。
+    协调进程由服务实例交给视频脚本的热进程执行，脚本依赖的模块已经导入、推理引擎已经预热，本地处理分段时不再冷启动
+    """
+    module = load_script_module(video_script_name)
+    module.video_cpp_call(*parse_video_command_args(args))
+
+
+class VideoSplitCoordinator:
+    """
+    长视频分段并行处理的协调进程：
+
+    1. 按关键帧把视频切分为多段并上传，每一段作为一个普通的视频任务放入服务的分派队列，由空闲的实例拉取处理
+    2. 本进程同时处理第一段，处理完后撤回还没有被其他实例取走的分段，继续在本地处理
+    3. 各段处理完毕后把结果推入父任务的分段结果列表，本进程汇总进度，按顺序拼接mp4和jsonl后作为父任务的结果上传
+    """
+
+    def __init__(self, service_name, video_script_name, video_path, video_output_path, video_output_json_path,
+                 video_progress_key, hyperparameters_json_str, task_id, service_unique_id):
+        self.service_name = service_name
+        self.video_script_name = video_script_name
+        self.video_path = video_path
+        self.video_output_path = video_output_path
+        self.video_output_json_path = video_output_json_path
+        self.video_progress_key = video_progress_key
+        self.hyperparameters_json_str = hyperparameters_json_str
+        self.task_id = task_id
+        self.service_unique_id = service_unique_id
+        self.segment_dir = f"temp/segments_{task_id}"
+        self.redis_client = create_redis_client()
+        self.progress_publisher = ProgressPublisher(self.redis_client, task_id)
+        self.segment_tasks = []
+        # 任意一段失败后父任务失败，本地不再处理剩余的分段
+        self.failed = False
+
+    def run(self):
+        try:
+            duration = probe_duration(self.video_path)
+            segment_num = get_segment_num(self.redis_client, self.service_name, duration)
+            if segment_num > 1:
+                segment_paths = split_video(self.video_path, math.ceil(duration / segment_num), self.segment_dir)
+            else:
+                segment_paths = []
+            if len(segment_paths) <= 1:
+                # 实例决定分段之后空闲实例被占用，按普通视频任务处理，视频脚本负责上传结果、记录状态和释放槽位
+                LOGGER.info(f"video split skipped, task_id: {self.task_id}, duration: {duration}")
+                try:
+                    run_video_script(self.video_script_name,
+                                     [self.video_path, self.video_output_path, self.video_output_json_path,
+                                      self.video_progress_key, self.hyperparameters_json_str, self.task_id,
+                                      self.service_unique_id])
+                except Exception as e:
+                    LOGGER.error(f"process video failed, task_id: {self.task_id}, error: {e}")
+                return
+            LOGGER.info(f"video split into {len(segment_paths)} segments, task_id: {self.task_id}")
+            self.progress_publisher.update(0, force=True)
+            self.dispatch_segments(segment_paths)
+            results = self.wait_segment_results()
+            self.merge_segment_results(results)
+            after_video_call(self.video_output_path, self.video_output_json_path,
+                             self.task_id, self.service_name, self.service_unique_id)
+        except Exception as e:
+            self.failed = True
+            LOGGER.error(f"video split failed, task_id: {self.task_id}, error: {e}")
+            self.progress_publisher.log(f"video split failed: {e}")
+            update_task_state(self.redis_client, self.task_id, STATE_FAILED, error=str(e))
+            # 撤回还没有被取走的分段，并释放父任务占用的槽位
+            for segment_task in self.segment_tasks:
+                if segment_task.raw_request:
+                    withdraw_dispatch_request(self.redis_client, self.service_name, segment_task.raw_request)
+            with ClusterRpcProxy(config.get_rpc_config()) as cluster_rpc:
+                cluster_rpc.manage_service.change_state_to_ready(self.service_name, self.service_unique_id,
+                                                                 self.task_id)
+            raise
+        finally:
+            self.redis_client.delete(segment_result_key(self.task_id))
+            shutil.rmtree(self.segment_dir, ignore_errors=True)
+            clear_video_temp_resource(self.video_path, self.video_output_path, self.video_output_json_path)
+
+    def dispatch_segments(self, segment_paths):
+        with ClusterRpcProxy(config.get_rpc_config()) as cluster_rpc:
+            for index, segment_path in enumerate(segment_paths):
+                segment_url = cluster_rpc.object_storage_service.upload_object(segment_path)
+                self.segment_tasks.append(SegmentTask(index, segment_task_id(self.task_id, index),
+                                                      segment_path, segment_url))
+        hyperparameters = json.loads(self.hyperparameters_json_str)
+        for segment_task in self.segment_tasks:
+            update_task_state(self.redis_client, segment_task.task_id, STATE_QUEUED, service_name=self.service_name,
+                              source=VIDEO_URL_TYPE)
+        for segment_task in self.segment_tasks[1:]:
+            segment_task.raw_request = submit_dispatch_request(self.redis_client, self.service_name, {
+                'supportInput': {'type': VIDEO_URL_TYPE, 'format': '', 'value': segment_task.segment_url},
+                'hyperparameters': hyperparameters,
+                'taskId': segment_task.task_id,
+            })
+        threading.Thread(target=self.process_local_segments, daemon=True).start()
+
+    def process_local_segments(self):
+        # 先处理第一段，然后从后往前撤回还没有被取走的分段，后放入队列的分段被取走的可能性最小
+        local_tasks = [self.segment_tasks[0]]
+        while len(local_tasks) > 0 and not self.failed:
+            segment_task = local_tasks.pop()
+            self.process_segment(segment_task)
+            for candidate in reversed(self.segment_tasks):
+                if candidate.raw_request and withdraw_dispatch_request(self.redis_client, self.service_name,
+                                                                       candidate.raw_request):
+                    candidate.raw_request = None
+                    local_tasks.append(candidate)
+                    break
+
+    def process_segment(self, segment_task: SegmentTask):
+        LOGGER.info(f"process segment locally: {segment_task.task_id}")
+        update_task_state(self.redis_client, segment_task.task_id, STATE_RUNNING, instance_id=self.service_unique_id)
+        try:
+            run_video_script(self.video_script_name,
+                             [segment_task.segment_path, f"temp/output_{segment_task.task_id}.mp4",
+                              f"temp/output_{segment_task.task_id}.jsonl", segment_task.video_progress_key,
+                              self.hyperparameters_json_str, segment_task.task_id, self.service_unique_id])
+        except Exception as e:
+            # 视频脚本在after_video_call之前失败时不会推入分段结果，这里记录失败状态，协调进程据此结束父任务
+            LOGGER.error(f"process segment failed: {segment_task.task_id}, error: {e}")
+            update_task_state(self.redis_client, segment_task.task_id, STATE_FAILED, error=str(e))
+
+    def wait_segment_results(self):
+        results = {}
+        timeout = config.config.get("video_split_segment_timeout", 3600)
+        poll_interval = config.config.get("video_split_progress_interval", 1)
+        deadline = time.time() + timeout
+        segment_task_ids = [segment_task.task_id for segment_task in self.segment_tasks]
+        while len(results) < len(self.segment_tasks):
+            if time.time() > deadline:
+                raise TimeoutError(f"segments not finished: {len(results)}/{len(self.segment_tasks)}")
+            item = self.redis_client.blpop(segment_result_key(self.task_id), timeout=poll_interval)
+            if item:
+                result = json.loads(item[1])
+                if result.get('error') is not None:
+                    # 中途失败的分段只有部分结果，不能拼接进父任务的结果
+                    raise ValueError(f"segment {result['index']} failed: {result['error']}")
+                results[result['index']] = result
+                LOGGER.info(f"segment finished: {result['index']}, task_id: {self.task_id}")
+            # 各段长度接近，总进度取各段进度的平均值，各段的状态记录一次批量读取
+            task_states = get_task_states(self.redis_client, segment_task_ids)
+            for task_id, state in task_states.items():
+                # 下载分段或创建视频模板时失败的分段不会推入结果，只记录了失败状态，不再等待到超时
+                if state and state.get('state') == STATE_FAILED:
+                    raise ValueError(f"segment {task_id} failed: {state.get('error')}")
+            states = task_states.values()
+            progress = sum(float(state.get('progress', 0)) if state else 0 for state in states) / len(states)
+            self.progress_publisher.update(progress)
+        return [results[index] for index in range(len(self.segment_tasks))]
+
+    def merge_segment_results(self, results):
+        video_paths = []
+        jsonl_paths = []
+        for result in results:
+            downloaded_video = download_file(result['video_url'], temp_dir=self.segment_dir)
+            downloaded_json = download_file(result['json_url'], temp_dir=self.segment_dir)
+            if downloaded_video is None or downloaded_json is None:
+                raise ValueError(f"download segment result failed: {result['index']}")
+            video_paths.append(downloaded_video[1])
+            jsonl_paths.append(downloaded_json[1])
+        concat_videos(video_paths, self.video_output_path)
+        concat_jsonl(jsonl_paths, self.video_output_json_path)
+        LOGGER.info(f"segments merged, task_id: {self.task_id}")
+
+
+def main():
+    """
+    入口：python scripts/video_split.py <service_name> <video_script_name> <视频脚本的7个参数>
+    """
+    args = sys.argv[1:]
+    print("Received arguments:", args)
+    if len(args) != 9:
+        raise ValueError('args length error')
+    VideoSplitCoordinator(*args).run()
+
+
+if __name__ == '__main__':
+    main()
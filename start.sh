@@ -15,6 +15,7 @@ nohup python cgi/main.py > log_cgi &
 nohup nameko run --config nameko_config.yaml microservice.manage:ManageService > log_manage  &
 nohup nameko run --config nameko_config.yaml microservice.monitor:MonitorService > log_monitor &
 nohup nameko run --config nameko_config.yaml microservice.object_storage:ObjectStorageService > log_object_storage &
+nohup nameko run --config nameko_config.yaml microservice.result:ResultService > log_result &
 nohup nameko run --config nameko_config.yaml microservice.user:UserService > log_user &
 
 nohup nameko run --config nameko_config.yaml microservice.detection_hx:DetectionService > log_detection &
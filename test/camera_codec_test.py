@@ -0,0 +1,94 @@
+import pytest
+
+from common.camera_codec import CameraDataEncoder, CameraDataDecoder, is_delta_payload, SCORE_SCALE
+
+
+def make_item(xmin, ymin, w, h, label=1, score=0.5, track_id=None):
+    json_item = {'xmin': xmin, 'ymin': ymin, 'w': w, 'h': h, 'label': label, 'score': score}
+    if track_id is not None:
+        json_item['track_id'] = track_id
+    return json_item
+
+
+def assert_items_equal(decoded_items, json_items):
+    assert len(decoded_items) == len(json_items)
+    for decoded_item, json_item in zip(decoded_items, json_items):
+        for name in ['xmin', 'ymin', 'w', 'h', 'label']:
+            assert decoded_item[name] == json_item[name]
+        # score量化为uint16
+        assert decoded_item['score'] == pytest.approx(json_item['score'], abs=1 / SCORE_SCALE)
+        assert decoded_item.get('track_id') == json_item.get('track_id')
+
+
+def test_keyframe_round_trip():
+    encoder = CameraDataEncoder(keyframe_interval=30)
+    decoder = CameraDataDecoder()
+    json_items = [make_item(10, 20, 100, 200, label=3, score=0.91),
+                  make_item(-5, 0, 32767, 1, label=255, score=1.0)]
+    payload = encoder.encode(json_items, timestamp=1700000000123, frame_age_ms=40)
+    assert not is_delta_payload(payload)
+    decoded = decoder.decode(payload)
+    assert decoded['timestamp'] == 1700000000123
+    assert decoded['frame_age_ms'] == 40
+    assert decoded['seq'] == 0
+    assert_items_equal(decoded['data'], json_items)
+
+
+def test_empty_frame_round_trip():
+    encoder = CameraDataEncoder()
+    decoded = CameraDataDecoder().decode(encoder.encode([], timestamp=5))
+    assert decoded['data'] == []
+    assert decoded['timestamp'] == 5
+
+
+def test_delta_frames_round_trip():
+    encoder = CameraDataEncoder(keyframe_interval=30)
+    decoder = CameraDataDecoder()
+    frames = [[make_item(100 + i, 50 - i, 80, 60 + i, track_id=7),
+               make_item(300, 300 + 2 * i, 40, 40, label=2, track_id=9)] for i in range(5)]
+    for i, json_items in enumerate(frames):
+        payload = encoder.encode(json_items, timestamp=i)
+        # 第一帧是关键帧，之后的目标都出现在上一帧中且位移很小，使用差分帧
+        assert is_delta_payload(payload) == (i > 0)
+        decoded = decoder.decode(payload)
+        assert decoded['seq'] == i
+        assert_items_equal(decoded['data'], json_items)
+
+
+def test_keyframe_when_delta_not_possible():
+    encoder = CameraDataEncoder(keyframe_interval=3)
+    decoder = CameraDataDecoder()
+    frames = [
+        [make_item(0, 0, 10, 10, track_id=1)],
+        # 位移超出int8范围
+        [make_item(500, 0, 10, 10, track_id=1)],
+        [make_item(501, 0, 10, 10, track_id=1)],
+        # 出现新目标
+        [make_item(502, 0, 10, 10, track_id=1), make_item(0, 0, 5, 5, track_id=2)],
+        [make_item(503, 0, 10, 10, track_id=1), make_item(1, 0, 5, 5, track_id=2)],
+        [make_item(504, 0, 10, 10, track_id=1), make_item(2, 0, 5, 5, track_id=2)],
+        # 到达关键帧间隔
+        [make_item(505, 0, 10, 10, track_id=1), make_item(3, 0, 5, 5, track_id=2)],
+    ]
+    expected_delta = [False, False, True, False, True, True, False]
+    for json_items, is_delta in zip(frames, expected_delta):
+        payload = encoder.encode(json_items)
+        assert is_delta_payload(payload) == is_delta
+        assert_items_equal(decoder.decode(payload)['data'], json_items)
+
+
+def test_force_keyframe():
+    encoder = CameraDataEncoder()
+    encoder.encode([make_item(0, 0, 10, 10, track_id=1)])
+    encoder.force_keyframe()
+    payload = encoder.encode([make_item(1, 0, 10, 10, track_id=1)])
+    assert not is_delta_payload(payload)
+    # 丢失之前所有帧的解码器也能从关键帧开始解码
+    assert_items_equal(CameraDataDecoder().decode(payload)['data'], [make_item(1, 0, 10, 10, track_id=1)])
+
+
+def test_decode_rejects_invalid_data():
+    payload = bytearray(CameraDataEncoder().encode([]))
+    payload[0:2] = b'XX'
+    with pytest.raises(ValueError):
+        CameraDataDecoder().decode(bytes(payload))
@@ -0,0 +1,91 @@
+import pytest
+
+from common.engine_pool import EnginePool
+
+
+@pytest.fixture
+def engine_files(tmp_path):
+    """
+    src_width和src_height为0时引擎的估算大小等于trt文件大小
+    """
+    def create(name, size):
+        path = tmp_path / name
+        path.write_bytes(b'\0' * size)
+        return (str(path), 0, 0, 1)
+
+    return create
+
+
+def create_pool(budget_bytes):
+    pool = EnginePool(memory_budget_mb=0)
+    pool.memory_budget = budget_bytes
+    return pool
+
+
+def test_hit_reuses_engine(engine_files):
+    pool = create_pool(1000)
+    key = engine_files('a.trt', 100)
+    created = []
+    factory = lambda: created.append(key) or object()
+    engine = pool.get(key, factory)
+    assert pool.get(key, factory) is engine
+    assert len(created) == 1
+    metrics = pool.metrics()
+    assert metrics['hit_count'] == 1
+    assert metrics['miss_count'] == 1
+
+
+def test_evicts_least_recently_used_by_cost(engine_files):
+    pool = create_pool(1000)
+    key_a = engine_files('a.trt', 400)
+    key_b = engine_files('b.trt', 400)
+    key_c = engine_files('c.trt', 150)
+    key_d = engine_files('d.trt', 550)
+    pool.get(key_a, object)
+    pool.get(key_b, object)
+    pool.get(key_c, object)
+    assert pool.used_bytes == 950
+    # 使用a之后b成为最久未使用的引擎
+    pool.get(key_a, object)
+    # d需要550字节，依次淘汰b和c后a与d共950字节，a保留
+    pool.get(key_d, object)
+    assert list(pool.entries.keys()) == [key_a, key_d]
+    assert pool.used_bytes == 400 + 550
+    assert pool.metrics()['eviction_count'] == 2
+
+
+def test_small_engine_evicts_only_what_it_needs(engine_files):
+    pool = create_pool(1000)
+    keys = [engine_files(f'{i}.trt', 300) for i in range(3)]
+    for key in keys:
+        pool.get(key, object)
+    pool.get(engine_files('small.trt', 200), object)
+    # 900 + 200超出预算，只淘汰最久未使用的一个
+    assert list(pool.entries.keys())[:2] == keys[1:]
+    assert pool.used_bytes == 800
+    assert pool.metrics()['eviction_count'] == 1
+
+
+def test_engine_larger_than_budget_is_still_created(engine_files):
+    pool = create_pool(1000)
+    key_a = engine_files('a.trt', 300)
+    key_big = engine_files('big.trt', 1500)
+    pool.get(key_a, object)
+    engine = pool.get(key_big, object)
+    # 池中的引擎全部淘汰后仍然创建，不能让请求失败
+    assert engine is not None
+    assert list(pool.entries.keys()) == [key_big]
+    assert pool.used_bytes == 1500
+
+
+def test_factory_error_does_not_leak_cost(engine_files):
+    pool = create_pool(1000)
+    key = engine_files('a.trt', 300)
+
+    def failing_factory():
+        raise RuntimeError("deserialize failed")
+
+    with pytest.raises(RuntimeError):
+        pool.get(key, failing_factory)
+    assert key not in pool.entries
+    assert pool.used_bytes == 0
@@ -0,0 +1,100 @@
+import threading
+import time
+
+import pytest
+
+from common.micro_batcher import MicroBatcher
+
+
+class RecordingBatchFunc:
+    """
+    记录每次批量调用的key和item，执行时等待delay秒，模拟推理耗时
+    """
+
+    def __init__(self, delay=0.0, error=None):
+        self.delay = delay
+        self.error = error
+        self.calls = []
+        self.lock = threading.Lock()
+
+    def __call__(self, key, items):
+        with self.lock:
+            self.calls.append((key, list(items)))
+        time.sleep(self.delay)
+        if self.error is not None:
+            raise self.error
+        return [(key, item * 10) for item in items]
+
+
+def submit_concurrently(batcher, requests):
+    """
+    requests为[(key, item)]，同时提交，返回与requests一一对应的结果或异常
+    """
+    results = [None] * len(requests)
+
+    def submit(index, key, item):
+        try:
+            results[index] = batcher.submit(key, item)
+        except Exception as e:
+            results[index] = e
+
+    threads = [threading.Thread(target=submit, args=(index, key, item))
+               for index, (key, item) in enumerate(requests)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return results
+
+
+def test_lone_request_does_not_wait_for_window():
+    batch_func = RecordingBatchFunc()
+    batcher = MicroBatcher(batch_func, window_ms=500, max_batch_size=8)
+    start_time = time.time()
+    assert batcher.submit('a', 1) == ('a', 10)
+    assert time.time() - start_time < 0.25
+    assert batcher.metrics()['lone_flush_count'] == 1
+
+
+def test_concurrent_requests_are_batched():
+    # 第一个请求执行期间到达的请求在窗口内合并为一个batch
+    batch_func = RecordingBatchFunc(delay=0.1)
+    batcher = MicroBatcher(batch_func, window_ms=50, max_batch_size=8)
+    results = submit_concurrently(batcher, [('a', item) for item in range(6)])
+    assert sorted(results) == [('a', item * 10) for item in range(6)]
+    assert sum(len(items) for _, items in batch_func.calls) == 6
+    assert len(batch_func.calls) < 6
+
+
+def test_batch_split_by_max_batch_size_and_key():
+    batch_func = RecordingBatchFunc(delay=0.1)
+    batcher = MicroBatcher(batch_func, window_ms=100, max_batch_size=3)
+    requests = [('a', item) for item in range(8)] + [('b', item) for item in range(4)]
+    results = submit_concurrently(batcher, requests)
+    # 每个调用方拿到的是自己的item的结果
+    assert results == [(key, item * 10) for key, item in requests]
+    for key, items in batch_func.calls:
+        assert 1 <= len(items) <= 3
+    for key in ['a', 'b']:
+        assert sorted(item for call_key, items in batch_func.calls if call_key == key for item in items) == \
+            [item for request_key, item in requests if request_key == key]
+    metrics = batcher.metrics()
+    assert metrics['request_count'] == len(requests)
+    assert metrics['batch_count'] == len(batch_func.calls)
+
+
+def test_error_propagates_to_every_request_in_batch():
+    batch_func = RecordingBatchFunc(delay=0.1, error=RuntimeError("inference failed"))
+    batcher = MicroBatcher(batch_func, window_ms=50, max_batch_size=8)
+    results = submit_concurrently(batcher, [('a', item) for item in range(4)])
+    assert all(isinstance(result, RuntimeError) for result in results)
+    # 失败之后不影响之后的请求
+    batch_func.error = None
+    assert batcher.submit('a', 5) == ('a', 50)
+    assert batcher.in_flight == 0
+
+
+def test_result_size_mismatch_raises():
+    batcher = MicroBatcher(lambda key, items: [], window_ms=10, max_batch_size=8)
+    with pytest.raises(ValueError):
+        batcher.submit('a', 1)
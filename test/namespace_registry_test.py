@@ -0,0 +1,70 @@
+import time
+import uuid
+
+from flask import Flask
+from flask_socketio import Namespace, SocketIO
+
+from cgi.namespace_registry import NamespaceRegistry, NAMESPACE_REGISTRY_KEY
+from common.util import create_redis_client
+
+
+class TaskNamespace(Namespace):
+    def __init__(self, namespace, unique_id):
+        super().__init__(namespace)
+        self.unique_id = unique_id
+
+    def to_info(self):
+        return {'namespace': self.namespace, 'unique_id': self.unique_id}
+
+    @staticmethod
+    def from_info(info):
+        return TaskNamespace(info['namespace'], info['unique_id'])
+
+    def on_ping(self):
+        self.emit('pong', self.unique_id)
+
+
+def create_worker():
+    """
+    每个worker有自己的Flask应用、SocketIO和redis连接，与多个网关进程的情况相同
+    """
+    app = Flask('ai-platform')
+    socketio = SocketIO(app, async_mode='threading')
+    registry = NamespaceRegistry(socketio, create_redis_client())
+    registry.start(TaskNamespace.from_info)
+    return app, socketio, registry
+
+
+def wait_until(condition, timeout=5):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        if condition():
+            return True
+        time.sleep(0.05)
+    return False
+
+
+def test_namespace_registered_on_every_worker():
+    app_a, socketio_a, registry_a = create_worker()
+    app_b, socketio_b, registry_b = create_worker()
+    # 等待两个worker订阅完成
+    time.sleep(0.5)
+    unique_id = str(uuid.uuid4())
+    namespace = '/' + unique_id
+    registry_a.register(TaskNamespace(namespace, unique_id))
+    try:
+        # 在worker a上创建的namespace，连接到worker b也能进入
+        assert wait_until(lambda: namespace in socketio_b.server.namespace_handlers)
+        client = socketio_b.test_client(app_b, namespace=namespace)
+        assert client.is_connected(namespace)
+        client.emit('ping', namespace=namespace)
+        assert client.get_received(namespace)[0]['args'][0] == unique_id
+        client.disconnect(namespace=namespace)
+
+        # 之后启动的worker从redis加载已有的namespace
+        app_c, socketio_c, registry_c = create_worker()
+        assert wait_until(lambda: namespace in socketio_c.server.namespace_handlers)
+    finally:
+        registry_a.remove(namespace)
+    assert wait_until(lambda: namespace not in socketio_b.server.namespace_handlers)
+    assert registry_a.redis_client.hget(NAMESPACE_REGISTRY_KEY, namespace) is None
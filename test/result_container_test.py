@@ -0,0 +1,99 @@
+import json
+
+import pytest
+
+from common.result_container import write_result_container, ResultContainerReader
+
+FRAME_COUNT = 10
+CHUNK_FRAMES = 4
+
+
+def frame_result(frame_idx):
+    # 奇数帧没有目标，偶数帧有frame_idx % 3 + 1个带track_id的目标
+    if frame_idx % 2 == 1:
+        return []
+    return [{'xmin': frame_idx, 'ymin': i, 'w': 10.5, 'h': 20, 'label': i, 'score': 0.25, 'track_id': 100 + i}
+            for i in range(frame_idx % 3 + 1)]
+
+
+@pytest.fixture
+def container(tmp_path):
+    jsonl_path = tmp_path / 'output.jsonl'
+    container_path = tmp_path / 'result.rc'
+    with open(jsonl_path, 'w') as f:
+        for frame_idx in range(FRAME_COUNT):
+            f.write(json.dumps(frame_result(frame_idx)) + '\n')
+    assert write_result_container(str(jsonl_path), str(container_path), fps=25,
+                                  chunk_frames=CHUNK_FRAMES) == FRAME_COUNT
+    data = container_path.read_bytes()
+    reads = []
+
+    def read_func(offset, length):
+        reads.append((offset, length))
+        return data[offset:offset + length]
+
+    return ResultContainerReader(read_func, len(data)), reads
+
+
+def assert_frames(frames, start_frame, end_frame):
+    assert [frame['frame_idx'] for frame in frames] == list(range(start_frame, end_frame))
+    for frame in frames:
+        assert frame['pts'] == pytest.approx(frame['frame_idx'] * 1000 / 25)
+        assert frame['data'] == frame_result(frame['frame_idx'])
+
+
+@pytest.mark.parametrize('start_frame, end_frame', [
+    (0, FRAME_COUNT),
+    (0, 1),
+    # chunk边界：[0, 4)、[4, 8)、[8, 10)
+    (3, 4),
+    (4, 5),
+    (3, 5),
+    (4, 8),
+    (7, 9),
+    (FRAME_COUNT - 1, FRAME_COUNT),
+])
+def test_read_frames(container, start_frame, end_frame):
+    reader, _ = container
+    assert_frames(reader.read_frames(start_frame, end_frame), start_frame, end_frame)
+
+
+def test_read_frames_out_of_range(container):
+    reader, _ = container
+    # 超出结果末尾的部分被截断，整体超出或空范围返回空列表
+    assert_frames(reader.read_frames(8, FRAME_COUNT + 100), 8, FRAME_COUNT)
+    assert reader.read_frames(FRAME_COUNT, FRAME_COUNT + 5) == []
+    assert reader.read_frames(5, 5) == []
+
+
+def test_read_frames_only_reads_overlapping_chunks(container):
+    reader, reads = container
+    reader.load_index()
+    index_read_count = len(reads)
+    reader.read_frames(4, 8)
+    assert len(reads) == index_read_count + 1
+    # 再次读取不重复读取index
+    reader.read_frames(3, 5)
+    assert len(reads) == index_read_count + 3
+
+
+def test_frame_at_timestamp(container):
+    reader, _ = container
+    assert reader.frame_at_timestamp(-1) == 0
+    assert reader.frame_at_timestamp(0) == 0
+    assert reader.frame_at_timestamp(1) == 1
+    # 第4帧是第二个chunk的第一帧
+    assert reader.frame_at_timestamp(4 * 40) == 4
+    assert reader.frame_at_timestamp(4 * 40 - 1) == 4
+    assert reader.frame_at_timestamp(4 * 40 + 1) == 5
+    assert reader.frame_at_timestamp((FRAME_COUNT - 1) * 40) == FRAME_COUNT - 1
+    assert reader.frame_at_timestamp((FRAME_COUNT - 1) * 40 + 1) == FRAME_COUNT
+
+
+def test_reader_with_cached_index(container):
+    reader, reads = container
+    reader.load_index()
+    cached_reader = ResultContainerReader(reader.read_func, reader.size, reader.index, reader.frame_count)
+    read_count = len(reads)
+    assert_frames(cached_reader.read_frames(0, 2), 0, 2)
+    assert len(reads) == read_count + 1
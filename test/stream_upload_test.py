@@ -0,0 +1,61 @@
+import subprocess
+from unittest import mock
+
+from video import stream_upload
+from video.stream_upload import StreamVideoWriter, StreamJsonlWriter
+
+
+_popen = subprocess.Popen
+
+
+class FailingMinioClient:
+    """
+    读取fail_after_parts个分片后抛出异常，模拟上传中途对象存储连接断开
+    """
+
+    def __init__(self, fail_after_parts=2):
+        self.fail_after_parts = fail_after_parts
+        self.uploaded_size = 0
+
+    def put_object(self, bucket_name, object_name, data, length=-1, part_size=None, content_type=None):
+        for _ in range(self.fail_after_parts):
+            self.uploaded_size += len(data.read(part_size))
+        raise ConnectionResetError("connection reset by peer")
+
+
+class Frame:
+    def __init__(self, size):
+        self.data = b'\0' * size
+
+
+def cat_popen(command, stdin=None, stdout=None, stderr=None):
+    # 用cat代替ffmpeg，输入原样输出，上传线程关闭stdout后cat与ffmpeg一样随之退出
+    return _popen(['cat'], stdin=stdin, stdout=stdout, stderr=stderr)
+
+
+def test_video_upload_fails_midway(tmp_path):
+    client = FailingMinioClient()
+    with mock.patch.object(stream_upload, 'create_minio_client', return_value=client), \
+            mock.patch.object(stream_upload.subprocess, 'Popen', side_effect=cat_popen):
+        writer = StreamVideoWriter('output_test.mp4', 25, (640, 480))
+        # 写入的数据远大于上传失败前读取的两个分片，写入不能抛出异常，也不能阻塞
+        frame = Frame(640 * 480 * 3)
+        for _ in range(100):
+            writer.write(frame)
+        assert writer.failed
+        assert writer.release() is False
+    assert client.uploaded_size == 2 * writer.uploader.part_size
+
+
+def test_jsonl_upload_fails_midway(tmp_path):
+    json_path = tmp_path / 'output_test.jsonl'
+    client = FailingMinioClient(fail_after_parts=1)
+    with mock.patch.object(stream_upload, 'create_minio_client', return_value=client):
+        writer = StreamJsonlWriter('output_test.jsonl', str(json_path))
+        line = '{"frame": 0, "result": []}\n'
+        line_count = 2 * writer.uploader.part_size // len(line)
+        for _ in range(line_count):
+            writer.write(line)
+        assert writer.close() is False
+    # 上传失败不影响本地文件，任务结束后可以重新上传
+    assert json_path.read_text() == line * line_count
@@ -0,0 +1,98 @@
+import uuid
+
+import pytest
+
+from common.task_state import update_task_state, get_task_state, get_task_states, list_active_tasks, \
+    task_state_key, ACTIVE_TASKS_KEY, STATE_QUEUED, STATE_RUNNING, STATE_UPLOADING, STATE_DONE, STATE_FAILED
+from common.util import create_redis_client
+
+
+@pytest.fixture
+def redis_client():
+    return create_redis_client()
+
+
+@pytest.fixture
+def task_ids(redis_client):
+    created = []
+
+    def create():
+        task_id = f"task_state_test_{uuid.uuid4()}"
+        created.append(task_id)
+        return task_id
+
+    yield create
+    for task_id in created:
+        redis_client.delete(task_state_key(task_id))
+        redis_client.zrem(ACTIVE_TASKS_KEY, task_id)
+
+
+def is_active(redis_client, task_id):
+    return redis_client.zscore(ACTIVE_TASKS_KEY, task_id) is not None
+
+
+def test_state_transitions(redis_client, task_ids):
+    task_id = task_ids()
+    assert update_task_state(redis_client, task_id, STATE_QUEUED, service_name='detection', source='video_url')
+    assert is_active(redis_client, task_id)
+    assert update_task_state(redis_client, task_id, STATE_RUNNING, instance_id='instance')
+    assert update_task_state(redis_client, task_id, STATE_UPLOADING)
+    assert update_task_state(redis_client, task_id, STATE_DONE, video_url='video', json_url='json')
+    assert not is_active(redis_client, task_id)
+    state = get_task_state(redis_client, task_id)
+    assert state['state'] == STATE_DONE
+    assert state['service_name'] == 'detection'
+    assert state['instance_id'] == 'instance'
+    assert state['json_url'] == 'json'
+    for name in ['created_at', 'queued_at', 'running_at', 'uploading_at', 'done_at']:
+        assert name in state
+
+
+@pytest.mark.parametrize('terminal_state', [STATE_DONE, STATE_FAILED])
+@pytest.mark.parametrize('late_state', [STATE_QUEUED, STATE_RUNNING, STATE_UPLOADING, STATE_DONE, STATE_FAILED])
+def test_terminal_state_rejects_late_updates(redis_client, task_ids, terminal_state, late_state):
+    task_id = task_ids()
+    update_task_state(redis_client, task_id, STATE_RUNNING)
+    assert update_task_state(redis_client, task_id, terminal_state, error='first')
+    final_state = get_task_state(redis_client, task_id)
+    # 已经结束的任务不会被迟到的更新改回未结束的状态，记录中的字段也不会被修改
+    assert not update_task_state(redis_client, task_id, late_state, error='late')
+    assert get_task_state(redis_client, task_id) == final_state
+    assert final_state['state'] == terminal_state
+    assert final_state['error'] == 'first'
+    assert not is_active(redis_client, task_id)
+
+
+def test_get_task_states(redis_client, task_ids):
+    task_id = task_ids()
+    missing_task_id = task_ids()
+    update_task_state(redis_client, task_id, STATE_QUEUED)
+    states = get_task_states(redis_client, [task_id, missing_task_id])
+    assert states[task_id]['state'] == STATE_QUEUED
+    assert states[missing_task_id] is None
+
+
+def test_list_active_tasks(redis_client, task_ids):
+    detection_task_id = task_ids()
+    track_task_id = task_ids()
+    done_task_id = task_ids()
+    expired_task_id = task_ids()
+    update_task_state(redis_client, detection_task_id, STATE_QUEUED, service_name='detection')
+    update_task_state(redis_client, track_task_id, STATE_RUNNING, service_name='track')
+    update_task_state(redis_client, done_task_id, STATE_QUEUED, service_name='detection')
+    update_task_state(redis_client, done_task_id, STATE_DONE)
+    update_task_state(redis_client, expired_task_id, STATE_RUNNING, service_name='detection')
+    # 模拟处理进程崩溃后状态hash过期
+    redis_client.delete(task_state_key(expired_task_id))
+
+    task_ids_listed = [task['task_id'] for task in list_active_tasks(redis_client, limit=100000)]
+    assert detection_task_id in task_ids_listed
+    assert track_task_id in task_ids_listed
+    assert done_task_id not in task_ids_listed
+    assert expired_task_id not in task_ids_listed
+    # 过期的任务移出索引
+    assert not is_active(redis_client, expired_task_id)
+
+    detection_tasks = list_active_tasks(redis_client, service_name='detection', limit=100000)
+    assert all(task['service_name'] == 'detection' for task in detection_tasks)
+    assert detection_task_id in [task['task_id'] for task in detection_tasks]
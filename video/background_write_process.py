@@ -1,43 +1,211 @@
+import json
 import multiprocessing
+import os
+import queue
+import time
+from multiprocessing import shared_memory
 
 import cv2
+import numpy as np
 
+from common.config import config
 from common.log import LOGGER
+from microservice.minio_storage import create_minio_client
+from video.pipeline_stats import StageStats
+from video.progressive_uploader import ProgressiveUploader
+from video.stream_upload import StreamVideoWriter, StreamJsonlWriter
 
 
 class BackgroundWriteProcess:
     """
     摄像头后台进程，负责写入jsonl文件和mp4文件
+
+    帧数据通过共享内存环形缓冲区传递：缓冲区划分为固定数量的槽位，每个槽位大小为width×height×3，
+    生产者把帧直接写入空闲槽位，只通过队列传递槽位下标和json数据，避免每一帧都经过pickle和管道复制。
+    空闲槽位用完时put会阻塞，直到后台进程写完一帧并归还槽位，因此编码跟不上时内存占用也是有上限的。
+
+    传入checkpoint时输出写入检查点目录，每写入checkpoint_interval帧结束当前mp4分片并保存一次检查点。
+    传入stream_upload=(视频对象名, jsonl对象名)时输出视频编码为分片mp4并边编码边上传，jsonl同时写入本地文件和对象存储，
+    release()之后通过stream_uploaded判断是否上传成功；视频上传中途失败时已经上传的部分无法恢复，本地也没有完整的输出视频，
+    此时stream_failed为True，jsonl仍然完整地写入了本地文件。
+    边编码边上传时再传入progressive_task_id，处理过程中把HLS分片和结果分块作为部分结果上传
     """
-    def __init__(self, camera_output_path, camera_output_json_path, frame_width, frame_height, fps=30):
-        self.camera_data_queue = multiprocessing.Queue()
-        self.camera_json_queue = multiprocessing.Queue()
+    def __init__(self, camera_output_path, camera_output_json_path, frame_width, frame_height, fps=30,
+                 slot_num=None, checkpoint=None, checkpoint_interval=None, stream_upload=None,
+                 progressive_task_id=None):
+        self.frame_shape = (frame_height, frame_width, 3)
+        self.slot_num = slot_num if slot_num else config.get("write_ring_slot_num", 16)
+        slot_size = frame_width * frame_height * 3
+        self.shm = shared_memory.SharedMemory(create=True, size=slot_size * self.slot_num)
+        self.frames = np.ndarray((self.slot_num,) + self.frame_shape, dtype=np.uint8, buffer=self.shm.buf)
+        # 空闲槽位下标队列，初始时所有槽位都空闲
+        self.free_slot_queue = multiprocessing.Queue()
+        for slot_index in range(self.slot_num):
+            self.free_slot_queue.put(slot_index)
+        # 元数据队列，元素为(槽位下标, json数据)，None表示结束
+        self.meta_queue = multiprocessing.Queue()
+        # 子进程退出前通过该队列回传编码阶段的耗时统计和边编码边上传是否成功
+        self.stats_queue = multiprocessing.Queue()
+        if checkpoint_interval is None:
+            checkpoint_interval = config.get("video_checkpoint_interval", 300)
         self.process = multiprocessing.Process(target=self._background, daemon=True,
                                                args=[camera_output_path, camera_output_json_path,
-                                                     self.camera_data_queue, self.camera_json_queue,
-                                                     frame_width, frame_height, fps])
+                                                     self.shm, self.slot_num, self.free_slot_queue,
+                                                     self.meta_queue, self.stats_queue,
+                                                     frame_width, frame_height, fps,
+                                                     checkpoint, max(int(checkpoint_interval), 1),
+                                                     stream_upload, progressive_task_id])
+        self.stream_uploaded = False
+        self.stream_failed = False
         self.process.start()
 
     @staticmethod
-    def _background(camera_output_path, camera_output_json_path, camera_data_queue, camera_json_queue,
-                    frame_width, frame_height, fps=30):
-        json_file = open(camera_output_json_path, 'w')
-        out = cv2.VideoWriter(camera_output_path, cv2.VideoWriter_fourcc(*'avc1'), fps, (frame_width, frame_height))
+    def _background(camera_output_path, camera_output_json_path, shm, slot_num, free_slot_queue, meta_queue,
+                    stats_queue, frame_width, frame_height, fps=30, checkpoint=None, checkpoint_interval=1,
+                    stream_upload=None, progressive_task_id=None):
+        stats = StageStats('encode')
+        frames = np.ndarray((slot_num, frame_height, frame_width, 3), dtype=np.uint8, buffer=shm.buf)
+        fourcc = cv2.VideoWriter_fourcc(*'avc1')
+        frame_size = (frame_width, frame_height)
+        progressive = None
+        if checkpoint:
+            # 从上一个检查点之后的分片开始写入，崩溃时没有写完的分片会被覆盖
+            part_index = checkpoint.part_count
+            frame_index = checkpoint.frame_index
+            json_file = open(checkpoint.jsonl_path, 'a')
+            out = cv2.VideoWriter(checkpoint.part_path(part_index), fourcc, fps, frame_size)
+        else:
+            part_index = frame_index = 0
+            if stream_upload:
+                try:
+                    if progressive_task_id:
+                        progressive = BackgroundWriteProcess._start_progressive(progressive_task_id)
+                    video_object_name, json_object_name = stream_upload
+                    out = StreamVideoWriter(video_object_name, fps, frame_size,
+                                            hls_dir=progressive.hls_dir if progressive else None)
+                    json_file = StreamJsonlWriter(json_object_name, camera_output_json_path)
+                except Exception as e:
+                    # 例如没有安装ffmpeg，退回到写入本地文件，任务结束后再上传
+                    LOGGER.error(f"start stream upload failed, write to local file: {e}")
+                    stream_upload = None
+                    if progressive:
+                        progressive.finish()
+                        progressive = None
+            if not stream_upload:
+                json_file = open(camera_output_json_path, 'w')
+                out = cv2.VideoWriter(camera_output_path, fourcc, fps, frame_size)
+        frames_in_part = 0
         while True:
-            image = camera_data_queue.get()
-            if image is None:
+            with stats.wait():
+                meta = meta_queue.get()
+            if meta is None:
                 break
-            out.write(image)
-            json_data = camera_json_queue.get()
-            json_file.write(json_data + '\n')
-        out.release()
-        json_file.close()
+            slot_index, json_data = meta
+            with stats.busy(1):
+                out.write(frames[slot_index])
+                if not isinstance(json_data, str):
+                    json_data = json.dumps(json_data)
+                json_file.write(json_data + '\n')
+                if progressive:
+                    progressive.add_result(json_data + '\n')
+            # 帧已经交给编码器，归还槽位
+            free_slot_queue.put(slot_index)
+            frames_in_part += 1
+            if checkpoint and frames_in_part >= checkpoint_interval:
+                out.release()
+                frame_index += frames_in_part
+                part_index += 1
+                BackgroundWriteProcess._save_checkpoint(checkpoint, json_file, frame_index, part_index)
+                out = cv2.VideoWriter(checkpoint.part_path(part_index), fourcc, fps, frame_size)
+                frames_in_part = 0
+        stream_uploaded = stream_failed = False
+        if stream_upload:
+            # 等待最后一个分片上传完成，这是处理结束后唯一需要等待的上传
+            video_uploaded = out.release()
+            json_uploaded = json_file.close()
+            if video_uploaded and not json_uploaded:
+                # 本地的jsonl是完整的，重新上传一次
+                json_uploaded = BackgroundWriteProcess._upload_local_file(stream_upload[1], camera_output_json_path)
+            stream_uploaded = video_uploaded and json_uploaded
+            # 视频上传中途失败时本地没有完整的视频，不能再退回到任务结束后上传，只能报告失败
+            stream_failed = not stream_uploaded
+            if progressive:
+                progressive.finish()
+        else:
+            out.release()
+        if checkpoint:
+            if frames_in_part > 0:
+                BackgroundWriteProcess._save_checkpoint(checkpoint, json_file, frame_index + frames_in_part,
+                                                        part_index + 1)
+            elif os.path.exists(checkpoint.part_path(part_index)):
+                # 最后一个分片没有写入任何帧
+                os.remove(checkpoint.part_path(part_index))
+        if not stream_upload:
+            json_file.close()
+        del frames
+        shm.close()
+        stats_queue.put((stats.to_dict(), stream_uploaded, stream_failed))
+
+    @staticmethod
+    def _start_progressive(task_id):
+        # 部分结果只影响处理过程中的预览，启动失败时不影响输出
+        try:
+            return ProgressiveUploader(task_id, f"temp/progressive_{task_id}")
+        except Exception as e:
+            LOGGER.error(f"start progressive uploader failed: {e}")
+            return None
+
+    @staticmethod
+    def _upload_local_file(object_name, file_path):
+        try:
+            create_minio_client().fput_object(config.get("bucket_name"), object_name, file_path)
+            return True
+        except Exception as e:
+            LOGGER.error(f"upload {file_path} failed: {e}")
+            return False
+
+    @staticmethod
+    def _save_checkpoint(checkpoint, json_file, frame_index, part_count):
+        # 检查点记录的帧必须已经落盘：分片已经结束，jsonl已经刷新到磁盘
+        json_file.flush()
+        os.fsync(json_file.fileno())
+        checkpoint.save(frame_index, json_file.tell(), part_count)
 
     def put(self, image, json_data):
-        self.camera_data_queue.put(image)
-        self.camera_json_queue.put(json_data)
+        # json_data可以是json字符串，也可以是可以json序列化的对象，对象在后台进程中序列化
+        # 没有空闲槽位时阻塞，对上游形成背压；后台进程异常退出时不会再归还槽位，抛出异常让任务失败
+        while True:
+            try:
+                slot_index = self.free_slot_queue.get(timeout=1)
+                break
+            except queue.Empty:
+                if not self.process.is_alive():
+                    raise RuntimeError(f"background write process exited, exitcode: {self.process.exitcode}")
+        if image.shape != self.frame_shape:
+            image = cv2.resize(image, (self.frame_shape[1], self.frame_shape[0]))
+        self.frames[slot_index][:] = image
+        self.meta_queue.put((slot_index, json_data))
 
     def release(self):
+        """
+        结束后台进程并等待文件保存完毕，返回编码阶段的耗时统计
+        """
         LOGGER.info("release background write process")
-        self.camera_data_queue.put(None)  # None表示结束信号，子进程接收到None后释放资源，保存文件
+        self.meta_queue.put(None)  # None表示结束信号，子进程接收到None后释放资源，保存文件
+        # 先取统计再join，避免子进程因队列中的数据未被取走而无法退出
+        stats = None
+        deadline = time.time() + 60
+        while True:
+            try:
+                stats, self.stream_uploaded, self.stream_failed = self.stats_queue.get(timeout=1)
+                break
+            except queue.Empty:
+                # 后台进程已经退出时不再等待
+                if not self.process.is_alive() or time.time() > deadline:
+                    LOGGER.error(f"get background write process stats failed, exitcode: {self.process.exitcode}")
+                    break
         self.process.join()
+        del self.frames
+        self.shm.close()
+        self.shm.unlink()
+        return stats
@@ -0,0 +1,159 @@
+import threading
+import time
+from typing import Callable, Dict, List
+
+from common.config import config
+from common.log import LOGGER
+from common.util import clear_camera_temp_resource
+from video.camera_template import CameraTemplate
+
+
+class CameraStream:
+
+    def __init__(self, camera_template: CameraTemplate, stream_func):
+        self.camera_template = camera_template
+        self.stream_func = stream_func
+
+
+class CameraHost:
+    """
+    多路摄像头推理宿主，一个服务实例只启动一个宿主进程，所有摄像头任务共享同一个推理引擎。
+
+    每个tick轮询所有摄像头的最新帧，把分辨率相同的帧合并为一个batch调用batch_func，
+    再把每一帧的结果交给该路摄像头的stream_func（例如独立的ByteTrack跟踪器）处理，
+    最后由该路摄像头的CameraTemplate负责发送结果和保存文件。
+
+    batch_func接收帧列表，返回与帧一一对应的结果列表；
+    stream_func_factory为每路摄像头创建一个stream_func(image, result) -> json_items；
+    template_options为创建CameraTemplate时额外传入的参数，例如读取器和是否发送预览帧
+    """
+
+    def __init__(self, service_name, batch_func: Callable[[List], List], stream_func_factory: Callable,
+                 max_batch_size=None, tick_ms=None, template_options=None):
+        self.service_name = service_name
+        self.template_options = template_options if template_options else {}
+        self.batch_func = batch_func
+        self.stream_func_factory = stream_func_factory
+        self.max_batch_size = max_batch_size if max_batch_size else config.get("camera_host_max_batch_size", 8)
+        self.tick_interval = (tick_ms if tick_ms else config.get("camera_host_tick_ms", 5)) / 1000
+        self.streams: Dict[str, CameraStream] = {}
+        self.opening_count = 0
+        self.accepting = True
+        self.lock = threading.Lock()
+
+    def add_stream(self, camera_id, hyperparameters, namespace, task_id, service_unique_id,
+                   camera_output_path, camera_output_json_path):
+        """
+        打开摄像头需要等待视频流的分辨率和socketio连接，在单独的线程中进行，不阻塞其他摄像头的推理
+        """
+        self.lock.acquire()
+        try:
+            self.opening_count += 1
+        finally:
+            self.lock.release()
+        threading.Thread(target=self._open_stream, daemon=True,
+                         args=[camera_id, hyperparameters, namespace, task_id, service_unique_id,
+                               camera_output_path, camera_output_json_path]).start()
+
+    def _open_stream(self, camera_id, hyperparameters, namespace, task_id, service_unique_id,
+                     camera_output_path, camera_output_json_path):
+        stream = None
+        try:
+            LOGGER.info(f'camera host open camera: {camera_id}, task_id: {task_id}')
+            camera_template = CameraTemplate(camera_id, hyperparameters, namespace, task_id, service_unique_id,
+                                             camera_output_path, camera_output_json_path, self.service_name,
+                                             **self.template_options)
+            stream = CameraStream(camera_template, self.stream_func_factory())
+        except Exception as e:
+            LOGGER.error(f"camera host open camera {camera_id} failed: {e}")
+            clear_camera_temp_resource(camera_output_path, camera_output_json_path)
+        finally:
+            self.lock.acquire()
+            try:
+                self.opening_count -= 1
+                if stream:
+                    self.streams[task_id] = stream
+            finally:
+                self.lock.release()
+
+    def close(self):
+        """
+        不再接收新的摄像头，已有的摄像头全部结束后run()返回
+        """
+        self.accepting = False
+
+    def run(self):
+        while True:
+            self.lock.acquire()
+            try:
+                streams = list(self.streams.items())
+                finished = not self.accepting and len(streams) == 0 and self.opening_count == 0
+            finally:
+                self.lock.release()
+            if finished:
+                break
+            ready_frames = self._poll_frames(streams)
+            if len(ready_frames) == 0:
+                time.sleep(self.tick_interval)
+                continue
+            self._infer(ready_frames)
+
+    def _poll_frames(self, streams):
+        ready_frames = []
+        for task_id, stream in streams:
+            camera_template = stream.camera_template
+            if camera_template.stop_camera_flag:
+                self._end_stream(task_id)
+                continue
+            image = camera_template.poll_frame(timeout=0)
+            if image is None:
+                self._end_stream(task_id)
+            elif image is not False:
+                ready_frames.append((task_id, stream, image))
+        return ready_frames
+
+    def _infer(self, ready_frames):
+        # 按分辨率分组，同一分辨率的帧才能合并为一个batch
+        groups = {}
+        for ready_frame in ready_frames:
+            image = ready_frame[2]
+            groups.setdefault(image.shape[:2], []).append(ready_frame)
+        for group in groups.values():
+            for start in range(0, len(group), self.max_batch_size):
+                batch = group[start:start + self.max_batch_size]
+                infer_start_time = time.time()
+                try:
+                    results = self.batch_func([image for _, _, image in batch])
+                except Exception as e:
+                    LOGGER.error(f"camera host batch inference failed: {e}")
+                    continue
+                infer_end_time = time.time()
+                for (task_id, stream, image), result in zip(batch, results):
+                    try:
+                        json_items = stream.stream_func(image, result)
+                        stream.camera_template.handle_result(image, json_items, infer_start_time, infer_end_time)
+                    except Exception as e:
+                        LOGGER.error(f"camera host handle result failed, task_id: {task_id}, error: {e}")
+                        stream.camera_template.log(str(e))
+                        self._end_stream(task_id)
+
+    def _end_stream(self, task_id):
+        self.lock.acquire()
+        try:
+            stream = self.streams.pop(task_id, None)
+        finally:
+            self.lock.release()
+        if stream is None:
+            return
+        # 释放时需要上传文件并通知管理服务，在单独的线程中进行，不阻塞其他摄像头的推理
+        threading.Thread(target=self._release_stream, args=[stream], daemon=False).start()
+
+    @staticmethod
+    def _release_stream(stream: CameraStream):
+        camera_template = stream.camera_template
+        try:
+            camera_template.release()
+        except Exception as e:
+            LOGGER.error(f"camera host release camera failed, task_id: {camera_template.task_id}, error: {e}")
+        finally:
+            clear_camera_temp_resource(camera_template.camera_output_path, camera_template.camera_output_json_path)
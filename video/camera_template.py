@@ -2,22 +2,35 @@ import json
 import subprocess
 import time
 
+import cv2
 import socketio
 
 from common import config
+from common.camera_backpressure import AdaptiveEmitController, FpsCounter, flush_fps
+from common.camera_channel import camera_channel_key, pack_camera_message
+from common.camera_codec import CameraDataFormat, CameraDataEncoder
+from common.latency_recorder import LatencyRecorder
+from common.util import create_redis_client
 from video.background_write_process import BackgroundWriteProcess
 from common.log import LOGGER
 from scripts.camera_common import after_camera_call
 from video.camera_mode_enum import CameraModeEnum
 from video.sei_injector import SEIInjector
 from video.unbuffered_sei_parser import UnbufferedSEIParser
+from video.unbuffered_video_capture import UnbufferedVideoCapture
 
 
 class CameraTemplate:
     def __init__(self, camera_id, hyperparameters, namespace, task_id, service_unique_id,
-                 camera_output_path, camera_output_json_path, service_name, ai_func=None):
+                 camera_output_path, camera_output_json_path, service_name, ai_func=None,
+                 capture_cls=UnbufferedSEIParser, emit_preview=False):
         # ai_func接收image返回以字典为元素的列表
         self.ai_func = ai_func
+        # capture_cls为直接读取camera_id时使用的无缓存读取器，SEI模式始终从注入了SEI的rtmp流读取；
+        # emit_preview为True时在结果之前把原始帧编码为jpg发送给前端，用于前端不单独拉流的服务
+        self.emit_preview = emit_preview
+        self.emit_current = False
+        self.preview_jpg = None
         self.namespace = namespace
         self.task_id = task_id
         self.service_unique_id = service_unique_id
@@ -29,20 +42,36 @@ class CameraTemplate:
         self.diff_timestamp = 0
         self.sei_injector = None
         self.pipe = None
+        # 每一帧在各个阶段的延迟统计，定期写入redis，网关转发的延迟由网关写入同一个hash
+        self.latency_recorder = LatencyRecorder()
+        self.latency_key = task_id + "_latency"
+        self.latency_flush_interval = config.config.get("latency_flush_interval", 5)
+        self.last_latency_flush_time = time.time()
+        self.redis_client = create_redis_client()
+        self.frame_capture_time = 0
+        # 默认使用json格式，前端通过namespace协商为二进制格式
+        self.camera_data_format = CameraDataFormat.JSON.value
+        self.camera_data_encoder = CameraDataEncoder()
+        self.frame_dequeue_time = 0
+        # 根据网关反馈的背压等级跳过部分帧的发送，并统计视频源帧率和实际发送帧率
+        self.emit_controller = AdaptiveEmitController(self.redis_client, task_id)
+        self.source_fps_counter = FpsCounter()
+        self.emit_fps_counter = FpsCounter()
+        self.last_frame_seq = 0
         self.parse_camera_mode(hyperparameters)
         self.width = 0
         self.height = 0
         if self.camera_mode == CameraModeEnum.SEI.value:
             rtmp_url = f"rtmp://127.0.0.1/live{namespace}"
             self.sei_injector = SEIInjector(camera_id, rtmp_url)
-            self.unbuffered_sei_parser = UnbufferedSEIParser(rtmp_url)
-            self.width, self.height = self.unbuffered_sei_parser.get_param()
+            self.unbuffered_cap = UnbufferedSEIParser(rtmp_url)
+            self.width, self.height = self.unbuffered_cap.get_param()
         elif self.camera_mode == CameraModeEnum.WEBRTC_STREAMER.value:
-            self.unbuffered_sei_parser = UnbufferedSEIParser(camera_id)
-            self.width, self.height = self.unbuffered_sei_parser.get_param()
+            self.unbuffered_cap = capture_cls(camera_id)
+            self.width, self.height = self.unbuffered_cap.get_param()
         else:
-            self.unbuffered_sei_parser = UnbufferedSEIParser(camera_id)
-            self.width, self.height = self.unbuffered_sei_parser.get_param()
+            self.unbuffered_cap = capture_cls(camera_id)
+            self.width, self.height = self.unbuffered_cap.get_param()
             rtmp_url = f"rtmp://127.0.0.1/live{namespace}"
             command = ['ffmpeg',
                        '-y', '-an',
@@ -61,6 +90,15 @@ class CameraTemplate:
         sio = socketio.Client()
         self.sio = sio
 
+        @sio.on('connect', namespace=namespace)
+        def on_connect():
+            # 连接后向网关查询前端协商的camera_data格式
+            sio.emit('camera_data_format_retrieve', namespace=namespace)
+
+        @sio.on('camera_data_format', namespace=namespace)
+        def on_camera_data_format(camera_data_format):
+            self.set_camera_data_format(camera_data_format)
+
         @sio.on('disconnect', namespace=namespace)
         def on_disconnect():
             if not self.stop_camera_flag:
@@ -80,48 +118,148 @@ class CameraTemplate:
     def loop_process(self):
         try:
             while not self.stop_camera_flag:
-                if self.camera_mode == CameraModeEnum.SEI.value:
-                    sei_str = self.unbuffered_sei_parser.get_sei()
-                    if sei_str:
-                        latest_sei_milli_timestamp = int(sei_str)
-                        local_milli_timestamp = time.time() * 1000
-                        self.diff_timestamp = local_milli_timestamp - latest_sei_milli_timestamp
-                image = self.unbuffered_sei_parser.read()
+                image = self.poll_frame()
                 if image is None:
                     break
                 # 对帧进行处理
+                infer_start_time = time.time()
                 json_items = self.ai_func(image)
-                if self.camera_mode == CameraModeEnum.PYTHON_PUBLISH_STREAM.value:
-                    self.pipe.stdin.write(image.tostring())
-                if self.camera_mode == CameraModeEnum.SEI.value:
-                    camera_data = {
-                        'data': json_items,
-                        'timestamp': int(time.time() * 1000) - self.diff_timestamp
-                    }
-                    json_items_str = json.dumps(camera_data)
-                elif self.camera_mode == CameraModeEnum.WEBRTC_STREAMER.value:
-                    camera_data = {
-                        'data': json_items,
-                        'timestamp': int(time.time() * 1000)
-                    }
-                    json_items_str = json.dumps(camera_data)
-                else:
-                    json_items_str = json.dumps(json_items)
-                self.sio.emit('camera_data', json_items_str, namespace=self.namespace)
-                self.background_write_process.put(image, json_items_str)
+                self.handle_result(image, json_items, infer_start_time, time.time())
         except Exception as e:
             self.log(str(e))
             raise
         finally:
-            self.sio.disconnect()
-            self.background_write_process.release()
-            self.unbuffered_sei_parser.release()
-            if self.camera_mode == CameraModeEnum.PYTHON_PUBLISH_STREAM.value:
-                self.pipe.terminate()
-            if self.camera_mode == CameraModeEnum.SEI.value and self.sei_injector:
-                self.sei_injector.release()
-            after_camera_call(self.camera_output_path, self.camera_output_json_path,
-                              self.task_id, self.service_name, self.service_unique_id)
+            self.release()
+
+    def poll_frame(self, timeout=None):
+        """
+        读取最新的一帧，摄像头结束时返回None。
+        timeout不为None时最多等待timeout秒，期间没有新的帧返回False，供多路摄像头推理宿主轮询使用
+        """
+        if self.camera_mode == CameraModeEnum.SEI.value:
+            sei_str = self.unbuffered_cap.get_sei()
+            if sei_str:
+                latest_sei_milli_timestamp = int(sei_str)
+                local_milli_timestamp = time.time() * 1000
+                self.diff_timestamp = local_milli_timestamp - latest_sei_milli_timestamp
+        if isinstance(self.unbuffered_cap, UnbufferedVideoCapture):
+            log = self.unbuffered_cap.get_log()
+            if log:
+                self.log(log)
+        image = self.unbuffered_cap.read(timeout)
+        if image is not None and image is not False:
+            # 在推理和绘制之前决定该帧是否发送，跳过发送的帧不需要编码预览
+            self.emit_current = self.emit_controller.should_emit()
+            if self.emit_current and self.emit_preview:
+                _, jpg_data = cv2.imencode(".jpg", image,
+                                           [cv2.IMWRITE_JPEG_QUALITY, self.emit_controller.jpeg_quality()])
+                self.preview_jpg = jpg_data.tobytes()
+            # 帧被解析出来的时间和被取出的时间，两者之差为帧在读取队列中等待的时间
+            self.frame_capture_time = self.unbuffered_cap.frame_timestamp()
+            self.frame_dequeue_time = time.time()
+            self.latency_recorder.record_interval('queue', self.frame_capture_time, self.frame_dequeue_time)
+            # 信箱只保留最新帧，两次读取之间的序号差是视频源实际产生的帧数
+            frame_seq = self.unbuffered_cap.frame_seq()
+            self.source_fps_counter.add(frame_seq - self.last_frame_seq if self.last_frame_seq else 1)
+            self.last_frame_seq = frame_seq
+        return image
+
+    def handle_result(self, image, json_items, infer_start_time=None, infer_end_time=None):
+        """
+        把一帧的推理结果发送给前端，并交给后台写进程保存。
+        infer_start_time和infer_end_time为该帧推理的开始和结束时间，用于延迟统计
+        """
+        if infer_start_time and infer_end_time:
+            # 取出帧到开始推理之间的等待（例如多路摄像头宿主等待组batch），以及推理本身的耗时
+            self.latency_recorder.record_interval('pre_infer', self.frame_dequeue_time, infer_start_time)
+            self.latency_recorder.record_interval('infer', infer_start_time, infer_end_time)
+        if self.camera_mode == CameraModeEnum.PYTHON_PUBLISH_STREAM.value:
+            self.pipe.stdin.write(image.tostring())
+        serialize_start_time = time.time()
+        # 帧从解析出来到被处理时经过的时间，用于判断帧的新鲜程度
+        frame_age_ms = int(self.unbuffered_cap.frame_age_ms())
+        timestamp = int(time.time() * 1000)
+        if self.camera_mode == CameraModeEnum.SEI.value:
+            timestamp -= self.diff_timestamp
+            camera_data = {
+                'data': json_items,
+                'timestamp': timestamp,
+                'frame_age_ms': frame_age_ms,
+            }
+        elif self.camera_mode == CameraModeEnum.WEBRTC_STREAMER.value:
+            camera_data = {
+                'data': json_items,
+                'timestamp': timestamp,
+                'frame_age_ms': frame_age_ms,
+            }
+        else:
+            camera_data = json_items
+        if self.emit_current:
+            self.emit_camera_data(json_items, camera_data, timestamp, frame_age_ms, serialize_start_time)
+        # jsonl文件始终保存json格式，跳过发送的帧同样保存，json序列化在后台写进程中进行
+        self.background_write_process.put(image, camera_data)
+        if time.time() - self.last_latency_flush_time >= self.latency_flush_interval:
+            self.flush_latency()
+
+    def emit_camera_data(self, json_items, camera_data, timestamp, frame_age_ms, serialize_start_time):
+        if self.emit_controller.take_keyframe_request():
+            self.camera_data_encoder.force_keyframe()
+        # 背压跳过的帧不经过编码，二进制格式的下一帧仍然相对于上一次发送的帧做差分
+        payload = self.serialize_camera_data(json_items, camera_data, timestamp, frame_age_ms)
+        emit_start_time = time.time()
+        self.latency_recorder.record_interval('serialize', serialize_start_time, emit_start_time)
+        if self.preview_jpg is not None:
+            # 预览帧与结果作为两条camera_data先后发送，前端在预览帧上绘制随后收到的结果
+            self.redis_client.publish(camera_channel_key(self.task_id),
+                                      pack_camera_message(self.preview_jpg, int(emit_start_time * 1000)))
+            self.preview_jpg = None
+        # 结果发布到该任务的redis channel，由网关订阅后转发给所有观看者，不再经过socketio连接中转；
+        # 消息中附带发送时间，网关据此统计转发延迟，转发给前端时只转发数据本身
+        self.redis_client.publish(camera_channel_key(self.task_id),
+                                  pack_camera_message(payload, int(emit_start_time * 1000)))
+        emit_end_time = time.time()
+        self.emit_fps_counter.add()
+        self.latency_recorder.record_interval('emit', emit_start_time, emit_end_time)
+        self.latency_recorder.record_interval('total', self.frame_capture_time, emit_end_time)
+
+    def serialize_camera_data(self, json_items, camera_data, timestamp, frame_age_ms):
+        if self.camera_data_format == CameraDataFormat.BINARY.value:
+            try:
+                return self.camera_data_encoder.encode(json_items, timestamp, frame_age_ms)
+            except (KeyError, TypeError, ValueError):
+                # 结果不是目标框列表（例如分类结果）时仍然使用json
+                pass
+        return json.dumps(camera_data)
+
+    def set_camera_data_format(self, camera_data_format):
+        LOGGER.info(f"camera data format: {camera_data_format}, task_id: {self.task_id}")
+        # 切换格式后重新创建编码器，保证二进制格式的第一帧是关键帧
+        self.camera_data_encoder = CameraDataEncoder()
+        self.camera_data_format = camera_data_format
+
+    def flush_latency(self):
+        self.last_latency_flush_time = time.time()
+        try:
+            self.latency_recorder.flush(self.redis_client, self.latency_key)
+            flush_fps(self.redis_client, self.task_id, {
+                'source_fps': self.source_fps_counter.take(),
+                'emit_fps': self.emit_fps_counter.take(),
+                'backpressure_level': self.emit_controller.level,
+            })
+        except Exception as e:
+            LOGGER.error(f"flush camera latency failed: {e}")
+
+    def release(self):
+        self.flush_latency()
+        self.sio.disconnect()
+        self.background_write_process.release()
+        self.unbuffered_cap.release()
+        if self.camera_mode == CameraModeEnum.PYTHON_PUBLISH_STREAM.value:
+            self.pipe.terminate()
+        if self.camera_mode == CameraModeEnum.SEI.value and self.sei_injector:
+            self.sei_injector.release()
+        after_camera_call(self.camera_output_path, self.camera_output_json_path,
+                          self.task_id, self.service_name, self.service_unique_id)
 
     def parse_camera_mode(self, hyperparameters):
         for hyperparameter in hyperparameters:
@@ -0,0 +1,111 @@
+import multiprocessing
+import time
+from multiprocessing import shared_memory
+
+import numpy as np
+
+
+class LatestFrameMailbox:
+    """
+    跨进程的"最新帧"信箱，读取进程写入帧，消费进程总是读取到最新的一帧。
+
+    帧数据存放在共享内存中的三个槽位（三缓冲）：写入方总是写入既不是最新帧、也不是读取方正在使用的槽位，
+    写完后在锁内更新最新槽位、序号和时间戳；读取方在锁内取得最新槽位后直接在共享内存上读取，
+    因此帧既不需要pickle，也不需要经过管道复制，旧帧会被直接覆盖，不会堆积。
+
+    共享内存的大小取决于视频分辨率，而分辨率只有在读取进程打开视频流之后才能得到，
+    所以由读取进程调用create()创建共享内存，再把共享内存名称交给消费进程调用attach()。
+    同步对象需要在创建子进程之前构造，以便子进程继承
+    """
+    SLOT_NUM = 3
+
+    def __init__(self):
+        self.condition = multiprocessing.Condition()
+        self.seq = multiprocessing.Value('q', 0, lock=False)
+        self.latest_slot = multiprocessing.Value('i', -1, lock=False)
+        self.reading_slot = multiprocessing.Value('i', -1, lock=False)
+        self.closed = multiprocessing.Value('b', 0, lock=False)
+        # 每个槽位中帧的写入时间（秒）
+        self.timestamps = multiprocessing.Array('d', self.SLOT_NUM, lock=False)
+        self.shm = None
+        self.frames = None
+        self.last_read_seq = 0
+        self.last_read_timestamp = 0.0
+
+    def __getstate__(self):
+        # 共享内存在子进程中单独创建或附加，不随对象传递
+        state = self.__dict__.copy()
+        state['shm'] = None
+        state['frames'] = None
+        return state
+
+    def create(self, width, height):
+        """
+        写入方创建共享内存，返回共享内存名称
+        """
+        self.shm = shared_memory.SharedMemory(create=True, size=self.SLOT_NUM * width * height * 3)
+        self.frames = np.ndarray((self.SLOT_NUM, height, width, 3), dtype=np.uint8, buffer=self.shm.buf)
+        return self.shm.name
+
+    def attach(self, name, width, height):
+        """
+        读取方附加到写入方创建的共享内存
+        """
+        self.shm = shared_memory.SharedMemory(name=name)
+        self.frames = np.ndarray((self.SLOT_NUM, height, width, 3), dtype=np.uint8, buffer=self.shm.buf)
+
+    def write(self, frame):
+        with self.condition:
+            busy_slots = (self.latest_slot.value, self.reading_slot.value)
+        slot = next(slot for slot in range(self.SLOT_NUM) if slot not in busy_slots)
+        # 该槽位既不是最新帧也没有被读取，可以在锁外写入
+        self.frames[slot][:] = frame
+        with self.condition:
+            self.latest_slot.value = slot
+            self.timestamps[slot] = time.time()
+            self.seq.value += 1
+            self.condition.notify_all()
+
+    def close(self):
+        """
+        写入方结束写入，读取方读完最新帧后read()返回None
+        """
+        with self.condition:
+            self.closed.value = 1
+            self.condition.notify_all()
+
+    def read(self, timeout=None, copy=False):
+        """
+        阻塞等待比上一次读取更新的帧。
+        copy为False时返回共享内存上的视图，视图在下一次调用read()之前有效，写入方不会覆盖该槽位；
+        写入方已关闭时返回None，超时返回False
+        """
+        with self.condition:
+            has_new_frame = self.condition.wait_for(
+                lambda: self.seq.value > self.last_read_seq or self.closed.value, timeout=timeout)
+            if not has_new_frame:
+                return False
+            if self.seq.value <= self.last_read_seq:
+                return None
+            slot = self.latest_slot.value
+            self.reading_slot.value = slot
+            self.last_read_seq = self.seq.value
+            self.last_read_timestamp = self.timestamps[slot]
+        frame = self.frames[slot]
+        return frame.copy() if copy else frame
+
+    def frame_age_ms(self):
+        """
+        上一次读取到的帧从写入到现在经过的毫秒数
+        """
+        if self.last_read_timestamp == 0:
+            return 0
+        return (time.time() - self.last_read_timestamp) * 1000
+
+    def release(self, unlink=False):
+        self.frames = None
+        if self.shm:
+            self.shm.close()
+            if unlink:
+                self.shm.unlink()
+            self.shm = None
@@ -0,0 +1,45 @@
+import time
+from contextlib import contextmanager
+
+
+class StageStats:
+    """
+    流水线中单个阶段的耗时统计。
+
+    busy_time为阶段实际处理数据的时间，wait_time为阶段等待上游数据或等待下游队列空位的时间，
+    利用率为busy_time / (busy_time + wait_time)，利用率最高的阶段即为流水线的瓶颈
+    """
+
+    def __init__(self, name):
+        self.name = name
+        self.busy_time = 0.0
+        self.wait_time = 0.0
+        self.item_count = 0
+
+    @contextmanager
+    def busy(self, item_count=0):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.busy_time += time.perf_counter() - start
+            self.item_count += item_count
+
+    @contextmanager
+    def wait(self):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.wait_time += time.perf_counter() - start
+
+    def to_dict(self):
+        total_time = self.busy_time + self.wait_time
+        return {
+            'stage': self.name,
+            'item_count': self.item_count,
+            'busy_time': round(self.busy_time, 3),
+            'wait_time': round(self.wait_time, 3),
+            'utilization': round(self.busy_time / total_time, 4) if total_time > 0 else 0,
+            'avg_item_ms': round(self.busy_time * 1000 / self.item_count, 3) if self.item_count > 0 else 0,
+        }
@@ -0,0 +1,145 @@
+import io
+import json
+import os
+import queue
+import shutil
+import threading
+from datetime import timedelta
+
+from common.config import config
+from common.log import LOGGER
+from common.progress_publisher import progress_channel_key, pack_progress_message, PARTIAL_EVENT
+from common.progressive_result import progressive_object_prefix, progressive_state_key, progressive_segments_key, \
+    progressive_results_key, parse_hls_playlist, PARTIAL_SEGMENT, PARTIAL_RESULT, PARTIAL_END
+from common.util import create_redis_client
+from microservice.minio_storage import create_minio_client
+
+PLAYLIST_NAME = 'index.m3u8'
+
+
+class ProgressiveUploader:
+    """
+    在后台写进程中运行，把处理过程中产生的部分结果上传到对象存储：
+
+    - hls_dir中ffmpeg写入的fmp4分片，加入playlist后上传并删除本地文件
+    - add_result()传入的jsonl结果，每chunk_frames帧作为一个结果分块上传
+
+    上传在后台线程中进行，不阻塞编码。每上传一个对象都记录到redis并通过进度channel通知前端
+    """
+
+    def __init__(self, task_id, hls_dir, chunk_frames=None):
+        self.task_id = task_id
+        self.hls_dir = hls_dir
+        self.chunk_frames = chunk_frames if chunk_frames else config.get("video_progressive_chunk_frames", 300)
+        self.poll_interval = config.get("video_progressive_poll_interval", 1)
+        self.object_prefix = progressive_object_prefix(task_id)
+        self.client = create_minio_client()
+        self.bucket_name = config.get("bucket_name")
+        self.redis_client = create_redis_client()
+        self.channel = progress_channel_key(task_id)
+        self.init_uploaded = False
+        self.target_duration = 0
+        self.segment_count = 0
+        self.pending_lines = []
+        self.pending_start_frame = 0
+        # 元素为(start_frame, end_frame, data)
+        self.result_queue = queue.Queue()
+        self.stop_event = threading.Event()
+        os.makedirs(hls_dir, exist_ok=True)
+        self.thread = threading.Thread(target=self._upload_loop, daemon=True)
+        self.thread.start()
+
+    def add_result(self, json_line):
+        self.pending_lines.append(json_line)
+        if len(self.pending_lines) >= self.chunk_frames:
+            self._flush_result()
+
+    def _flush_result(self):
+        if len(self.pending_lines) == 0:
+            return
+        end_frame = self.pending_start_frame + len(self.pending_lines)
+        self.result_queue.put((self.pending_start_frame, end_frame, ''.join(self.pending_lines).encode('utf-8')))
+        self.pending_start_frame = end_frame
+        self.pending_lines = []
+
+    def _upload_loop(self):
+        while not self.stop_event.is_set() or not self.result_queue.empty():
+            try:
+                item = self.result_queue.get(timeout=self.poll_interval)
+                self._upload_result(*item)
+            except queue.Empty:
+                pass
+            except Exception as e:
+                LOGGER.error(f"upload progressive result failed, task_id: {self.task_id}, error: {e}")
+            self._upload_segments()
+
+    def _upload_result(self, start_frame, end_frame, data):
+        object_name = f"{self.object_prefix}result_{start_frame:08d}.jsonl"
+        self.client.put_object(self.bucket_name, object_name, io.BytesIO(data), len(data),
+                               content_type="application/json")
+        self._record(progressive_results_key(self.task_id),
+                     {'object_name': object_name, 'start_frame': start_frame, 'end_frame': end_frame},
+                     {'type': PARTIAL_RESULT, 'start_frame': start_frame, 'end_frame': end_frame,
+                      'url': self._object_url(object_name)})
+
+    def _upload_segments(self):
+        playlist_path = os.path.join(self.hls_dir, PLAYLIST_NAME)
+        try:
+            with open(playlist_path, 'r') as f:
+                init_name, target_duration, segments = parse_hls_playlist(f.read())
+        except FileNotFoundError:
+            # 第一个分片还没有编码完成
+            return
+        try:
+            if init_name and not self.init_uploaded:
+                init_object_name = self._upload_file(init_name, "video/mp4")
+                self.redis_client.hset(progressive_state_key(self.task_id), 'init', init_object_name)
+                self.redis_client.expire(progressive_state_key(self.task_id), timedelta(days=1))
+                self.init_uploaded = True
+            for segment_name, duration in segments[self.segment_count:]:
+                object_name = self._upload_file(segment_name, "video/iso.segment")
+                self._record(progressive_segments_key(self.task_id),
+                             {'object_name': object_name, 'duration': duration},
+                             {'type': PARTIAL_SEGMENT, 'index': self.segment_count, 'duration': duration,
+                              'url': self._object_url(object_name)})
+                self.segment_count += 1
+                # 分片已经上传，删除本地文件，处理长视频时本地只保留正在编码的分片
+                os.remove(os.path.join(self.hls_dir, segment_name))
+            if target_duration != self.target_duration:
+                # 编码器根据实际的关键帧位置更新最大分片时长
+                self.redis_client.hset(progressive_state_key(self.task_id), 'target_duration', target_duration)
+                self.target_duration = target_duration
+        except Exception as e:
+            LOGGER.error(f"upload progressive segment failed, task_id: {self.task_id}, error: {e}")
+
+    def _upload_file(self, file_name, content_type):
+        object_name = self.object_prefix + file_name
+        self.client.fput_object(self.bucket_name, object_name, os.path.join(self.hls_dir, file_name),
+                                content_type=content_type)
+        return object_name
+
+    def _object_url(self, object_name):
+        return self.client.presigned_get_object(self.bucket_name, object_name, expires=timedelta(hours=24))
+
+    def _record(self, list_key, item, event_data):
+        pipeline = self.redis_client.pipeline()
+        pipeline.rpush(list_key, json.dumps(item))
+        pipeline.expire(list_key, timedelta(days=1))
+        pipeline.publish(self.channel, pack_progress_message(PARTIAL_EVENT, event_data))
+        pipeline.execute()
+
+    def finish(self):
+        """
+        在编码器结束之后调用：上传剩余的结果和分片，标记所有部分结果已经上传
+        """
+        self._flush_result()
+        self.stop_event.set()
+        self.thread.join()
+        # 编码器结束时写入最后一个分片，这里再检查一次playlist
+        self._upload_segments()
+        pipeline = self.redis_client.pipeline()
+        pipeline.hset(progressive_state_key(self.task_id), 'ended', 1)
+        pipeline.expire(progressive_state_key(self.task_id), timedelta(days=1))
+        pipeline.publish(self.channel, pack_progress_message(PARTIAL_EVENT, {'type': PARTIAL_END}))
+        pipeline.execute()
+        shutil.rmtree(self.hls_dir, ignore_errors=True)
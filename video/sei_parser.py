@@ -1,9 +1,11 @@
 import platform
+import struct
 import subprocess
 from enum import Enum
 
 import numpy as np
 
+from common.config import config
 from common.log import LOGGER
 
 plat = platform.system().lower()
@@ -22,38 +24,78 @@ class SEIParser:
     parameter_type_size = 4
     sei_len_size = 4
     command = ['video/ffmpeg_sei_parse.exe' if plat == 'windows' else 'video/ffmpeg_sei_parser']
+    parameter_struct = struct.Struct('<II')
+    sei_len_struct = struct.Struct('<I')
 
-    def __init__(self, url):
+    def __init__(self, url, frame_pool_size=None):
         # rtsp/rtmp都可以作为url
-        self.pipe = subprocess.Popen(self.command + [url], shell=False, stdout=subprocess.PIPE)
+        # 较大的管道缓冲区使消息头等小块数据的读取不必每次都陷入系统调用
+        self.pipe = subprocess.Popen(self.command + [url], shell=False, stdout=subprocess.PIPE,
+                                     bufsize=config.get("sei_parser_pipe_buffer_size", 1024 * 1024))
         self.width = 0
         self.height = 0
         self.url = url
+        self.frame_pool_size = frame_pool_size if frame_pool_size else config.get("sei_parser_frame_pool_size", 4)
+        # 复用的消息头缓冲区，最长的消息头为宽高两个int
+        self.header_buffer = bytearray(self.parameter_struct.size)
+        self.header_view = memoryview(self.header_buffer)
+        self.frame_pool = []
+        self.frame_pool_index = 0
+
+    def _read_into(self, view):
+        """
+        把数据读满view，流结束时返回False
+        """
+        total = 0
+        while total < len(view):
+            size = self.pipe.stdout.readinto(view[total:])
+            if not size:
+                return False
+            total += size
+        return True
+
+    def _init_frame_pool(self):
+        # 帧缓冲区只在分辨率确定时分配一次，之后每一帧都直接读入池中的缓冲区
+        frame_size = self.height * self.width * 3
+        self.frame_pool = []
+        for _ in range(self.frame_pool_size):
+            frame_buffer = bytearray(frame_size)
+            frame = np.frombuffer(frame_buffer, dtype=np.uint8).reshape((self.height, self.width, 3))
+            self.frame_pool.append((memoryview(frame_buffer), frame))
+        self.frame_pool_index = 0
 
     def start(self):
         """
         从进程的stdout中读取字节流，字节流中每个消息的格式为：
         message_type + message
         其中message_type占message_type_size个字节，根据message_type来决定后面读取的方式
+
+        图像帧被读入预先分配的帧缓冲池中轮流复用，yield出的帧在之后的frame_pool_size - 1帧内有效，
+        需要长期保存帧的调用方应自行复制
         """
         while True:
-            message_type_byte = self.pipe.stdout.read(self.message_type_size)
-            message_type = int.from_bytes(message_type_byte, byteorder='little')
+            if not self._read_into(self.header_view[:self.message_type_size]):
+                LOGGER.info(f"url: {self.url} stream closed")
+                break
+            message_type = self.header_buffer[0]
             if message_type == MessageType.END_MESSAGE.value:
                 LOGGER.info(f"url: {self.url} ended")
                 break
             elif message_type == MessageType.PARAMETER_TYPE.value:
                 # 宽度和高度信息很重要，根据宽高才能知道读取帧时应该读多少个字节，即width * height * 3个字节
-                width_byte = self.pipe.stdout.read(self.parameter_type_size)
-                height_byte = self.pipe.stdout.read(self.parameter_type_size)
-                width = int.from_bytes(width_byte, byteorder='little')
-                height = int.from_bytes(height_byte, byteorder='little')
+                if not self._read_into(self.header_view[:self.parameter_struct.size]):
+                    LOGGER.error("parameter data error")
+                    break
+                width, height = self.parameter_struct.unpack_from(self.header_buffer)
                 self.width = width
                 self.height = height
+                self._init_frame_pool()
                 yield message_type, width, height
             elif message_type == MessageType.SEI.value:
-                sei_data_len_byte = self.pipe.stdout.read(self.sei_len_size)
-                sei_data_len = int.from_bytes(sei_data_len_byte, byteorder='little')
+                if not self._read_into(self.header_view[:self.sei_len_struct.size]):
+                    LOGGER.error("sei data len error")
+                    break
+                sei_data_len, = self.sei_len_struct.unpack_from(self.header_buffer)
                 if sei_data_len <= 0:
                     LOGGER.error("sei data len error")
                     break
@@ -63,11 +105,14 @@ class SEIParser:
                     break
                 yield message_type, sei_data.decode('utf-8')
             elif message_type == MessageType.IMAGE_FRAME.value:
-                bgr24_data = self.pipe.stdout.read(self.height * self.width * 3)
-                if len(bgr24_data) < self.height * self.width * 3:
+                if len(self.frame_pool) == 0:
+                    LOGGER.error("image frame received before parameter")
+                    break
+                frame_view, bgr_img = self.frame_pool[self.frame_pool_index]
+                self.frame_pool_index = (self.frame_pool_index + 1) % len(self.frame_pool)
+                if not self._read_into(frame_view):
                     LOGGER.error("bgr24 data len error")
                     break
-                bgr_img = np.frombuffer(bgr24_data, dtype=np.uint8).reshape((self.height, self.width, 3))
                 yield message_type, bgr_img
         if self.pipe:
             self.pipe.terminate()
@@ -0,0 +1,155 @@
+import os
+import subprocess
+import threading
+
+from common.config import config
+from common.log import LOGGER
+from microservice.minio_storage import create_minio_client
+
+# minio要求multipart上传除最后一个分片外每个分片不小于5MiB
+MIN_PART_SIZE = 5 * 1024 * 1024
+
+
+def result_video_object_name(task_id):
+    # 边处理边上传的输出视频以固定的对象名上传，任务结束时直接根据对象名生成下载链接
+    return f"output_{task_id}.mp4"
+
+
+class StreamUploader:
+    """
+    在后台线程中把数据流以multipart方式上传到对象存储：数据每凑满part_size字节就作为一个分片上传，
+    处理过程中输出已经在持续上传，数据结束后只需要等待最后一个分片上传完成。
+
+    source为None时通过write()写入数据，数据经过管道交给minio客户端；
+    否则直接读取source（例如ffmpeg的stdout）直到结束
+    """
+
+    def __init__(self, object_name, content_type="application/octet-stream", source=None):
+        self.object_name = object_name
+        self.content_type = content_type
+        self.writer = None
+        if source is None:
+            read_fd, write_fd = os.pipe()
+            source = os.fdopen(read_fd, 'rb')
+            self.writer = os.fdopen(write_fd, 'wb')
+        self.source = source
+        self.error = None
+        self.client = create_minio_client()
+        self.bucket_name = config.get("bucket_name")
+        part_size = config.get("video_stream_upload_part_size", 8 * 1024 * 1024)
+        self.part_size = max(int(part_size), MIN_PART_SIZE)
+        self.thread = threading.Thread(target=self._upload, daemon=True)
+        self.thread.start()
+
+    def _upload(self):
+        try:
+            # length为-1时minio客户端按part_size分片读取，读到流结束后完成multipart上传
+            self.client.put_object(self.bucket_name, self.object_name, self.source, length=-1,
+                                   part_size=self.part_size, content_type=self.content_type)
+        except Exception as e:
+            self.error = e
+            LOGGER.error(f"stream upload failed, object_name: {self.object_name}, error: {e}")
+        finally:
+            self.source.close()
+
+    def write(self, data):
+        if self.error is not None:
+            return
+        try:
+            self.writer.write(data)
+        except OSError as e:
+            # 上传线程异常退出，错误已经记录在self.error中
+            LOGGER.error(f"write stream upload pipe failed: {e}")
+
+    def finish(self):
+        """
+        结束数据流并等待最后一个分片上传完成，返回是否上传成功
+        """
+        if self.writer:
+            try:
+                self.writer.close()
+            except OSError as e:
+                # 上传线程异常退出后管道的读端已经关闭
+                LOGGER.error(f"close stream upload pipe failed: {e}")
+        self.thread.join()
+        return self.error is None
+
+
+class StreamVideoWriter:
+    """
+    与cv2.VideoWriter用法相同的视频写入器，帧交给ffmpeg编码为分片mp4（fragmented mp4）并边编码边上传。
+    普通mp4的moov在文件结束时才写入，必须等编码完成才能上传；分片mp4每个关键帧开始一个新的分片，
+    输出是只追加的字节流，可以直接作为multipart上传的数据源，不需要在本地磁盘保存完整的视频。
+
+    传入hls_dir时通过tee复用同一次编码，同时在hls_dir中写入HLS的fmp4分片和playlist，用于处理过程中的播放
+    """
+
+    def __init__(self, object_name, fps, frame_size, hls_dir=None):
+        frame_width, frame_height = frame_size
+        command = ['ffmpeg', '-loglevel', 'error', '-y',
+                   '-f', 'rawvideo', '-pix_fmt', 'bgr24', '-s', f'{frame_width}x{frame_height}',
+                   '-r', str(fps if fps > 0 else 30), '-i', '-',
+                   '-c:v', config.get("video_stream_upload_codec", "libx264"), '-pix_fmt', 'yuv420p',
+                   '-g', str(config.get("video_stream_upload_gop", 60))]
+        movflags = 'frag_keyframe+empty_moov+default_base_moof'
+        if hls_dir:
+            hls_time = config.get("video_progressive_segment_seconds", 4)
+            command += ['-map', '0:v', '-f', 'tee',
+                        f'[f=mp4:movflags={movflags}]pipe:1|'
+                        f'[f=hls:hls_time={hls_time}:hls_playlist_type=event:hls_segment_type=fmp4:'
+                        f'hls_segment_filename={hls_dir}/seg_%05d.m4s]{hls_dir}/index.m3u8']
+        else:
+            command += ['-movflags', movflags, '-f', 'mp4', 'pipe:1']
+        self.process = subprocess.Popen(command, stdin=subprocess.PIPE, stdout=subprocess.PIPE,
+                                        stderr=subprocess.DEVNULL)
+        self.uploader = StreamUploader(object_name, "video/mp4", source=self.process.stdout)
+        self.failed = False
+
+    def write(self, image):
+        if self.failed:
+            return
+        try:
+            # 帧是连续内存，直接写入缓冲区，不额外复制
+            self.process.stdin.write(image.data)
+        except OSError as e:
+            # 上传中途失败时上传线程关闭ffmpeg的stdout，ffmpeg随之退出，写入管道会抛出BrokenPipeError。
+            # 之后的帧不再写入，调用方继续处理剩余的帧，release()返回False
+            self.failed = True
+            LOGGER.error(f"write ffmpeg stdin failed, object_name: {self.uploader.object_name}, error: {e}")
+
+    def release(self):
+        """
+        结束编码并等待上传完成，返回是否上传成功
+        """
+        try:
+            self.process.stdin.close()
+        except OSError as e:
+            self.failed = True
+            LOGGER.error(f"close ffmpeg stdin failed: {e}")
+        return_code = self.process.wait()
+        uploaded = self.uploader.finish()
+        if return_code != 0:
+            LOGGER.error(f"ffmpeg exited with code {return_code}, object_name: {self.uploader.object_name}")
+            return False
+        return uploaded and not self.failed
+
+
+class StreamJsonlWriter:
+    """
+    jsonl结果同时写入本地文件和对象存储：本地文件用于生成结果容器等后续处理，上传随写入进行
+    """
+
+    def __init__(self, object_name, json_path):
+        self.json_file = open(json_path, 'w')
+        self.uploader = StreamUploader(object_name, "application/json")
+
+    def write(self, json_line):
+        self.json_file.write(json_line)
+        self.uploader.write(json_line.encode('utf-8'))
+
+    def close(self):
+        """
+        返回是否上传成功
+        """
+        self.json_file.close()
+        return self.uploader.finish()
@@ -2,60 +2,80 @@ import multiprocessing
 import queue
 
 from common.log import LOGGER
+from video.latest_frame_mailbox import LatestFrameMailbox
 from video.sei_parser import MessageType, SEIParser
 
 
 class UnbufferedSEIParser:
 
     def __init__(self, rtmp_url):
-        self.q = multiprocessing.Queue()
+        self.mailbox = LatestFrameMailbox()
         self.param_queue = multiprocessing.Queue()
         self.sei_queue = multiprocessing.Queue()
         self.stop_queue = multiprocessing.Queue()
         self.process = multiprocessing.Process(target=self._reader, daemon=True,
-                                               args=[self.q, self.param_queue, self.sei_queue,
+                                               args=[self.mailbox, self.param_queue, self.sei_queue,
                                                      rtmp_url, self.stop_queue])
         self.process.start()
 
     # 帧可用时立即读取帧，只保留最新的帧
     @staticmethod
-    def _reader(q, param_queue, sei_queue, rtmp_url, stop_queue):
+    def _reader(mailbox, param_queue, sei_queue, rtmp_url, stop_queue):
         sei_parser = SEIParser(rtmp_url)
         ffmpeg_parser_gen = sei_parser.start()
         ffmpeg_parse_data = next(ffmpeg_parser_gen)
         if ffmpeg_parse_data[0] == MessageType.PARAMETER_TYPE.value:
             width = ffmpeg_parse_data[1]
             height = ffmpeg_parse_data[2]
-            param_queue.put((width, height))
-        for ffmpeg_parse_data in ffmpeg_parser_gen:
-            if stop_queue.qsize() > 0:
-                sei_parser.release()
-                q.put(None)
-                break
-            if ffmpeg_parse_data[0] == MessageType.SEI.value:
-                sei_str = ffmpeg_parse_data[1]
-                sei_queue.put(sei_str)
-                continue
-            if ffmpeg_parse_data[0] != MessageType.IMAGE_FRAME.value:
-                LOGGER.error("MessageType mismatch")
-                q.put(None)
-                break
-            image = ffmpeg_parse_data[1]
-            q.put(image)
-            size = q.qsize()
-            if size > 2:
-                for i in range(size - 2):
-                    try:
-                        q.get_nowait()
-                    except queue.Empty:
-                        pass
-        q.put(None)
+            shm_name = mailbox.create(width, height)
+            param_queue.put((width, height, shm_name))
+        try:
+            for ffmpeg_parse_data in ffmpeg_parser_gen:
+                if stop_queue.qsize() > 0:
+                    sei_parser.release()
+                    break
+                if ffmpeg_parse_data[0] == MessageType.SEI.value:
+                    sei_str = ffmpeg_parse_data[1]
+                    sei_queue.put(sei_str)
+                    continue
+                if ffmpeg_parse_data[0] != MessageType.IMAGE_FRAME.value:
+                    LOGGER.error("MessageType mismatch")
+                    break
+                mailbox.write(ffmpeg_parse_data[1])
+        finally:
+            mailbox.close()
+            mailbox.release()
+
+    def read(self, timeout=None):
+        """
+        返回最新的一帧，返回的帧在下一次调用read()之前有效，视频流结束时返回None。
+        timeout为None时一直等待新的帧，否则最多等待timeout秒，超时返回False
+        """
+        while True:
+            frame = self.mailbox.read(timeout=1 if timeout is None else timeout)
+            if frame is not False:
+                return frame
+            if not self.process.is_alive():
+                return None
+            if timeout is not None:
+                return False
+
+    def frame_age_ms(self):
+        # 上一次read()返回的帧距离被解析出来经过的毫秒数
+        return self.mailbox.frame_age_ms()
+
+    def frame_timestamp(self):
+        # 上一次read()返回的帧被写入信箱的时间（秒）
+        return self.mailbox.last_read_timestamp
 
-    def read(self):
-        return self.q.get()
+    def frame_seq(self):
+        # 上一次read()返回的帧的序号，即截至该帧解析出来的帧数，用于统计视频源的帧率
+        return self.mailbox.last_read_seq
 
     def get_param(self):
-        return self.param_queue.get()
+        width, height, shm_name = self.param_queue.get()
+        self.mailbox.attach(shm_name, width, height)
+        return width, height
 
     def get_sei(self):
         try:
@@ -70,3 +90,4 @@ class UnbufferedSEIParser:
         if self.process:
             self.process.join(timeout=5)
             self.process.terminate()
+        self.mailbox.release(unlink=True)
@@ -1,51 +1,74 @@
 import multiprocessing
 
-import queue
-
 import cv2
 
+from video.latest_frame_mailbox import LatestFrameMailbox
+
 
 # 无缓存读取视频流
 class UnbufferedVideoCapture:
 
     def __init__(self, video_capture_url):
-        self.q = multiprocessing.Queue()
+        self.mailbox = LatestFrameMailbox()
         self.param_queue = multiprocessing.Queue()
         self.log_queue = multiprocessing.Queue()
         self.process = multiprocessing.Process(target=self._reader, daemon=True,
-                                               args=[self.q, self.param_queue, self.log_queue, video_capture_url])
+                                               args=[self.mailbox, self.param_queue, self.log_queue,
+                                                     video_capture_url])
         self.process.start()
 
     # 帧可用时立即读取帧，只保留最新的帧
     @staticmethod
-    def _reader(q, param_queue, log_queue, cap_url):
+    def _reader(mailbox, param_queue, log_queue, cap_url):
         cap = cv2.VideoCapture(cap_url)
         if not cap.isOpened():
             log_queue.put("打开摄像头失败")
             return
         frame_width = int(cap.get(cv2.CAP_PROP_FRAME_WIDTH))
         frame_height = int(cap.get(cv2.CAP_PROP_FRAME_HEIGHT))
-        param_queue.put((frame_width, frame_height))
+        shm_name = mailbox.create(frame_width, frame_height)
+        param_queue.put((frame_width, frame_height, shm_name))
+        try:
+            while True:
+                ret, frame = cap.read()
+                if not ret:
+                    break
+                mailbox.write(frame)
+        finally:
+            mailbox.close()
+            mailbox.release()
+            cap.release()
+
+    def read(self, timeout=None):
+        """
+        返回最新的一帧，返回的帧在下一次调用read()之前有效，视频流结束时返回None。
+        timeout为None时一直等待新的帧，否则最多等待timeout秒，超时返回False
+        """
         while True:
-            ret, frame = cap.read()
-            if not ret:
-                q.put(None)
-                break
-            size = q.qsize()
-            # print(f'qsize = {size}')
-            if size > 2:
-                for i in range(size - 2):
-                    try:
-                        q.get_nowait()
-                    except queue.Empty:
-                        pass
-            q.put(frame)
-
-    def read(self):
-        return self.q.get()
+            frame = self.mailbox.read(timeout=1 if timeout is None else timeout)
+            if frame is not False:
+                return frame
+            if not self.process.is_alive():
+                return None
+            if timeout is not None:
+                return False
+
+    def frame_age_ms(self):
+        # 上一次read()返回的帧距离被解码出来经过的毫秒数
+        return self.mailbox.frame_age_ms()
+
+    def frame_timestamp(self):
+        # 上一次read()返回的帧被写入信箱的时间（秒）
+        return self.mailbox.last_read_timestamp
+
+    def frame_seq(self):
+        # 上一次read()返回的帧的序号，即截至该帧解码出来的帧数，用于统计视频源的帧率
+        return self.mailbox.last_read_seq
 
     def get_param(self):
-        return self.param_queue.get()
+        frame_width, frame_height, shm_name = self.param_queue.get()
+        self.mailbox.attach(shm_name, frame_width, frame_height)
+        return frame_width, frame_height
 
     def get_log(self):
         if self.log_queue.empty():
@@ -55,3 +78,4 @@ class UnbufferedVideoCapture:
     def release(self):
         if self.process:
             self.process.terminate()
+        self.mailbox.release(unlink=True)
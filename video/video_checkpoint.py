@@ -0,0 +1,142 @@
+import hashlib
+import json
+import os
+import shutil
+
+from common.config import config
+from common.log import LOGGER
+from video.video_segment import concat_videos
+
+try:
+    import fcntl
+except ImportError:
+    # windows下没有fcntl，不对检查点加锁
+    fcntl = None
+
+# 计算检查点id时读取的视频文件头部字节数
+VIDEO_HEAD_SIZE = 1024 * 1024
+
+
+def compute_checkpoint_id(service_name, video_path, hyperparameters):
+    """
+    检查点id由服务名、超参数、视频文件大小和文件头部内容决定，同一个视频以相同参数重新提交时可以找到之前的检查点
+    """
+    sha256 = hashlib.sha256()
+    sha256.update(service_name.encode('utf-8'))
+    sha256.update(json.dumps(hyperparameters, sort_keys=True,
+                             default=lambda o: o.__json__() if hasattr(o, '__json__') else o.__dict__)
+                  .encode('utf-8'))
+    sha256.update(str(os.path.getsize(video_path)).encode('utf-8'))
+    with open(video_path, 'rb') as f:
+        sha256.update(f.read(VIDEO_HEAD_SIZE))
+    return sha256.hexdigest()
+
+
+class VideoCheckpoint:
+    """
+    视频任务的检查点，保存在本地磁盘的checkpoint_dir目录下：
+
+    - checkpoint.json：已经写入输出的帧数frame_index、jsonl文件的有效长度jsonl_offset、已经编码完成的分片数part_count
+    - part_xxxxx.mp4：编码完成的输出视频分片，mp4在写入过程中崩溃会无法读取，所以每个检查点都结束当前分片并开始新的分片
+    - output.jsonl：已经写入的结果，恢复时截断到jsonl_offset
+
+    恢复时从frame_index开始继续处理，任务完成后按顺序拼接所有分片得到完整的输出视频
+    """
+    STATE_FILE = 'checkpoint.json'
+    JSONL_FILE = 'output.jsonl'
+
+    def __init__(self, checkpoint_dir):
+        self.checkpoint_dir = checkpoint_dir
+        self.frame_index = 0
+        self.jsonl_offset = 0
+        self.part_count = 0
+        self.lock_file = None
+
+    @classmethod
+    def for_video(cls, service_name, video_path, hyperparameters):
+        checkpoint_root = config.get("video_checkpoint_dir", "temp/checkpoints")
+        checkpoint_id = compute_checkpoint_id(service_name, video_path, hyperparameters)
+        return cls(os.path.join(checkpoint_root, checkpoint_id))
+
+    def __getstate__(self):
+        # 锁只由创建检查点的进程持有，不随对象传递给后台写进程
+        state = self.__dict__.copy()
+        state['lock_file'] = None
+        return state
+
+    @property
+    def jsonl_path(self):
+        return os.path.join(self.checkpoint_dir, self.JSONL_FILE)
+
+    def part_path(self, part_index):
+        return os.path.join(self.checkpoint_dir, f'part_{part_index:05d}.mp4')
+
+    def acquire(self):
+        """
+        加锁防止相同的视频和参数同时被两个任务处理，进程退出（包括崩溃）时锁自动释放，加锁失败返回False
+        """
+        os.makedirs(self.checkpoint_dir, exist_ok=True)
+        if fcntl is None:
+            return True
+        self.lock_file = open(os.path.join(self.checkpoint_dir, 'lock'), 'w')
+        try:
+            fcntl.flock(self.lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            return True
+        except OSError:
+            self.lock_file.close()
+            self.lock_file = None
+            return False
+
+    def load(self):
+        """
+        读取已有的检查点并截断jsonl文件，返回是否存在可以恢复的检查点
+        """
+        state_path = os.path.join(self.checkpoint_dir, self.STATE_FILE)
+        if not os.path.exists(state_path):
+            # 没有检查点时丢弃上一次残留的输出
+            open(self.jsonl_path, 'w').close()
+            return False
+        with open(state_path, 'r') as f:
+            state = json.load(f)
+        self.frame_index = state['frame_index']
+        self.jsonl_offset = state['jsonl_offset']
+        self.part_count = state['part_count']
+        with open(self.jsonl_path, 'a') as f:
+            f.truncate(self.jsonl_offset)
+        return self.frame_index > 0
+
+    def save(self, frame_index, jsonl_offset, part_count):
+        # 先写临时文件再替换，避免写入过程中崩溃导致检查点损坏
+        self.frame_index = frame_index
+        self.jsonl_offset = jsonl_offset
+        self.part_count = part_count
+        state_path = os.path.join(self.checkpoint_dir, self.STATE_FILE)
+        temp_path = state_path + '.tmp'
+        with open(temp_path, 'w') as f:
+            json.dump({'frame_index': frame_index, 'jsonl_offset': jsonl_offset, 'part_count': part_count}, f)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(temp_path, state_path)
+
+    def merge(self, video_output_path, video_output_json_path):
+        """
+        把所有分片拼接为完整的输出视频，jsonl复制到输出路径
+        """
+        part_paths = [self.part_path(part_index) for part_index in range(self.part_count)]
+        if len(part_paths) == 1:
+            shutil.copyfile(part_paths[0], video_output_path)
+        elif len(part_paths) > 1:
+            concat_videos(part_paths, video_output_path)
+        shutil.copyfile(self.jsonl_path, video_output_json_path)
+
+    def remove(self):
+        if self.lock_file:
+            self.lock_file.close()
+            self.lock_file = None
+        shutil.rmtree(self.checkpoint_dir, ignore_errors=True)
+        LOGGER.info(f"video checkpoint removed: {self.checkpoint_dir}")
+
+    def release(self):
+        if self.lock_file:
+            self.lock_file.close()
+            self.lock_file = None
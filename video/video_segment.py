@@ -0,0 +1,113 @@
+import json
+import os
+import subprocess
+from datetime import timedelta
+
+from common.config import config
+from common.dispatch import get_live_capacity
+from common.log import LOGGER
+
+# 分段任务的task_id为"{父任务task_id}{SEGMENT_TASK_SEPARATOR}{分段序号}"
+SEGMENT_TASK_SEPARATOR = "_segment_"
+
+
+def segment_task_id(task_id, index):
+    return f"{task_id}{SEGMENT_TASK_SEPARATOR}{index}"
+
+
+def is_segment_task_id(task_id):
+    return SEGMENT_TASK_SEPARATOR in task_id
+
+
+def parse_segment_task_id(task_id):
+    """
+    返回(父任务task_id, 分段序号)
+    """
+    parent_task_id, index = task_id.rsplit(SEGMENT_TASK_SEPARATOR, 1)
+    return parent_task_id, int(index)
+
+
+def get_segment_num(redis_client, service_name, duration):
+    """
+    协调进程处理一段，其余各段交给在线实例的空闲槽位，每段不短于video_split_min_segment_seconds
+    """
+    max_segment_num = config.get("video_split_max_segments", 8)
+    min_segment_seconds = config.get("video_split_min_segment_seconds", 30)
+    free_capacity = sum(get_live_capacity(redis_client, service_name).values())
+    return max(min(free_capacity + 1, max_segment_num, int(duration // min_segment_seconds)), 1)
+
+
+def segment_result_key(task_id):
+    # list，分段处理完毕后把{'index', 'video_url', 'json_url', 'error'}推入父任务的该列表，error为None表示分段处理成功
+    return task_id + "_segment_results"
+
+
+def probe_duration(video_path):
+    """
+    返回视频时长（秒），获取失败时返回0
+    """
+    command = ['ffprobe', '-v', 'error', '-show_entries', 'format=duration',
+               '-of', 'default=noprint_wrappers=1:nokey=1', video_path]
+    try:
+        output = subprocess.run(command, capture_output=True, check=True, text=True).stdout
+        return float(output.strip())
+    except (subprocess.CalledProcessError, ValueError) as e:
+        LOGGER.error(f"probe video duration failed: {video_path}, error: {e}")
+        return 0
+
+
+def split_video(video_path, segment_seconds, output_dir):
+    """
+    不重新编码，按segment_seconds把视频切分为多段。流复制时只能在关键帧处切分，
+    所以每一段都从关键帧开始，各段的帧首尾相接、不重叠，分段数量可能少于预期
+    """
+    os.makedirs(output_dir, exist_ok=True)
+    command = ['ffmpeg', '-y', '-v', 'error',
+               '-i', video_path,
+               '-map', '0:v:0', '-an',
+               '-c', 'copy',
+               '-f', 'segment',
+               '-segment_time', str(segment_seconds),
+               '-reset_timestamps', '1',
+               os.path.join(output_dir, 'segment_%03d.mp4')]
+    subprocess.run(command, check=True)
+    return sorted(os.path.join(output_dir, file_name) for file_name in os.listdir(output_dir)
+                  if file_name.startswith('segment_'))
+
+
+def concat_videos(video_paths, output_path):
+    """
+    各段输出视频的编码参数相同，使用concat demuxer直接拼接，不重新编码
+    """
+    list_path = output_path + '.txt'
+    with open(list_path, 'w') as f:
+        for video_path in video_paths:
+            f.write(f"file '{os.path.abspath(video_path)}'\n")
+    command = ['ffmpeg', '-y', '-v', 'error',
+               '-f', 'concat', '-safe', '0',
+               '-i', list_path,
+               '-c', 'copy',
+               output_path]
+    try:
+        subprocess.run(command, check=True)
+    finally:
+        os.remove(list_path)
+
+
+def concat_jsonl(jsonl_paths, output_path):
+    # jsonl的每一行对应一帧，按分段顺序拼接后与拼接后的视频逐帧对应
+    with open(output_path, 'w') as output_file:
+        for jsonl_path in jsonl_paths:
+            with open(jsonl_path, 'r') as f:
+                for line in f:
+                    if line.strip():
+                        output_file.write(line if line.endswith('\n') else line + '\n')
+
+
+def push_segment_result(redis_client, task_id, video_url, json_url, error=None):
+    parent_task_id, index = parse_segment_task_id(task_id)
+    pipeline = redis_client.pipeline()
+    pipeline.rpush(segment_result_key(parent_task_id),
+                   json.dumps({'index': index, 'video_url': video_url, 'json_url': json_url, 'error': error}))
+    pipeline.expire(segment_result_key(parent_task_id), timedelta(days=1))
+    pipeline.execute()
@@ -1,21 +1,58 @@
 import json
+import queue
+import threading
 from datetime import timedelta
 
 import cv2
 
+from common.config import config
 from common.log import LOGGER
+from common.progress_publisher import ProgressPublisher
+from common.result_container import result_jsonl_object_name
 from common.util import create_redis_client
 from scripts.video_common import after_video_call
 from video.background_write_process import BackgroundWriteProcess
+from video.pipeline_stats import StageStats
+from video.stream_upload import result_video_object_name
+from video.video_checkpoint import VideoCheckpoint
+from video.video_segment import is_segment_task_id
 
 
 class VideoTemplate:
+    """
+    视频任务的流水线模板，分为四个阶段：
+
+    1. decode：解码线程预先读取视频帧，放入有界队列
+    2. infer：主线程从队列中按batch取出帧，调用ai_batch_func（或逐帧调用ai_func）进行推理
+    3. draw：绘制线程调用draw_func在帧上绘制结果，并把帧和结果交给后台写进程
+    4. encode：后台写进程负责编码mp4和写入jsonl文件
+
+    相邻阶段之间通过有界队列连接，各阶段可以并行执行，队列满时上游阶段阻塞等待。
+    每个阶段都会统计自身的利用率，任务结束时写入日志和redis，用于判断长视频处理的瓶颈所在。
+
+    开启检查点时后台写进程定期保存检查点，相同的视频以相同的参数重新提交时从检查点继续处理。
+    stateful为True表示推理依赖前面帧的状态（例如跟踪），恢复时先推理检查点之前的若干帧重建状态，这些帧的结果不输出。
+
+    没有使用检查点时，开启video_stream_upload_enabled后输出视频和jsonl在处理过程中就以multipart方式上传，
+    最后一帧处理完后只需要等待最后一个分片上传完成；再开启video_progressive_enabled时，
+    处理过程中还会发布HLS分片和结果分块，前端可以在任务完成前播放和浏览已经处理过的部分
+    """
+
     def __init__(self, video_path, video_output_path, video_output_json_path, video_progress_key,
-                 hyperparameters, task_id, service_unique_id, service_name, ai_func=None):
+                 hyperparameters, task_id, service_unique_id, service_name, ai_func=None,
+                 ai_batch_func=None, draw_func=None, batch_size=None, stateful=False):
         # ai_func接收image返回以字典为元素的列表
         self.ai_func = ai_func
+        # ai_batch_func接收image列表，返回与image一一对应的结果列表
+        self.ai_batch_func = ai_batch_func
+        # draw_func接收image和ai_func的结果，在image上绘制结果，为None时不绘制（例如已在ai_func中绘制）
+        self.draw_func = draw_func
+        if batch_size is None:
+            batch_size = config.get("video_pipeline_batch_size", 8) if ai_batch_func else 1
+        self.batch_size = max(int(batch_size), 1)
         self.task_id = task_id
         self.log_key = task_id + "_log"
+        self.stats_key = task_id + "_pipeline_stats"
         self.service_unique_id = service_unique_id
         self.video_path = video_path
         self.video_output_path = video_output_path
@@ -33,41 +70,216 @@ class VideoTemplate:
         self.width = frame_width
         self.height = frame_height
         fps = int(video_capture.get(cv2.CAP_PROP_FPS))
-        self.camera_write_process = BackgroundWriteProcess(self.video_output_path, self.video_output_json_path,
-                                                           self.width, self.height, fps)
+        self.fps = fps
         self.total_frame_count = int(video_capture.get(cv2.CAP_PROP_FRAME_COUNT))
+        self.checkpoint = None
+        self.start_frame_index = 0
+        if config.get("video_checkpoint_enabled", False):
+            self.checkpoint = self.open_checkpoint(hyperparameters)
+        replay_frames = config.get("video_checkpoint_replay_frames", 30) if stateful else 0
+        # 解码从decode_start_index开始，decode_start_index到start_frame_index之间的帧只推理不输出
+        self.decode_start_index = max(self.start_frame_index - replay_frames, 0)
+        stream_upload = None
+        progressive_task_id = None
+        if self.checkpoint is None and config.get("video_stream_upload_enabled", False):
+            # 检查点依赖本地的mp4分片，与边处理边上传不能同时使用
+            stream_upload = (result_video_object_name(task_id), result_jsonl_object_name(task_id))
+            # 长视频的分段由协调进程汇总，前端只订阅父任务，分段不发布部分结果
+            if config.get("video_progressive_enabled", False) and not is_segment_task_id(task_id):
+                progressive_task_id = task_id
+        self.camera_write_process = BackgroundWriteProcess(self.video_output_path, self.video_output_json_path,
+                                                           self.width, self.height, fps, checkpoint=self.checkpoint,
+                                                           stream_upload=stream_upload,
+                                                           progressive_task_id=progressive_task_id)
         self.video_capture = video_capture
         self.redis_client = create_redis_client()
-        self.redis_client.setex(name=video_progress_key, time=timedelta(days=1), value="0.00")
+        # 进度节流后发布到redis channel，由网关推送给前端，不再每个batch写一次redis
+        self.progress_publisher = ProgressPublisher(self.redis_client, task_id)
+        self.progress_publisher.update(0, force=True)
+
+        queue_size = config.get("video_pipeline_queue_size", 32)
+        self.frame_queue = queue.Queue(maxsize=queue_size)
+        self.result_queue = queue.Queue(maxsize=queue_size)
+        self.stop_event = threading.Event()
+        self.stage_error = None
+        self.stage_stats = {name: StageStats(name) for name in ['decode', 'infer', 'draw']}
+
+    def open_checkpoint(self, hyperparameters):
+        try:
+            checkpoint = VideoCheckpoint.for_video(self.service_name, self.video_path, hyperparameters)
+            if not checkpoint.acquire():
+                LOGGER.info(f"video checkpoint is in use, run without checkpoint, task_id: {self.task_id}")
+                return None
+            if checkpoint.load():
+                self.start_frame_index = checkpoint.frame_index
+                LOGGER.info(f"resume video task from frame {self.start_frame_index}, task_id: {self.task_id}")
+            return checkpoint
+        except Exception as e:
+            LOGGER.error(f"open video checkpoint failed: {e}")
+            return None
 
     def loop_process(self):
+        decode_thread = threading.Thread(target=self._decode_loop, daemon=True)
+        draw_thread = threading.Thread(target=self._draw_loop, daemon=True)
+        completed = False
+        error = None
         try:
-            current_frame_count = 0
-            with open(self.video_output_json_path, 'w') as f:
-                # 逐帧读取视频
-                while True:
-                    # 读取一帧
-                    ret, image = self.video_capture.read()
-                    # 检查是否成功读取帧
-                    if not ret:
-                        break
-                    current_frame_count += 1
-                    progress_str = "%.2f" % (current_frame_count / self.total_frame_count)
-                    self.redis_client.setex(name=self.video_progress_key, time=timedelta(days=1), value=progress_str)
-                    # 对帧进行处理
-                    json_items = self.ai_func(image)
-                    self.camera_write_process.put(image, json.dumps(json_items))
+            decode_thread.start()
+            draw_thread.start()
+            self._infer_loop()
+            completed = True
         except Exception as e:
-            self.log(str(e))
+            error = str(e)
+            self.log(error)
             raise
         finally:
+            self.stop_event.set()
+            # 各阶段取数据时都会检查stop_event，不需要再向队列放入结束标记
+            decode_thread.join()
+            draw_thread.join()
             self.video_capture.release()
-            self.camera_write_process.release()
+            encode_stats = self.camera_write_process.release()
+            self.report_pipeline_stats(encode_stats)
+            if self.checkpoint:
+                self.merge_checkpoint()
             after_video_call(self.video_output_path, self.video_output_json_path,
-                             self.task_id, self.service_name, self.service_unique_id)
+                             self.task_id, self.service_name, self.service_unique_id,
+                             stream_uploaded=self.camera_write_process.stream_uploaded,
+                             stream_failed=self.camera_write_process.stream_failed, fps=self.fps, error=error)
+            if self.checkpoint:
+                # 任务失败时保留检查点，重新提交后从检查点继续
+                if completed:
+                    self.checkpoint.remove()
+                else:
+                    self.checkpoint.release()
 
-    def log(self, log_str):
+    def merge_checkpoint(self):
+        try:
+            self.checkpoint.merge(self.video_output_path, self.video_output_json_path)
+        except Exception as e:
+            LOGGER.error(f"merge video checkpoint failed: {e}")
+
+    def _put(self, q, item):
+        """
+        向有界队列放入数据，流水线停止时放弃并返回False，避免上游阶段永久阻塞
+        """
+        while not self.stop_event.is_set():
+            try:
+                q.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def _get(self, q):
+        """
+        从有界队列取出数据，队列为空且流水线已经停止时返回None，
+        避免相邻阶段出错退出、没有放入结束标记时下游阶段永久阻塞
+        """
+        while True:
+            try:
+                return q.get(timeout=0.1)
+            except queue.Empty:
+                if self.stop_event.is_set():
+                    return None
+
+    def _decode_loop(self):
+        stats = self.stage_stats['decode']
+        try:
+            with stats.busy():
+                # 从检查点恢复时跳过已经处理过的帧，逐帧grab比按帧号seek更准确
+                for _ in range(self.decode_start_index):
+                    if not self.video_capture.grab():
+                        break
+            while not self.stop_event.is_set():
+                with stats.busy():
+                    ret, image = self.video_capture.read()
+                # 检查是否成功读取帧
+                if not ret:
+                    break
+                stats.item_count += 1
+                with stats.wait():
+                    if not self._put(self.frame_queue, image):
+                        break
+        except Exception as e:
+            self.stage_error = e
+        finally:
+            # None表示视频读取结束
+            self._put(self.frame_queue, None)
+
+    def _infer_loop(self):
+        stats = self.stage_stats['infer']
+        current_frame_count = self.decode_start_index
+        replay_remaining = self.start_frame_index - self.decode_start_index
+        finished = False
+        while not finished:
+            frames = []
+            with stats.wait():
+                while len(frames) < self.batch_size:
+                    image = self._get(self.frame_queue)
+                    if image is None:
+                        finished = True
+                        break
+                    frames.append(image)
+            if len(frames) == 0:
+                break
+            with stats.busy(len(frames)):
+                results = self._infer(frames)
+            current_frame_count += len(frames)
+            self.progress_publisher.update(current_frame_count / self.total_frame_count)
+            outputs = list(zip(frames, results))
+            if replay_remaining > 0:
+                # 重建状态用的帧已经输出过，不再交给后续阶段
+                replay_count = min(replay_remaining, len(outputs))
+                outputs = outputs[replay_count:]
+                replay_remaining -= replay_count
+            for image, json_items in outputs:
+                if not self._put(self.result_queue, (image, json_items)):
+                    break
+            if self.stage_error is not None:
+                raise self.stage_error
+        if current_frame_count > 0:
+            # 节流可能跳过了最后一次进度，结束时强制发布
+            self.progress_publisher.update(current_frame_count / self.total_frame_count, force=True)
+        self._put(self.result_queue, None)
+        if self.stage_error is not None:
+            raise self.stage_error
+
+    def _infer(self, frames):
+        if self.ai_batch_func:
+            return self.ai_batch_func(frames)
+        return [self.ai_func(image) for image in frames]
+
+    def _draw_loop(self):
+        stats = self.stage_stats['draw']
+        try:
+            while True:
+                with stats.wait():
+                    item = self._get(self.result_queue)
+                if item is None:
+                    break
+                image, json_items = item
+                with stats.busy(1):
+                    if self.draw_func:
+                        self.draw_func(image, json_items)
+                    self.camera_write_process.put(image, json.dumps(json_items))
+        except Exception as e:
+            self.stage_error = e
+            self.stop_event.set()
+
+    def report_pipeline_stats(self, encode_stats=None):
+        stage_stats = [stats.to_dict() for stats in self.stage_stats.values()]
+        if encode_stats:
+            stage_stats.append(encode_stats)
+        bottleneck = max(stage_stats, key=lambda stats: stats['utilization'])['stage']
+        LOGGER.info(f"video pipeline stats, task_id: {self.task_id}, bottleneck: {bottleneck}, "
+                    f"stats: {stage_stats}")
+        mapping = {stats['stage']: json.dumps(stats) for stats in stage_stats}
+        mapping['bottleneck'] = bottleneck
         pipeline = self.redis_client.pipeline()
-        pipeline.rpush(self.log_key, log_str)
-        pipeline.expire(self.log_key, timedelta(days=1))
+        pipeline.hset(self.stats_key, mapping=mapping)
+        pipeline.expire(self.stats_key, timedelta(days=1))
         pipeline.execute()
+
+    def log(self, log_str):
+        self.progress_publisher.log(log_str)